@@ -0,0 +1,16 @@
+"""
+Celery application for the app project.
+
+Workers are started with `celery -A app worker`; task modules are discovered
+from every installed app's tasks.py. Periodic tasks (CELERY_BEAT_SCHEDULE in
+settings) need `celery -A app beat` running as well.
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+app = Celery('app')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
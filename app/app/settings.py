@@ -167,6 +167,80 @@ LOGIN_REDIRECT_URL = '/'      # Where to redirect after successful login (e.g.,
 # LOGIN_REDIRECT_URL = 'inventory:inventory_batch_list_view'
 
 
+# --- Cache ---
+# Shared by every web and Celery process: the product-matching versions and the
+# courier token leases only work if all workers see the same cache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CACHE_URL', 'redis://localhost:6379/1'),
+    }
+}
+
+
+# --- Celery (background jobs) ---
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_TIMEZONE = TIME_ZONE
+# Redeliver a task whose worker died mid-run; long-running tasks are written to be idempotent.
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Run tasks inline (no broker/worker needed), e.g. for local development.
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+# Periodic tasks, run by `celery -A app beat`.
+TRACKING_REFRESH_INTERVAL_SECONDS = int(os.environ.get('TRACKING_REFRESH_INTERVAL_SECONDS', '300'))
+CELERY_BEAT_SCHEDULE = {
+    'refresh-parcel-tracking': {
+        'task': 'operation.tasks.refresh_parcel_tracking',
+        'schedule': TRACKING_REFRESH_INTERVAL_SECONDS,
+        # A run that could not start before the next one is due is dropped.
+        'options': {'expires': TRACKING_REFRESH_INTERVAL_SECONDS},
+    },
+    'flag-tracking-sla-breaches': {
+        'task': 'operation.tasks.flag_tracking_sla_breaches',
+        'schedule': 60 * 60,
+    },
+}
+
+
+# --- Tracking refresh (operation/tracking_refresh.py) ---
+TRACKING_REFRESH_WORKERS = int(os.environ.get('TRACKING_REFRESH_WORKERS', '8'))
+TRACKING_REFRESH_BATCH_SIZE = int(os.environ.get('TRACKING_REFRESH_BATCH_SIZE', '500'))
+# Must stay below the interval so runs do not overlap.
+TRACKING_REFRESH_MAX_SECONDS = int(os.environ.get('TRACKING_REFRESH_MAX_SECONDS', '240'))
+# (requests per second, burst) allowed per courier API.
+TRACKING_RATE_LIMITS = {
+    'dhl': (4, 4),
+    'fedex': (5, 5),
+    'ups': (5, 5),
+}
+# Seconds until a parcel is polled again, by tracking phase (operation.tracking_refresh.poll_phase).
+TRACKING_POLL_INTERVALS = {
+    'out_for_delivery': 60 * 60,
+    'exception': 2 * 60 * 60,
+    'moving': 4 * 60 * 60,
+    'slow': 12 * 60 * 60,
+    'idle': 24 * 60 * 60,
+    'awaiting_pickup': 6 * 60 * 60,
+    'failed': 60 * 60,
+}
+# Transit SLA for couriers without CourierCompany.transit_sla_days.
+TRACKING_DEFAULT_TRANSIT_SLA_DAYS = int(os.environ.get('TRACKING_DEFAULT_TRANSIT_SLA_DAYS', '7'))
+TRACKING_DELIVERY_FAILED_DAYS = int(os.environ.get('TRACKING_DELIVERY_FAILED_DAYS', '20'))
+
+# --- Courier API clients (operation/courier_http.py) ---
+# Kept-alive connections per courier; enough for every refresh worker.
+COURIER_HTTP_POOL_SIZE = TRACKING_REFRESH_WORKERS
+COURIER_HTTP_MAX_RETRIES = int(os.environ.get('COURIER_HTTP_MAX_RETRIES', '2'))
+# Consecutive failed calls that open a courier's circuit breaker, and how long it stays open.
+COURIER_BREAKER_FAILURES = int(os.environ.get('COURIER_BREAKER_FAILURES', '5'))
+COURIER_BREAKER_RESET_SECONDS = int(os.environ.get('COURIER_BREAKER_RESET_SECONDS', '30'))
+
+
+# --- Packing ---
+# Longest (ms) a pack waits for stock rows locked by another packer before failing with "try again".
+PACKING_LOCK_TIMEOUT_MS = int(os.environ.get('PACKING_LOCK_TIMEOUT_MS', '5000'))
+
+
 # REST_FRAMEWORK = {
 #     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema'
 # }
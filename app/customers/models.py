@@ -44,9 +44,13 @@ class Customer(models.Model):
             return f"{self.company_name} ({self.customer_name})"
         return self.customer_name
 
+    @staticmethod
+    def generate_customer_id():
+        # A simple way to generate an ID: CUST + 6 random hex chars
+        return f"CUST-{''.join(uuid.uuid4().hex.upper().split('-'))[:6]}"
+
     def save(self, *args, **kwargs):
         # Generate a unique customer_id if one doesn't exist
         if not self.customer_id:
-            # A simple way to generate an ID: CUST + 6 random hex chars
-            self.customer_id = f"CUST-{''.join(uuid.uuid4().hex.upper().split('-'))[:6]}"
+            self.customer_id = self.generate_customer_id()
         super().save(*args, **kwargs)
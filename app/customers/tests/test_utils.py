@@ -0,0 +1,76 @@
+'''
+Tests for the customer import helpers.
+'''
+from django.test import TestCase
+
+from customers.models import Customer
+from customers.utils import customer_import_keys, resolve_customers_from_import
+
+
+def make_record(name, phone=None, email=None, zip_code=''):
+    '''Return a resolver record as built by the order importer.'''
+    return {
+        'customer_name': name,
+        'company_name': '-',
+        'phone_number': phone,
+        'email': email,
+        'address_info': {'zip_code': zip_code},
+        'vat_number': None,
+    }
+
+
+def identity_key(record):
+    return customer_import_keys(
+        record['customer_name'], record['phone_number'], record['email'], record['address_info']['zip_code'],
+    )[0]
+
+
+class ResolveCustomersFromImportTests(TestCase):
+    '''Test bulk customer resolution for imports'''
+
+    def setUp(self):
+        self.by_phone = Customer.objects.create(customer_name='Jane Doe', phone_number='60123456789')
+        self.by_email = Customer.objects.create(customer_name='John Roe', email='john@example.com')
+        self.by_zip = Customer.objects.create(customer_name='Ann Lee', zip_code='50450')
+
+    def test_matches_existing_customers_by_each_key(self):
+        '''test phone, email and name + zip keys find existing customers'''
+        records = [
+            make_record('Someone Else', phone='+60 12-345 6789'),
+            make_record('John', email='JOHN@example.com'),
+            make_record('ann lee', zip_code='50450'),
+        ]
+
+        customers = resolve_customers_from_import(records)
+
+        self.assertEqual([customers[identity_key(r)] for r in records], [self.by_phone, self.by_email, self.by_zip])
+        self.assertEqual(Customer.objects.count(), 3)
+
+    def test_creates_missing_customers_once_with_ids(self):
+        '''test new customers are bulk-created once per key and get a customer_id'''
+        records = [
+            make_record('New One', phone='60199999999', zip_code='10000'),
+            make_record('New One', phone='60199999999'),
+            make_record('New One', zip_code='10000'),
+            make_record('Another', email='another@example.com'),
+        ]
+
+        with self.assertNumQueries(5):
+            customers = resolve_customers_from_import(records)
+
+        new_one = customers[identity_key(records[0])]
+        self.assertEqual(customers[identity_key(records[2])], new_one)
+        self.assertTrue(new_one.pk and new_one.customer_id.startswith('CUST-'))
+        self.assertEqual(Customer.objects.count(), 5)
+
+    def test_query_count_independent_of_record_count(self):
+        '''test resolving many customers does not issue per-record queries'''
+        small = [make_record(f'Small {i}', phone=f'6010000{i:04d}') for i in range(5)]
+        large = [make_record(f'Large {i}', phone=f'6020000{i:04d}') for i in range(50)]
+
+        with self.assertNumQueries(5):
+            resolve_customers_from_import(small)
+        with self.assertNumQueries(5):
+            customers = resolve_customers_from_import(large)
+
+        self.assertEqual(len(customers), 50)
@@ -1,21 +1,33 @@
 # app/customers/utils.py
 
 from .models import Customer
+from django.db import transaction, IntegrityError
 from django.db.models import Q
+from django.db.models.functions import Lower
+import logging
 import re
 
+logger = logging.getLogger(__name__)
+
 def normalize_phone(phone_number):
     """Strips all non-digit characters from a phone number."""
     if not phone_number:
         return None
     return re.sub(r'\D', '', str(phone_number))
 
+def normalize_email(email):
+    """Lower-cases and strips an email address; returns None for blanks."""
+    if not email:
+        return None
+    return str(email).strip().lower() or None
+
 def get_or_create_customer_from_import(
     customer_name,
     company_name=None,
     phone_number=None,
     address_info=None,
-    vat_number=None
+    vat_number=None,
+    email=None
 ):
     """
     Finds an existing customer based on the provided details or creates a new one.
@@ -27,6 +39,7 @@ def get_or_create_customer_from_import(
         phone_number (str, optional): The customer's phone number.
         address_info (dict, optional): A dict with address fields.
         vat_number (str, optional): The customer's VAT number.
+        email (str, optional): The customer's email address.
 
     Returns:
         tuple: (Customer object, created_boolean)
@@ -45,6 +58,13 @@ def get_or_create_customer_from_import(
         except Customer.DoesNotExist:
             pass # Not found, proceed to next check
 
+    # --- Attempt 1b: Match by unique email address ---
+    normalized_email = normalize_email(email)
+    if normalized_email:
+        customer = Customer.objects.filter(email__iexact=normalized_email).first()
+        if customer:
+            return customer, False
+
     # --- Attempt 2: Match by Customer Name and a key address part (e.g., ZIP code) ---
     # This helps differentiate customers with the same name.
     if customer_name and address_info.get('zip_code'):
@@ -70,6 +90,169 @@ def get_or_create_customer_from_import(
         state=address_info.get('state', ''),
         zip_code=address_info.get('zip_code', ''),
         country=address_info.get('country', ''),
-        vat_number=vat_number
+        vat_number=vat_number,
+        email=normalized_email
     )
     return new_customer, True # (customer, created=True)
+
+
+def customer_import_keys(customer_name=None, phone_number=None, email=None, zip_code=None):
+    """
+    Returns the lookup keys of an imported customer, most reliable first:
+    ('phone', ...), ('email', ...) and ('name_zip', (name, zip)). A customer
+    with none of those is identified by ('name', ...) alone.
+
+    The first key is the customer's identity key in the map returned by
+    resolve_customers_from_import.
+    """
+    keys = []
+    normalized_phone = normalize_phone(phone_number)
+    if normalized_phone:
+        keys.append(('phone', normalized_phone))
+    normalized_email = normalize_email(email)
+    if normalized_email:
+        keys.append(('email', normalized_email))
+    name = str(customer_name or '').strip().lower()
+    zip_code = str(zip_code or '').strip().lower()
+    if name and zip_code:
+        keys.append(('name_zip', (name, zip_code)))
+    if not keys and name:
+        keys.append(('name', name))
+    return keys
+
+
+def _record_keys(record):
+    return customer_import_keys(
+        record.get('customer_name'),
+        record.get('phone_number'),
+        record.get('email'),
+        (record.get('address_info') or {}).get('zip_code'),
+    )
+
+
+def _new_customer_from_record(record):
+    address_info = record.get('address_info') or {}
+    return Customer(
+        customer_name=record.get('customer_name') or '',
+        company_name=record.get('company_name'),
+        phone_number=normalize_phone(record.get('phone_number')),
+        email=normalize_email(record.get('email')),
+        address_line1=address_info.get('address_line1', ''),
+        city=address_info.get('city', ''),
+        state=address_info.get('state', ''),
+        zip_code=address_info.get('zip_code', ''),
+        country=address_info.get('country', ''),
+        vat_number=record.get('vat_number'),
+    )
+
+
+def _unused_customer_ids(count):
+    """Generates `count` customer_ids not used by any existing customer (bulk_create skips Customer.save)."""
+    customer_ids = set()
+    while len(customer_ids) < count:
+        candidates = {Customer.generate_customer_id() for _ in range(count - len(customer_ids))} - customer_ids
+        taken = set(Customer.objects.filter(customer_id__in=candidates).values_list('customer_id', flat=True))
+        customer_ids |= candidates - taken
+    return list(customer_ids)
+
+
+def resolve_customers_from_import(records):
+    """
+    Bulk version of get_or_create_customer_from_import for a whole import file.
+
+    Each record is a dict of get_or_create_customer_from_import's keyword
+    arguments (customer_name, company_name, phone_number, email, address_info,
+    vat_number). Records are matched in file order with the same cascade
+    (phone, then email, then a unique name + ZIP code); records without any of
+    those keys match an existing customer by name. Existing customers are
+    loaded with one query and the missing ones are bulk-created, so the number
+    of queries does not depend on the number of records.
+
+    Returns:
+        dict: {identity key: Customer}, where the identity key of a record is
+        the first of its customer_import_keys(). Records with no keys at all
+        are left out.
+    """
+    records = [(record, _record_keys(record)) for record in records]
+    records = [(record, keys) for record, keys in records if keys]
+    if not records:
+        return {}
+
+    phones, emails, names, name_zips = set(), set(), set(), set()
+    for _, keys in records:
+        for kind, value in keys:
+            if kind == 'phone':
+                phones.add(value)
+            elif kind == 'email':
+                emails.add(value)
+            elif kind == 'name_zip':
+                name_zips.add(value)
+            else:
+                names.add(value)
+
+    query = Q()
+    if phones:
+        query |= Q(phone_number__in=phones)
+    if emails:
+        query |= Q(email_lower__in=emails)
+    if name_zips:
+        query |= Q(name_lower__in={name for name, _ in name_zips}, zip_lower__in={zip_code for _, zip_code in name_zips})
+    if names:
+        query |= Q(name_lower__in=names)
+    existing = (
+        Customer.objects
+        .alias(email_lower=Lower('email'), name_lower=Lower('customer_name'), zip_lower=Lower('zip_code'))
+        .filter(query)
+        .order_by('pk')
+    )
+
+    # key -> Customer, or AMBIGUOUS when several customers share a name + ZIP code.
+    ambiguous = object()
+    index = {}
+
+    def register(customer):
+        for key in customer_import_keys(customer.customer_name, customer.phone_number, customer.email, customer.zip_code):
+            if key[0] == 'name_zip' and index.get(key, customer) is not customer:
+                index[key] = ambiguous
+            else:
+                index.setdefault(key, customer)
+        name_key = ('name', str(customer.customer_name or '').strip().lower())
+        index.setdefault(name_key, customer)
+
+    for customer in existing:
+        register(customer)
+
+    resolved, new_customers = {}, []
+    for record, keys in records:
+        if keys[0] in resolved:
+            continue
+        customer = next((index[key] for key in keys if index.get(key, ambiguous) is not ambiguous), None)
+        if customer is None:
+            customer = _new_customer_from_record(record)
+            new_customers.append((customer, record))
+            register(customer)
+        resolved[keys[0]] = customer
+
+    if new_customers:
+        for (customer, _), customer_id in zip(new_customers, _unused_customer_ids(len(new_customers))):
+            customer.customer_id = customer_id
+        try:
+            with transaction.atomic():
+                Customer.objects.bulk_create([customer for customer, _ in new_customers])
+        except IntegrityError as e:
+            # Another import created one of these customers meanwhile; fall back to one-by-one.
+            logger.warning(f"Bulk customer creation failed ({e}); resolving {len(new_customers)} customers one by one.")
+            fallback = {}
+            for customer, record in new_customers:
+                try:
+                    with transaction.atomic():
+                        fallback[id(customer)], _ = get_or_create_customer_from_import(**record)
+                except IntegrityError as record_error:
+                    logger.error(f"Could not create customer '{record.get('customer_name')}': {record_error}")
+            resolved = {
+                key: fallback.get(id(customer)) if customer.pk is None else customer
+                for key, customer in resolved.items()
+            }
+            resolved = {key: customer for key, customer in resolved.items() if customer is not None}
+
+    return resolved
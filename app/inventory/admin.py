@@ -17,7 +17,8 @@ from .models import (
     Product, Supplier, StockTransaction, InventoryBatchItem,
     StockTakeSession, StockTakeItem,
      ErpStockCheckSession, ErpStockCheckItem, WarehouseProductDiscrepancy, # New Stock Take Models
-     PackagingMaterial, WarehousePackagingMaterial, PackagingStockTransaction
+     PackagingMaterial, WarehousePackagingMaterial, PackagingStockTransaction,
+     StockReservation
 )
 from warehouse.models import Warehouse, WarehouseProduct # Import WarehouseProduct
 from .models import StockDiscrepancy
@@ -723,3 +724,19 @@ class PackagingStockTransactionAdmin(admin.ModelAdmin):
         'recorded_by__email'
     )
 
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    """
+    Read-only view of the stock held for unpacked order items.
+    Reservations are maintained by inventory/reservations.py.
+    """
+    list_display = ('order_item', 'warehouse_product', 'batch_item', 'quantity', 'updated_at')
+    list_select_related = ('order_item__order', 'order_item__product', 'warehouse_product__product', 'warehouse_product__warehouse', 'batch_item')
+    list_filter = ('warehouse_product__warehouse',)
+    search_fields = ('order_item__order__erp_order_id', 'warehouse_product__product__sku')
+    readonly_fields = ('order_item', 'warehouse_product', 'batch_item', 'quantity', 'created_at', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,190 @@
+# app/inventory/allocation.py
+"""
+Wave allocation: assigns batches to the open items of many orders at once.
+
+allocate_wave loads everything it needs up front, with a fixed number of
+queries however many orders are in the wave:
+
+- the open order items, locked, and served oldest order first;
+- the warehouse products involved, locked as reserve_order_items locks them;
+- what other order items already hold, per warehouse product and per batch;
+- every pickable batch (inventory.services.available_batches_by_warehouse_product).
+
+Each SKU then gets a heap of its batches keyed by pick priority (default,
+secondary, none), then expiry (FEFO), then date received. Items take stock from
+the top of their SKU's heap, splitting across batches when one runs out. Stock
+is therefore used in strict FEFO order across the whole wave, not per order.
+An item is never given more than its warehouse product's available to promise.
+
+The results are written with bulk statements. An item gets one
+StockReservation per batch it was given, so later waves see exactly what is
+held in each batch, and its suggested batch is the first of them. The
+function returns the per-item allocations, the shortages and a consolidated
+pick plan: one line per batch with the total to pick and the order items it
+goes to, in location order.
+"""
+import heapq
+import logging
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import StockReservation
+from .reservations import _outstanding_quantity, lock_warehouse_products, reserved_quantities
+from .services import available_batches_by_warehouse_product
+
+logger = logging.getLogger(__name__)
+
+# Order items written per UPDATE statement.
+ALLOCATION_UPDATE_BATCH_SIZE = 1000
+
+
+def _pick_key(batch):
+    # Same order as available_batches_by_warehouse_product: priority and expiry with nulls last.
+    return (
+        batch.pick_priority is None, batch.pick_priority or 0,
+        batch.expiry_date is None, batch.expiry_date or batch.date_received,
+        batch.date_received, batch.pk,
+    )
+
+
+def _batch_reservations_of_others(warehouse_product_ids, order_items):
+    return dict(
+        StockReservation.objects
+        .filter(batch_item__warehouse_product__in=warehouse_product_ids, quantity__gt=0)
+        .exclude(order_item__in=order_items)
+        .values('batch_item').annotate(total=Sum('quantity')).values_list('batch_item', 'total')
+    )
+
+
+def _pick_plan(allocations, batches):
+    lines = {}
+    for order_item_id, picks in allocations.items():
+        for batch_id, quantity in picks:
+            line = lines.setdefault(batch_id, {'batch': batches[batch_id], 'quantity': 0, 'order_items': []})
+            line['quantity'] += quantity
+            line['order_items'].append((order_item_id, quantity))
+    return sorted(
+        lines.values(),
+        key=lambda line: (line['batch'].location_label or '', line['batch'].warehouse_product_id, line['batch'].pk),
+    )
+
+
+@transaction.atomic
+def allocate_wave(orders):
+    """
+    Allocates batches to every open item of `orders` (a queryset, or a list of
+    orders or order ids).
+
+    Returns:
+        dict: 'allocations' {order_item_id: [(batch_id, quantity), ...]},
+        'shortages' {order_item_id: quantity that could not be allocated} and
+        'pick_plan', a list of {'batch', 'quantity', 'order_items'} dicts in
+        pick order.
+    """
+    from operation.models import OrderItem
+
+    # Lock the items in pk order before the warehouse products, as packing does, then serve oldest orders first.
+    order_items = sorted(
+        OrderItem.objects
+        .select_for_update(of=('self',))
+        .filter(order__in=orders, status='PENDING_PROCESSING', warehouse_product__isnull=False)
+        .select_related('order')
+        .order_by('pk'),
+        key=lambda item: (item.order.order_date, item.order_id, item.pk),
+    )
+    needed = {item.pk: _outstanding_quantity(item) for item in order_items}
+    order_items = [item for item in order_items if needed[item.pk] > 0]
+    if not order_items:
+        return {'allocations': {}, 'shortages': {}, 'pick_plan': []}
+
+    warehouse_products = lock_warehouse_products({item.warehouse_product_id for item in order_items})
+    reserved_by_others = reserved_quantities(warehouse_products, exclude_order_items=order_items)
+    promisable = {
+        pk: warehouse_product.quantity - reserved_by_others.get(pk, 0)
+        for pk, warehouse_product in warehouse_products.items()
+    }
+    held_in_batch = _batch_reservations_of_others(warehouse_products, order_items)
+
+    batches, heaps, remaining = {}, {}, {}
+    for warehouse_product_id, wp_batches in available_batches_by_warehouse_product(warehouse_products).items():
+        heap = []
+        for batch in wp_batches:
+            free = batch.quantity - held_in_batch.get(batch.pk, 0)
+            if free > 0:
+                batches[batch.pk] = batch
+                remaining[batch.pk] = free
+                heap.append((_pick_key(batch), batch.pk))
+        heapq.heapify(heap)
+        heaps[warehouse_product_id] = heap
+
+    allocations, shortages = {}, {}
+    for item in order_items:
+        heap = heaps.get(item.warehouse_product_id, [])
+        wanted = min(needed[item.pk], max(promisable[item.warehouse_product_id], 0))
+        picks = []
+        while wanted and heap:
+            batch_id = heap[0][1]
+            quantity = min(wanted, remaining[batch_id])
+            picks.append((batch_id, quantity))
+            remaining[batch_id] -= quantity
+            wanted -= quantity
+            if not remaining[batch_id]:
+                heapq.heappop(heap)
+        allocated = sum(quantity for _, quantity in picks)
+        promisable[item.warehouse_product_id] -= allocated
+        allocations[item.pk] = picks
+        if allocated < needed[item.pk]:
+            shortages[item.pk] = needed[item.pk] - allocated
+
+    _save_allocations(order_items, allocations, batches)
+    if shortages:
+        logger.info(f"[Allocation] {len(shortages)} of {len(order_items)} order items could not be fully allocated.")
+    return {'allocations': allocations, 'shortages': shortages, 'pick_plan': _pick_plan(allocations, batches)}
+
+
+def _save_allocations(order_items, allocations, batches):
+    from operation.models import OrderItem
+
+    existing = {
+        (reservation.order_item_id, reservation.batch_item_id): reservation
+        for reservation in StockReservation.objects.filter(order_item__in=order_items)
+    }
+    now = timezone.now()
+    to_create, to_update = [], []
+    for item in order_items:
+        picks = allocations[item.pk]
+        first_batch = batches[picks[0][0]] if picks else None
+        item.suggested_batch_item = first_batch
+        item.suggested_batch_number_display = first_batch.batch_number if first_batch else None
+        item.suggested_batch_expiry_date_display = first_batch.expiry_date if first_batch else None
+
+        for batch_id, quantity in picks:
+            reservation = existing.pop((item.pk, batch_id), None)
+            if reservation:
+                reservation.quantity = quantity
+                reservation.updated_at = now
+                to_update.append(reservation)
+            else:
+                to_create.append(StockReservation(
+                    order_item=item, warehouse_product_id=item.warehouse_product_id,
+                    batch_item=batches[batch_id], quantity=quantity,
+                ))
+
+    # What the items held outside this allocation is released.
+    for reservation in existing.values():
+        if reservation.quantity:
+            reservation.quantity = 0
+            reservation.updated_at = now
+            to_update.append(reservation)
+
+    StockReservation.objects.bulk_create(to_create, batch_size=ALLOCATION_UPDATE_BATCH_SIZE)
+    StockReservation.objects.bulk_update(
+        to_update, ['quantity', 'updated_at'], batch_size=ALLOCATION_UPDATE_BATCH_SIZE,
+    )
+    OrderItem.objects.bulk_update(
+        order_items,
+        ['suggested_batch_item', 'suggested_batch_number_display', 'suggested_batch_expiry_date_display'],
+        batch_size=ALLOCATION_UPDATE_BATCH_SIZE,
+    )
@@ -0,0 +1,110 @@
+import datetime
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from inventory.allocation import allocate_wave
+from inventory.models import Product, InventoryBatchItem
+from inventory.services import get_suggested_batch_for_order_item
+from warehouse.models import Warehouse, WarehouseProduct
+from operation.models import Order, OrderItem
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    '''Benchmarks wave allocation against per-item batch lookups.'''
+
+    help = (
+        "Creates synthetic orders and batches, then times allocate_wave over all of them "
+        "and a per-item get_suggested_batch_for_order_item loop over the same lines. "
+        "Reports seconds and query counts. All data is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', nargs='+', type=int, default=[1000, 10000],
+                            help='Number of order lines per run.')
+        parser.add_argument('--lines-per-order', type=int, default=5)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--batches-per-product', type=int, default=4)
+
+    def _build(self, lines, options, run_tag):
+        warehouse = Warehouse.objects.create(name=f"Bench Warehouse {run_tag}")
+        products = Product.objects.bulk_create([
+            Product(sku=f"BENCH-{run_tag}-{i}", name=f"Bench Product {run_tag} {i}", price=1)
+            for i in range(options['products'])
+        ])
+        per_batch = max(1, lines * 3 // (options['products'] * options['batches_per_product']))
+        warehouse_products = WarehouseProduct.objects.bulk_create([
+            WarehouseProduct(
+                warehouse=warehouse, product=product,
+                quantity=per_batch * options['batches_per_product'],
+                batched_quantity=per_batch * options['batches_per_product'],
+            )
+            for product in products
+        ])
+        today = timezone.localdate()
+        InventoryBatchItem.objects.bulk_create([
+            InventoryBatchItem(
+                warehouse_product=warehouse_product, batch_number=f"B{b}", location_label=f"L{i % 40}",
+                quantity=per_batch, expiry_date=today + datetime.timedelta(days=30 * (b + 1)),
+            )
+            for i, warehouse_product in enumerate(warehouse_products)
+            for b in range(options['batches_per_product'])
+        ])
+        orders = Order.objects.bulk_create([
+            Order(erp_order_id=f"BENCH-{run_tag}-{o}", order_date=today, warehouse=warehouse)
+            for o in range(-(-lines // options['lines_per_order']))
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=orders[line // options['lines_per_order']],
+                product=warehouse_products[line % len(warehouse_products)].product,
+                warehouse_product=warehouse_products[line % len(warehouse_products)],
+                quantity_ordered=1 + line % 3,
+            )
+            for line in range(lines)
+        ])
+        return orders
+
+    def handle(self, *args, **options):
+        '''Entry point for command.'''
+        self.stdout.write(
+            f"{'lines':>8} {'per-item s':>11} {'per-item queries':>17} "
+            f"{'wave s':>8} {'wave queries':>13} {'pick lines':>11} {'short':>6}"
+        )
+
+        for lines in options['lines']:
+            run_tag = uuid.uuid4().hex[:6]
+            try:
+                with transaction.atomic():
+                    orders = self._build(lines, options, run_tag)
+                    order_items = list(OrderItem.objects.filter(order__in=orders).select_related('warehouse_product'))
+
+                    with CaptureQueriesContext(connection) as legacy_queries:
+                        started = time.perf_counter()
+                        for item in order_items:
+                            get_suggested_batch_for_order_item(item, item.quantity_ordered)
+                        legacy_elapsed = time.perf_counter() - started
+
+                    with CaptureQueriesContext(connection) as wave_queries:
+                        started = time.perf_counter()
+                        result = allocate_wave(orders)
+                        wave_elapsed = time.perf_counter() - started
+
+                    self.stdout.write(
+                        f"{lines:>8} {legacy_elapsed:>11.3f} {len(legacy_queries):>17} "
+                        f"{wave_elapsed:>8.3f} {len(wave_queries):>13} "
+                        f"{len(result['pick_plan']):>11} {len(result['shortages']):>6}"
+                    )
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished; all benchmark data was rolled back.'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from inventory.stock_ledger import reconcile_batched_quantities
+from warehouse.models import WarehouseProduct
+
+
+class Command(BaseCommand):
+    '''Finds and fixes drift between batch quantities and warehouse product totals.'''
+
+    help = (
+        "Recomputes every warehouse product's batched_quantity from its batches in one "
+        "set-based statement and corrects the ones that drifted. Also reports products "
+        "whose on-hand quantity is below their batched stock, which needs a stock take "
+        "rather than an automatic fix."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without correcting it.')
+        parser.add_argument('--show', type=int, default=20, help='Number of drifted products to list.')
+
+    def handle(self, *args, **options):
+        '''Entry point for command.'''
+        drifted = reconcile_batched_quantities(dry_run=options['dry_run'])
+
+        for warehouse_product_id, recorded, actual in drifted[:options['show']]:
+            self.stdout.write(f"  WarehouseProduct {warehouse_product_id}: recorded {recorded}, batches hold {actual}")
+        if len(drifted) > options['show']:
+            self.stdout.write(f"  ... and {len(drifted) - options['show']} more")
+
+        overdrawn = WarehouseProduct.objects.filter(quantity__lt=F('batched_quantity')).count()
+        if overdrawn:
+            self.stdout.write(self.style.WARNING(
+                f"{overdrawn} warehouse products hold less on hand than in their batches."
+            ))
+
+        verb = 'drifted' if options['dry_run'] else 'corrected'
+        self.stdout.write(self.style.SUCCESS(f"{len(drifted)} warehouse products {verb}."))
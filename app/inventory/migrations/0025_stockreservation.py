@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-16 21:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0015_warehouseproduct_selling_price'),
+        ('operation', '0054_parcel_code_sequence'),
+        ('inventory', '0024_alter_packagingstocktransaction_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=0, help_text='Quantity still held for the order item.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('batch_item', models.ForeignKey(blank=True, help_text='The batch the stock is held in, once one has been allocated.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_reservations', to='inventory.inventorybatchitem')),
+                ('order_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservation', to='operation.orderitem')),
+                ('warehouse_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='warehouse.warehouseproduct')),
+            ],
+            options={
+                'verbose_name': 'Stock Reservation',
+                'verbose_name_plural': 'Stock Reservations',
+                'indexes': [models.Index(condition=models.Q(('quantity__gt', 0)), fields=['warehouse_product'], name='stockreservation_open_wp_idx')],
+            },
+        ),
+    ]
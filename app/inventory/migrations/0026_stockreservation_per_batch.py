@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operation', '0057_parcel_latest_tracking_event'),
+        ('inventory', '0025_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockreservation',
+            name='order_item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='operation.orderitem'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockreservation',
+            constraint=models.UniqueConstraint(fields=('order_item', 'batch_item'), name='stockreservation_item_batch_uniq'),
+        ),
+    ]
@@ -6,6 +6,7 @@ from django.db.models import UniqueConstraint, Q, F
 from django.core.exceptions import ValidationError
 
 from warehouse.models import Warehouse, WarehouseProduct
+from .stock_ledger import adjust_batched_quantities
 
 class Supplier(models.Model):
     name = models.CharField(max_length=100, null=True)
@@ -105,16 +106,42 @@ class InventoryBatchItem(models.Model):
             priority_display = " (Secondary Pick)"
         return f"{wp_display} - Batch: {batch_display}{location_display} (Qty: {self.quantity}){priority_display}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the row held when loaded, so save() can apply the stock delta without re-reading it.
+        instance._loaded_stock = (instance.__dict__.get('warehouse_product_id'), instance.__dict__.get('quantity'))
+        return instance
+
     def save(self, *args, **kwargs):
         if self.location_label == '':
             self.location_label = None
-        if self.pick_priority is not None and self.pick_priority in [0, 1]:
-            with db_transaction.atomic():
+        update_fields = kwargs.get('update_fields')
+        tracks_stock = update_fields is None or bool({'quantity', 'warehouse_product'} & set(update_fields))
+        with db_transaction.atomic():
+            if self.pick_priority is not None and self.pick_priority in [0, 1]:
                 InventoryBatchItem.objects.filter(
                     warehouse_product=self.warehouse_product,
                     pick_priority=self.pick_priority
                 ).exclude(pk=self.pk).update(pick_priority=None)
-        super().save(*args, **kwargs)
+            previous = None
+            if tracks_stock and not self._state.adding:
+                previous = getattr(self, '_loaded_stock', None) or InventoryBatchItem.objects.filter(
+                    pk=self.pk
+                ).values_list('warehouse_product_id', 'quantity').first()
+            super().save(*args, **kwargs)
+            if tracks_stock:
+                self._apply_stock_delta(previous)
+
+    def _apply_stock_delta(self, previous):
+        if hasattr(self.quantity, 'resolve_expression'):  # e.g. saved with F('quantity') + n
+            self.refresh_from_db(fields=['quantity'])
+        deltas = {}
+        if previous:
+            deltas[previous[0]] = -previous[1]
+        deltas[self.warehouse_product_id] = deltas.get(self.warehouse_product_id, 0) + self.quantity
+        adjust_batched_quantities(deltas)
+        self._loaded_stock = (self.warehouse_product_id, self.quantity)
 
     @property
     def expiry_status_display(self):
@@ -448,37 +475,13 @@ class WarehouseProductDiscrepancy(models.Model):
 
 def process_order_allocation(order_instance):
     """
-    Processes an order to suggest batch items for its order items.
-    This function should be called after an order and its items are created/updated.
+    Allocates batches to the open items of one order. A wave of one; see
+    inventory.allocation.allocate_wave.
     """
     # MOVE THE IMPORT HERE:
-    from .services import get_suggested_batch_for_order_item
-
-    for item in order_instance.items.filter(status='PENDING_ALLOCATION'):
-        quantity_to_allocate = item.quantity_ordered - item.quantity_allocated
-        if quantity_to_allocate <= 0:
-            if item.quantity_ordered == item.quantity_allocated and item.status == 'PENDING_ALLOCATION':
-                item.status = 'ALLOCATED'
-                item.suggested_batch_item = None
-                item.suggested_batch_number_display = None
-                item.suggested_batch_expiry_date_display = None
-                item.save(update_fields=['status', 'suggested_batch_item', 'suggested_batch_number_display', 'suggested_batch_expiry_date_display'])
-            continue
-
-        suggested_batch = get_suggested_batch_for_order_item(item, quantity_to_allocate)
-
-        if suggested_batch:
-            item.suggested_batch_item = suggested_batch
-            item.suggested_batch_number_display = suggested_batch.batch_number
-            item.suggested_batch_expiry_date_display = suggested_batch.expiry_date
-            item.status = 'ALLOCATED'
-            item.save(update_fields=['suggested_batch_item', 'suggested_batch_number_display', 'suggested_batch_expiry_date_display', 'status'])
-        else:
-            item.status = 'ALLOCATION_FAILED'
-            item.suggested_batch_item = None
-            item.suggested_batch_number_display = "N/A" # Or None, depending on desired display
-            item.suggested_batch_expiry_date_display = None
-            item.save(update_fields=['status', 'suggested_batch_item', 'suggested_batch_number_display', 'suggested_batch_expiry_date_display'])
+    from .allocation import allocate_wave
+
+    return allocate_wave([order_instance])
 
 class PackagingMaterial(models.Model):
     """
@@ -572,3 +575,46 @@ class PackagingStockTransaction(models.Model):
         verbose_name = "Packaging Stock Transaction"
         verbose_name_plural = "Packaging Stock Transactions"
         ordering = ['-transaction_date']
+
+
+class StockReservation(models.Model):
+    """
+    Stock promised to an order item that has not been packed yet. Reservations
+    are held against a WarehouseProduct and, once a batch has been chosen, the
+    InventoryBatchItem too; an item allocated across several batches has one
+    reservation per batch. `quantity` is the amount still held; it drops as
+    the order item is packed. See inventory/reservations.py.
+    """
+    order_item = models.ForeignKey(
+        'operation.OrderItem',
+        on_delete=models.CASCADE,
+        related_name='stock_reservations'
+    )
+    warehouse_product = models.ForeignKey(
+        WarehouseProduct,
+        on_delete=models.CASCADE,
+        related_name='stock_reservations'
+    )
+    batch_item = models.ForeignKey(
+        InventoryBatchItem,
+        on_delete=models.SET_NULL,
+        null=True, blank=True,
+        related_name='stock_reservations',
+        help_text="The batch the stock is held in, once one has been allocated."
+    )
+    quantity = models.PositiveIntegerField(default=0, help_text="Quantity still held for the order item.")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.quantity} reserved of {self.warehouse_product} for order item {self.order_item_id}"
+
+    class Meta:
+        verbose_name = "Stock Reservation"
+        verbose_name_plural = "Stock Reservations"
+        indexes = [
+            models.Index(fields=['warehouse_product'], name='stockreservation_open_wp_idx', condition=Q(quantity__gt=0)),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['order_item', 'batch_item'], name='stockreservation_item_batch_uniq'),
+        ]
@@ -0,0 +1,201 @@
+# app/inventory/reservations.py
+"""
+Stock reservations and available-to-promise (ATP).
+
+StockReservations hold stock for an order item from the moment the order is
+imported (or allocated) until it is packed, one per batch the stock is held in.
+Available to promise is the warehouse product's on-hand quantity minus every
+open reservation against it.
+
+All writers lock the WarehouseProduct rows involved with SELECT ... FOR UPDATE,
+always in primary-key order, before reading the reserved totals. Two imports,
+or an import and a packer, therefore cannot both promise the same units.
+Packing takes those same locks (operation.packing.pack_order), refuses to dip
+into stock reserved for other orders, and consumes the packed order items'
+own reservations.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from warehouse.models import WarehouseProduct
+from .models import StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+def annotate_available_to_promise(queryset):
+    """
+    Annotates a WarehouseProduct queryset with `reserved_quantity` and
+    `available_to_promise`.
+    """
+    reserved = (
+        StockReservation.objects
+        .filter(warehouse_product=OuterRef('pk'), quantity__gt=0)
+        .values('warehouse_product')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    return queryset.annotate(
+        reserved_quantity=Coalesce(Subquery(reserved, output_field=IntegerField()), Value(0)),
+    ).annotate(
+        available_to_promise=F('quantity') - F('reserved_quantity'),
+    )
+
+
+def available_to_promise(warehouse_product_ids):
+    """
+    Returns:
+        dict: {warehouse_product_id: available_to_promise}, from one query.
+    """
+    return dict(
+        annotate_available_to_promise(WarehouseProduct.objects.filter(pk__in=warehouse_product_ids))
+        .values_list('pk', 'available_to_promise')
+    )
+
+
+def reserved_quantities(warehouse_product_ids, exclude_order_items=None):
+    """
+    Returns:
+        dict: {warehouse_product_id: quantity held by open reservations}, leaving
+        out the reservations of `exclude_order_items`.
+    """
+    reservations = StockReservation.objects.filter(warehouse_product__in=warehouse_product_ids, quantity__gt=0)
+    if exclude_order_items is not None:
+        reservations = reservations.exclude(order_item__in=exclude_order_items)
+    return dict(
+        reservations.values('warehouse_product').annotate(total=Sum('quantity')).values_list('warehouse_product', 'total')
+    )
+
+
+def lock_warehouse_products(warehouse_product_ids):
+    """Locks the given WarehouseProduct rows in primary-key order and returns them by pk."""
+    return WarehouseProduct.objects.select_for_update().filter(pk__in=warehouse_product_ids).order_by('pk').in_bulk()
+
+
+def _outstanding_quantity(order_item):
+    removed = order_item.order.get_total_removed_quantity_for_item(order_item.pk)
+    return max(0, order_item.quantity_ordered - order_item.quantity_packed - removed)
+
+
+@transaction.atomic
+def reserve_order_items(order_items):
+    """
+    Brings the reservations of `order_items` in line with what each still needs
+    to have packed (ordered - packed - removed). Missing stock is reserved as
+    far as available to promise allows, first come first served in the order
+    given; reservations larger than the outstanding quantity are trimmed.
+
+    The order items must have their `order` loaded. The number of queries does
+    not depend on the number of items.
+
+    Returns:
+        dict: {order_item_id: quantity that could not be reserved}, for short items.
+    """
+    order_items = [item for item in order_items if item.warehouse_product_id]
+    if not order_items:
+        return {}
+
+    warehouse_products = lock_warehouse_products({item.warehouse_product_id for item in order_items})
+    existing = {}
+    for reservation in StockReservation.objects.filter(order_item__in=order_items).order_by('pk'):
+        existing.setdefault(reservation.order_item_id, []).append(reservation)
+    reserved = reserved_quantities(warehouse_products)
+    available = {
+        pk: warehouse_product.quantity - reserved.get(pk, 0)
+        for pk, warehouse_product in warehouse_products.items()
+    }
+
+    now = timezone.now()
+    to_create, to_update, shortages = [], [], {}
+    for item in order_items:
+        needed = _outstanding_quantity(item)
+        reservations = existing.get(item.pk, [])
+        held = sum(reservation.quantity for reservation in reservations)
+        if needed > held:
+            change = min(needed - held, max(available[item.warehouse_product_id], 0))
+            if change < needed - held:
+                shortages[item.pk] = needed - held - change
+        else:
+            change = needed - held
+        if not change:
+            continue
+        available[item.warehouse_product_id] -= change
+        if change > 0:
+            # More stock is held in the item's suggested batch.
+            reservation = next(
+                (reservation for reservation in reservations if reservation.batch_item_id == item.suggested_batch_item_id),
+                None,
+            )
+            if reservation:
+                reservation.quantity += change
+                reservation.updated_at = now
+                to_update.append(reservation)
+            else:
+                to_create.append(StockReservation(
+                    order_item=item,
+                    warehouse_product_id=item.warehouse_product_id,
+                    batch_item_id=item.suggested_batch_item_id,
+                    quantity=change,
+                ))
+            continue
+        # Trim the newest reservations first.
+        excess = -change
+        for reservation in reversed(reservations):
+            released = min(excess, reservation.quantity)
+            if released:
+                reservation.quantity -= released
+                reservation.updated_at = now
+                to_update.append(reservation)
+                excess -= released
+            if not excess:
+                break
+
+    StockReservation.objects.bulk_create(to_create)
+    StockReservation.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+    if shortages:
+        logger.info(f"[Reservations] {len(shortages)} order items could not be fully reserved: {shortages}")
+    return shortages
+
+
+def consume_reservations(packed_by_item_batch):
+    """
+    Releases what packing used up. `packed_by_item_batch` is
+    {(order_item_id, batch_id): quantity}; each quantity comes out of the order
+    item's reservation in that batch first, then out of its other reservations.
+    Call it with the warehouse products locked, as pack_order does. Takes two
+    queries however many items were packed.
+    """
+    if not packed_by_item_batch:
+        return 0
+    reservations = {}
+    for reservation in StockReservation.objects.filter(
+        order_item__in={order_item_id for order_item_id, _ in packed_by_item_batch}, quantity__gt=0,
+    ).order_by('pk'):
+        reservations.setdefault(reservation.order_item_id, []).append(reservation)
+
+    unreleased = dict(packed_by_item_batch)
+    changed = {}
+    now = timezone.now()
+
+    def release(key, candidates):
+        for reservation in candidates:
+            released = min(unreleased[key], reservation.quantity)
+            if released:
+                reservation.quantity -= released
+                reservation.updated_at = now
+                changed[reservation.pk] = reservation
+                unreleased[key] -= released
+
+    # Every line's own batch first, so no line takes another line's reservation before that line is served.
+    for key in packed_by_item_batch:
+        order_item_id, batch_id = key
+        release(key, [r for r in reservations.get(order_item_id, []) if r.batch_item_id == batch_id])
+    for key in packed_by_item_batch:
+        release(key, reservations.get(key[0], []))
+
+    StockReservation.objects.bulk_update(changed.values(), ['quantity', 'updated_at'])
+    return len(changed)
@@ -6,7 +6,7 @@ import io
 
 
 from django.db import transaction
-from django.db.models import F, Q
+from django.db.models import Case, F, IntegerField, Q, Value, When
 from django.conf import settings
 from django.utils import timezone
 
@@ -14,6 +14,7 @@ import datetime # If working with datetime.max.date
 
 from .models import Product, InventoryBatchItem, StockTransaction, StockTakeSession, StockTakeItem
 from warehouse.models import Warehouse, WarehouseProduct
+from .reservations import lock_warehouse_products, reserved_quantities
 
 
 logger = logging.getLogger(__name__)
@@ -37,87 +38,169 @@ def send_whatsapp_notification(to_number, message):
     except Exception as e:
         print(f"[WHATSAPP ERROR] {e}")
 
-def get_suggested_batch_for_order_item(order_item, quantity_needed: int):
-    logger.debug(f"get_suggested_batch_for_order_item called for OI ID: {order_item.id if order_item else 'None'}, Qty needed: {quantity_needed}")
-    if not hasattr(order_item, 'warehouse_product') or not order_item.warehouse_product:
-        logger.warning(f"OrderItem ID {order_item.id if order_item else 'Unknown'} has no linked warehouse_product. Cannot suggest batch.")
-        return None
-
-    warehouse_product = order_item.warehouse_product
-    today = timezone.now().date()
+def available_batches_by_warehouse_product(warehouse_product_ids):
+    """
+    Loads the pickable batches (in stock, not expired) of several warehouse
+    products with one query.
 
-    available_batches_base_qs = InventoryBatchItem.objects.filter(
-        warehouse_product=warehouse_product,
-        quantity__gte=quantity_needed
+    Returns:
+        dict: {warehouse_product_id: [InventoryBatchItem, ...]}, each list in pick
+        order: default pick, secondary pick, then the rest; FEFO within each.
+    """
+    today = timezone.localdate()
+    batches = InventoryBatchItem.objects.filter(
+        warehouse_product__in=warehouse_product_ids,
+        quantity__gt=0
     ).exclude(
         expiry_date__isnull=False, expiry_date__lt=today
+    ).order_by(
+        F('pick_priority').asc(nulls_last=True),
+        F('expiry_date').asc(nulls_last=True),
+        'date_received',
+        'pk'
     )
+    by_warehouse_product = {}
+    for batch in batches:
+        by_warehouse_product.setdefault(batch.warehouse_product_id, []).append(batch)
+    return by_warehouse_product
+
 
-    default_pick_batch = available_batches_base_qs.filter(
-        pick_priority=0
-    ).order_by(F('expiry_date').asc(nulls_last=True), 'date_received').first()
+def pick_batch(batches, quantity_needed):
+    """The first batch in pick order that can cover `quantity_needed` alone, or None."""
+    return next((batch for batch in batches if batch.quantity >= quantity_needed), None)
 
-    if default_pick_batch:
-        logger.info(f"Found Default Pick Batch ID: {default_pick_batch.id} for OI ID: {order_item.id}")
-        return default_pick_batch
 
-    secondary_pick_batch = available_batches_base_qs.filter(
-        pick_priority=1
-    ).order_by(F('expiry_date').asc(nulls_last=True), 'date_received').first()
+def suggest_batches_for_order_items(quantities_needed):
+    """
+    Suggests a batch for each of several order items from one batch query:
+    the item's allocated batch (OrderItem.suggested_batch_item) if it can still
+    cover the quantity, otherwise the first batch in pick order that can.
 
-    if secondary_pick_batch:
-        logger.info(f"Found Secondary Pick Batch ID: {secondary_pick_batch.id} for OI ID: {order_item.id}")
-        return secondary_pick_batch
+    Args:
+        quantities_needed (dict): {OrderItem: quantity still to pick}.
 
-    general_fefo_batch = available_batches_base_qs.filter(
-        pick_priority__isnull=True
-    ).order_by(F('expiry_date').asc(nulls_last=True), 'date_received').first()
+    Returns:
+        tuple: ({order_item_id: suggested batch or None},
+                {warehouse_product_id: [available batches in pick order]}).
+    """
+    batches_by_wp = available_batches_by_warehouse_product(
+        {item.warehouse_product_id for item in quantities_needed if item.warehouse_product_id}
+    )
+    suggestions = {}
+    for item, quantity_needed in quantities_needed.items():
+        candidates = batches_by_wp.get(item.warehouse_product_id, [])
+        # A batch given to the item by wave allocation is kept while it still covers the item.
+        allocated = [batch for batch in candidates if batch.pk == item.suggested_batch_item_id]
+        suggestions[item.pk] = pick_batch(allocated, quantity_needed) or pick_batch(candidates, quantity_needed)
+        if suggestions[item.pk] is None:
+            logger.warning(f"No suitable batch found for OI ID: {item.pk} needing quantity {quantity_needed}")
+    return suggestions, batches_by_wp
 
-    if general_fefo_batch:
-        logger.info(f"Found General FEFO Batch ID: {general_fefo_batch.id} for OI ID: {order_item.id}")
-        return general_fefo_batch
 
-    logger.warning(f"No suitable batch found for OI ID: {order_item.id} needing quantity {quantity_needed}")
-    return None
+def get_suggested_batch_for_order_item(order_item, quantity_needed: int):
+    if not order_item.warehouse_product_id:
+        logger.warning(f"OrderItem ID {order_item.id if order_item else 'Unknown'} has no linked warehouse_product. Cannot suggest batch.")
+        return None
+    suggestions, _ = suggest_batches_for_order_items({order_item: quantity_needed})
+    return suggestions[order_item.pk]
 
 logger.info("inventory.services.py loaded and function 'get_suggested_batch_for_order_item' is defined.")
 
 
-def deduct_stock(warehouse_product, quantity_to_deduct, user, notes=""):
+
+class StockDeductionError(Exception):
+    """A deduction that cannot be made from the batches available; nothing has been written."""
+
+
+def deduct_stock(warehouse_product, quantity_to_deduct, user, notes="",
+                 transaction_type=StockTransaction.TransactionTypes.STOCK_OUT, related_order=None):
     """
-    Deducts stock for a given warehouse product using FIFO logic based on expiry date.
-    Creates stock transactions for the deductions.
+    Deducts stock for a warehouse product from its unexpired batches, earliest
+    expiry first, splitting the quantity across as many batches as needed.
+
+    The warehouse product is locked first, as every reservation writer locks
+    it (inventory.reservations), and the deduction may not dip into stock
+    reserved for orders. Candidate batches are then locked with SELECT ... FOR
+    UPDATE SKIP LOCKED, so batches a packer is holding are passed over rather
+    than waited for. The batches are updated with one grouped UPDATE, the
+    StockTransactions written with one bulk_create, and the warehouse
+    product's totals moved with one UPDATE.
+
+    Returns:
+        list: (InventoryBatchItem, quantity deducted) pairs, in FEFO order.
+
+    Raises:
+        StockDeductionError: if the unlocked, unexpired batches do not hold
+            enough stock, or the quantity exceeds the warehouse product's
+            available to promise.
     """
+    if quantity_to_deduct <= 0:
+        raise StockDeductionError("Quantity to deduct must be positive.")
+
     with transaction.atomic():
-        batches = InventoryBatchItem.objects.filter(
+        locked_product = lock_warehouse_products([warehouse_product.pk])[warehouse_product.pk]
+        batches = InventoryBatchItem.objects.select_for_update(skip_locked=True).filter(
             warehouse_product=warehouse_product,
             quantity__gt=0
-        ).order_by('expiry_date')
+        ).exclude(
+            expiry_date__isnull=False, expiry_date__lt=timezone.localdate()
+        ).order_by(
+            F('expiry_date').asc(nulls_last=True),
+            'date_received',
+            'pk'
+        )
 
+        deductions = []
         remaining_quantity_to_deduct = quantity_to_deduct
-
         for batch in batches:
             if remaining_quantity_to_deduct <= 0:
                 break
+            quantity_from_batch = min(batch.quantity, remaining_quantity_to_deduct)
+            deductions.append((batch, quantity_from_batch))
+            remaining_quantity_to_deduct -= quantity_from_batch
 
-            quantity_to_deduct_from_batch = min(batch.quantity, remaining_quantity_to_deduct)
-
-            batch.quantity -= quantity_to_deduct_from_batch
-            batch.save()
-
-            StockTransaction.objects.create(
-                inventory_item=batch,
-                transaction_type='DEDUCTION',
-                quantity=quantity_to_deduct_from_batch,
-                user=user,
-                notes=notes
+        if remaining_quantity_to_deduct > 0:
+            # Nothing has been written yet; batches held by other deductions are not counted.
+            raise StockDeductionError(
+                f"Not enough stock for {warehouse_product.product.name}. "
+                f"Cannot deduct {remaining_quantity_to_deduct} more units."
+            )
+        reserved = reserved_quantities([warehouse_product.pk]).get(warehouse_product.pk, 0)
+        if quantity_to_deduct > locked_product.quantity - reserved:
+            raise StockDeductionError(
+                f"Cannot deduct {quantity_to_deduct} of {warehouse_product.product.name}: "
+                f"{reserved} are reserved for orders, so only {max(locked_product.quantity - reserved, 0)} can be used."
             )
 
-            remaining_quantity_to_deduct -= quantity_to_deduct_from_batch
+        InventoryBatchItem.objects.filter(pk__in=[batch.pk for batch, _ in deductions]).update(
+            quantity=F('quantity') - Case(
+                *[When(pk=batch.pk, then=Value(qty)) for batch, qty in deductions],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+        StockTransaction.objects.bulk_create([
+            StockTransaction(
+                warehouse_id=warehouse_product.warehouse_id,
+                warehouse_product=warehouse_product,
+                product_id=warehouse_product.product_id,
+                transaction_type=transaction_type,
+                quantity=-qty,
+                batch_item_involved=batch,
+                reference_note=notes,
+                related_order=related_order,
+                recorded_by=user,
+            )
+            for batch, qty in deductions
+        ])
+        WarehouseProduct.objects.filter(pk=warehouse_product.pk).update(
+            quantity=F('quantity') - quantity_to_deduct,
+            batched_quantity=F('batched_quantity') - quantity_to_deduct,
+        )
 
-        if remaining_quantity_to_deduct > 0:
-            # This check is important to ensure you don't proceed with an order if there's not enough stock.
-            raise Exception(f"Not enough stock for {warehouse_product.product.name}. Cannot deduct {remaining_quantity_to_deduct} more units.")
+    for batch, qty in deductions:
+        batch.quantity -= qty
+    return deductions
 
 
 @transaction.atomic
@@ -1,21 +1,15 @@
-# inventory/signals.py (you'd need to create this file and import it in apps.py)
-from django.db.models.signals import post_save, post_delete
+# inventory/signals.py
+from django.db.models.signals import post_delete
 from django.dispatch import receiver
-from django.db.models import Sum
-from .models import InventoryBatchItem, WarehouseProduct
 
-@receiver(post_save, sender=InventoryBatchItem)
-@receiver(post_delete, sender=InventoryBatchItem)
-def update_warehouse_product_total_quantity(sender, instance, **kwargs):
-    warehouse_product = instance.warehouse_product
-    if warehouse_product:
-        # Recalculate the total quantity for the parent WarehouseProduct
-        new_total = InventoryBatchItem.objects.filter(
-            warehouse_product=warehouse_product
-        ).aggregate(total=Sum('quantity'))['total'] or 0
+from .models import InventoryBatchItem
+from .stock_ledger import adjust_batched_quantities
+
 
-        # Update without triggering signals again if WarehouseProduct had its own save method
-        WarehouseProduct.objects.filter(pk=warehouse_product.pk).update(total_quantity=new_total)
-        # Or if you add a 'total_quantity' field to WarehouseProduct model:
-        # warehouse_product.total_quantity = new_total
-        # warehouse_product.save(update_fields=['total_quantity']) # if you have a field and want to avoid recursion
+@receiver(post_delete, sender=InventoryBatchItem)
+def release_deleted_batch_quantity(sender, instance, **kwargs):
+    # Sent for queryset deletes too, so every removed batch leaves the warehouse total.
+    warehouse_product_id, quantity = getattr(
+        instance, '_loaded_stock', (instance.warehouse_product_id, instance.quantity)
+    )
+    adjust_batched_quantities({warehouse_product_id: -quantity})
@@ -0,0 +1,87 @@
+# app/inventory/stock_ledger.py
+"""
+Batch-to-warehouse stock totals.
+
+WarehouseProduct.batched_quantity is the sum of the product's batch
+quantities. It is never re-aggregated on write. Every change to a batch's
+quantity applies the same delta to its warehouse product in the same
+transaction:
+
+- InventoryBatchItem.save and the post_delete receiver in inventory/signals.py
+  run one UPDATE per change.
+- The bulk stock paths (operation.packing, operation.models.return_parcel_stock)
+  fold the delta into their grouped UPDATEs.
+
+Physical stock movements also move WarehouseProduct.quantity. Recording stock
+already on hand into batches only moves batched_quantity. The difference
+between the two is the product's unbatched stock.
+
+reconcile_batched_quantities() recomputes every total in one set-based
+statement and fixes the ones that drifted (see the reconcile_stock command).
+"""
+import logging
+
+from django.apps import apps
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Value, When
+
+from warehouse.models import WarehouseProduct
+
+logger = logging.getLogger(__name__)
+
+
+def adjust_batched_quantities(deltas):
+    """
+    Applies {warehouse_product_id: delta} to batched_quantity with one grouped UPDATE.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if pk and delta}
+    if not deltas:
+        return 0
+    return WarehouseProduct.objects.filter(pk__in=deltas).update(
+        batched_quantity=F('batched_quantity') + Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+
+
+def reconcile_batched_quantities(dry_run=False):
+    """
+    Compares every warehouse product's batched_quantity with the sum of its
+    batches in one statement and, unless `dry_run`, corrects the ones that
+    differ in that same statement.
+
+    Returns:
+        list: (warehouse_product_id, recorded, actual) for each drifted product.
+    """
+    batch_table = apps.get_model('inventory', 'InventoryBatchItem')._meta.db_table
+    product_table = WarehouseProduct._meta.db_table
+    drift_sql = f"""
+        SELECT wp.id, wp.batched_quantity AS recorded, COALESCE(totals.actual, 0) AS actual
+        FROM {product_table} wp
+        LEFT JOIN (
+            SELECT warehouse_product_id, SUM(quantity) AS actual
+            FROM {batch_table}
+            GROUP BY warehouse_product_id
+        ) totals ON totals.warehouse_product_id = wp.id
+        WHERE wp.batched_quantity <> COALESCE(totals.actual, 0)
+    """
+    if dry_run:
+        sql = drift_sql + " ORDER BY wp.id"
+    else:
+        sql = f"""
+            WITH drift AS ({drift_sql})
+            UPDATE {product_table} wp
+            SET batched_quantity = drift.actual
+            FROM drift
+            WHERE wp.id = drift.id
+            RETURNING drift.id, drift.recorded, drift.actual
+        """
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        drifted = sorted(cursor.fetchall())
+
+    if drifted and not dry_run:
+        logger.warning(f"[StockLedger] Corrected batched_quantity of {len(drifted)} warehouse products.")
+    return drifted
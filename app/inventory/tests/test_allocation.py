@@ -0,0 +1,127 @@
+'''
+Tests for wave allocation across many orders.
+'''
+import datetime
+
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from inventory.allocation import allocate_wave
+from inventory.models import Product, InventoryBatchItem, StockReservation
+from warehouse.models import Warehouse, WarehouseProduct
+from operation.models import Order, OrderItem
+
+
+class AllocateWaveTests(TestCase):
+    '''Test allocating batches to a wave of orders'''
+
+    def setUp(self):
+        self.warehouse = Warehouse.objects.create(name='Main WH')
+        self.today = timezone.localdate()
+
+    def make_stock(self, sku, batches):
+        '''batches: (quantity, pick_priority, days to expiry) tuples'''
+        product = Product.objects.create(sku=sku, name=f'Product {sku}', price=1)
+        warehouse_product = WarehouseProduct.objects.create(
+            warehouse=self.warehouse, product=product, quantity=sum(qty for qty, _, _ in batches),
+        )
+        return warehouse_product, [
+            InventoryBatchItem.objects.create(
+                warehouse_product=warehouse_product, batch_number=f'{sku}-B{i}', quantity=qty, pick_priority=priority,
+                location_label=f'L{i}', expiry_date=self.today + datetime.timedelta(days=days),
+            )
+            for i, (qty, priority, days) in enumerate(batches)
+        ]
+
+    def make_order(self, days_ago, lines):
+        order = Order.objects.create(
+            erp_order_id=f'W{Order.objects.count()}', order_date=self.today - datetime.timedelta(days=days_ago),
+            warehouse=self.warehouse,
+        )
+        return [
+            OrderItem.objects.create(
+                order=order, product=warehouse_product.product, warehouse_product=warehouse_product, quantity_ordered=qty,
+            )
+            for warehouse_product, qty in lines
+        ]
+
+    def test_stock_is_used_in_fefo_order_across_orders(self):
+        '''test the oldest order gets the earliest-expiring stock and later orders continue from there'''
+        wp, (late, early) = self.make_stock('A', [(10, None, 90), (4, None, 10)])
+        [newer] = self.make_order(0, [(wp, 5)])
+        [older] = self.make_order(3, [(wp, 6)])
+
+        result = allocate_wave(Order.objects.all())
+
+        self.assertEqual(result['allocations'][older.pk], [(early.pk, 4), (late.pk, 2)])
+        self.assertEqual(result['allocations'][newer.pk], [(late.pk, 5)])
+        self.assertEqual(result['shortages'], {})
+        newer.refresh_from_db()
+        self.assertEqual(newer.suggested_batch_item, late)
+        self.assertEqual(
+            dict(StockReservation.objects.filter(order_item=older).values_list('batch_item', 'quantity')),
+            {early.pk: 4, late.pk: 2},
+        )
+
+    def test_later_wave_respects_split_allocations(self):
+        '''test a second wave sees what an earlier split allocation holds in each batch'''
+        wp, (a, b, c) = self.make_stock('S', [(10, None, 10), (10, None, 20), (10, None, 30)])
+        [first] = self.make_order(1, [(wp, 15)])
+        allocate_wave([first.order])
+
+        [second] = self.make_order(0, [(wp, 10)])
+        result = allocate_wave([second.order])
+
+        self.assertEqual(result['allocations'][second.pk], [(b.pk, 5), (c.pk, 5)])
+        held = StockReservation.objects.filter(quantity__gt=0).values('batch_item').annotate(total=Sum('quantity'))
+        self.assertEqual({row['batch_item']: row['total'] for row in held}, {a.pk: 10, b.pk: 10, c.pk: 5})
+
+    def test_pick_priority_beats_expiry(self):
+        '''test a default pick batch is used before an earlier-expiring unprioritised one'''
+        wp, (fefo, default) = self.make_stock('B', [(10, None, 5), (10, 0, 60)])
+        [item] = self.make_order(0, [(wp, 3)])
+
+        result = allocate_wave([item.order])
+
+        self.assertEqual(result['allocations'][item.pk], [(default.pk, 3)])
+
+    def test_shortage_and_other_reservations(self):
+        '''test stock reserved for orders outside the wave is not allocated'''
+        wp, (batch,) = self.make_stock('C', [(10, None, 30)])
+        [outside] = self.make_order(5, [(wp, 4)])
+        StockReservation.objects.create(order_item=outside, warehouse_product=wp, batch_item=batch, quantity=4)
+        [item] = self.make_order(0, [(wp, 8)])
+
+        result = allocate_wave([item.order])
+
+        self.assertEqual(result['allocations'][item.pk], [(batch.pk, 6)])
+        self.assertEqual(result['shortages'], {item.pk: 2})
+
+    def test_pick_plan_consolidates_per_batch(self):
+        '''test the pick plan has one line per batch with the order items it serves'''
+        wp_a, (batch_a,) = self.make_stock('D', [(20, None, 30)])
+        wp_b, (batch_b,) = self.make_stock('E', [(20, None, 30)])
+        first = self.make_order(1, [(wp_a, 2), (wp_b, 1)])
+        second = self.make_order(0, [(wp_a, 3)])
+
+        plan = allocate_wave(Order.objects.all())['pick_plan']
+
+        self.assertEqual([(line['batch'], line['quantity']) for line in plan], [(batch_a, 5), (batch_b, 1)])
+        self.assertEqual(plan[0]['order_items'], [(first[0].pk, 2), (second[0].pk, 3)])
+
+    def test_query_count_independent_of_wave_size(self):
+        '''test allocating more orders does not run more queries'''
+        products = [self.make_stock(f'Q{i}', [(50, None, 30), (50, 1, 60)])[0] for i in range(3)]
+
+        def count_queries(orders):
+            with CaptureQueriesContext(connection) as ctx:
+                allocate_wave(orders)
+            return len(ctx.captured_queries)
+
+        small = [self.make_order(0, [(products[0], 1)])[0].order]
+        large = [self.make_order(0, [(wp, 2) for wp in products])[0].order for _ in range(6)]
+
+        self.assertEqual(count_queries(small), count_queries(large))
@@ -0,0 +1,85 @@
+'''
+Tests for the inventory batch list page and its on-demand batch detail.
+'''
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from inventory.models import Product, InventoryBatchItem
+from warehouse.models import Warehouse, WarehouseProduct
+
+
+class InventoryBatchListTests(TestCase):
+    '''Test the batch list renders from one annotated query'''
+
+    def setUp(self):
+        self.warehouse = Warehouse.objects.create(name='Main WH')
+        self.user = get_user_model().objects.create_user(
+            email='stock@example.com', password='testpass123', name='Stock Keeper',
+        )
+        self.user.warehouse = self.warehouse
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def make_product(self, sku, batch_quantities, quantity=None):
+        warehouse_product = WarehouseProduct.objects.create(
+            warehouse=self.warehouse, product=Product.objects.create(sku=sku, name=f'Product {sku}', price=1),
+            quantity=sum(batch_quantities) if quantity is None else quantity,
+        )
+        for i, qty in enumerate(batch_quantities):
+            InventoryBatchItem.objects.create(
+                warehouse_product=warehouse_product, batch_number=f'{sku}-B{i}', quantity=qty,
+                expiry_date=datetime.date.today() + datetime.timedelta(days=30 * (i + 1)),
+            )
+        return warehouse_product
+
+    def test_summary_annotations(self):
+        '''test each row carries its batch counts, next expiry and unbatched quantity'''
+        self.make_product('SKU-A', [5, 0, 3], quantity=10)
+
+        response = self.client.get(reverse('inventory:inventory_batch_list_view'))
+
+        wp = response.context['warehouse_products'][0]
+        self.assertEqual((wp.batch_count, wp.empty_batch_count, wp.unbatched_quantity), (2, 1, 2))
+        self.assertEqual(wp.next_expiry, datetime.date.today() + datetime.timedelta(days=30))
+        self.assertNotContains(response, 'SKU-A-B0')
+
+    def test_query_count_independent_of_batch_count(self):
+        '''test rendering the page costs the same however many batches exist'''
+        self.make_product('SKU-A', [1])
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse('inventory:inventory_batch_list_view'))
+            return len(ctx.captured_queries)
+
+        few = count_queries()
+        self.make_product('SKU-B', [1] * 20)
+        self.make_product('SKU-C', [2] * 20)
+
+        self.assertEqual(count_queries(), few)
+
+    def test_batch_detail_endpoint(self):
+        '''test expanding a product returns its batch rows and edit modals'''
+        warehouse_product = self.make_product('SKU-A', [5, 0])
+
+        response = self.client.get(reverse('inventory:warehouse_product_batches', args=[warehouse_product.pk]))
+
+        self.assertContains(response, 'SKU-A-B0')
+        self.assertContains(response, 'zero-quantity-batch')
+        self.assertContains(response, 'edit-batch-modal-toggle-')
+
+    def test_batch_detail_other_warehouse_forbidden(self):
+        '''test a user cannot load batches of another warehouse'''
+        other = WarehouseProduct.objects.create(
+            warehouse=Warehouse.objects.create(name='Other WH'),
+            product=Product.objects.create(sku='SKU-X', name='Product X', price=1),
+        )
+
+        response = self.client.get(reverse('inventory:warehouse_product_batches', args=[other.pk]))
+
+        self.assertEqual(response.status_code, 403)
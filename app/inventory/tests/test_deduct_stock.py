@@ -0,0 +1,159 @@
+'''
+Tests for the multi-batch FEFO stock deduction service.
+'''
+import datetime
+import threading
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from inventory.models import Product, InventoryBatchItem, StockTransaction, StockReservation
+from inventory.services import deduct_stock, StockDeductionError
+from warehouse.models import Warehouse, WarehouseProduct
+from operation.models import Order, OrderItem
+
+
+class DeductionFixtures:
+    def make_stock(self, batch_quantities):
+        self.user = get_user_model().objects.create_user(
+            email='picker@example.com', password='testpass123', name='Picker',
+        )
+        warehouse = Warehouse.objects.create(name='Main WH')
+        product = Product.objects.create(sku='SKU-HOT', name='Hot Product', price=1)
+        self.warehouse_product = WarehouseProduct.objects.create(
+            warehouse=warehouse, product=product, quantity=sum(batch_quantities),
+        )
+        # Later batches expire first, so FEFO order differs from creation order.
+        self.batches = [
+            InventoryBatchItem.objects.create(
+                warehouse_product=self.warehouse_product, batch_number=f'B{i}', quantity=qty,
+                expiry_date=timezone.localdate() + datetime.timedelta(days=100 - i),
+            )
+            for i, qty in enumerate(batch_quantities)
+        ]
+
+
+class DeductStockTests(DeductionFixtures, TestCase):
+    '''Test deducting stock across batches'''
+
+    def setUp(self):
+        self.make_stock([5, 5, 5])
+
+    def test_deducts_earliest_expiry_first_across_batches(self):
+        '''test a quantity larger than one batch is split in FEFO order'''
+        with CaptureQueriesContext(connection) as ctx:
+            deductions = deduct_stock(self.warehouse_product, 7, self.user, notes='Write-off')
+
+        self.assertEqual([(batch.batch_number, qty) for batch, qty in deductions], [('B2', 5), ('B1', 2)])
+        self.assertEqual(
+            dict(InventoryBatchItem.objects.values_list('batch_number', 'quantity')), {'B0': 5, 'B1': 3, 'B2': 0},
+        )
+        self.warehouse_product.refresh_from_db()
+        self.assertEqual((self.warehouse_product.quantity, self.warehouse_product.batched_quantity), (8, 8))
+        self.assertEqual(
+            sorted(StockTransaction.objects.values_list('quantity', flat=True)), [-5, -2],
+        )
+        # Product lock, batch lock/select, reserved total, batch UPDATE, transaction INSERT, product UPDATE,
+        # plus the savepoint pair.
+        self.assertLessEqual(len(ctx.captured_queries), 8)
+
+    def test_insufficient_stock_writes_nothing(self):
+        '''test asking for more than the batches hold raises and leaves stock untouched'''
+        with self.assertRaisesMessage(StockDeductionError, 'Cannot deduct 1 more units'):
+            deduct_stock(self.warehouse_product, 16, self.user)
+
+        self.assertEqual(InventoryBatchItem.objects.aggregate(total=Sum('quantity'))['total'], 15)
+        self.assertFalse(StockTransaction.objects.exists())
+
+    def test_expired_batches_are_not_deducted(self):
+        '''test an expired batch is passed over even though it expires first'''
+        InventoryBatchItem.objects.filter(pk=self.batches[2].pk).update(
+            expiry_date=timezone.localdate() - datetime.timedelta(days=1),
+        )
+
+        deductions = deduct_stock(self.warehouse_product, 6, self.user)
+
+        self.assertEqual([(batch.batch_number, qty) for batch, qty in deductions], [('B1', 5), ('B0', 1)])
+
+    def test_stock_reserved_for_orders_is_not_deducted(self):
+        '''test a deduction may only take stock that is not promised to an order'''
+        order = Order.objects.create(
+            erp_order_id='D1', order_date=timezone.localdate(), warehouse=self.warehouse_product.warehouse,
+        )
+        item = OrderItem.objects.create(
+            order=order, product=self.warehouse_product.product, warehouse_product=self.warehouse_product,
+            quantity_ordered=10,
+        )
+        StockReservation.objects.create(order_item=item, warehouse_product=self.warehouse_product, quantity=10)
+
+        with self.assertRaisesMessage(StockDeductionError, '10 are reserved for orders, so only 5 can be used'):
+            deduct_stock(self.warehouse_product, 6, self.user)
+        self.assertFalse(StockTransaction.objects.exists())
+
+        deduct_stock(self.warehouse_product, 5, self.user)
+        self.warehouse_product.refresh_from_db()
+        self.assertEqual(self.warehouse_product.quantity, 10)
+
+
+class ConcurrentDeductionTests(DeductionFixtures, TransactionTestCase):
+    '''Test parallel pickers deducting the same SKU'''
+
+    def setUp(self):
+        self.make_stock([5, 5, 5, 5])
+
+    def test_locked_batch_is_skipped_not_waited_for(self):
+        '''test a deduction takes the next batch while another transaction holds the first'''
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    list(InventoryBatchItem.objects.select_for_update().filter(pk=self.batches[3].pk))
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait(10)
+            deductions = deduct_stock(self.warehouse_product, 3, self.user)
+        finally:
+            release.set()
+            holder.join()
+
+        self.assertEqual([(batch.pk, qty) for batch, qty in deductions], [(self.batches[2].pk, 3)])
+
+    def test_parallel_deductions_never_go_negative(self):
+        '''test many pickers racing for one SKU never oversell a batch or the product'''
+        results, start = [], threading.Barrier(8)
+
+        def pick():
+            try:
+                start.wait(10)
+                try:
+                    deductions = deduct_stock(WarehouseProduct.objects.get(pk=self.warehouse_product.pk), 3, self.user)
+                    results.append(sum(qty for _, qty in deductions))
+                except StockDeductionError:
+                    results.append(0)
+            finally:
+                connection.close()
+
+        pickers = [threading.Thread(target=pick) for _ in range(8)]
+        for picker in pickers:
+            picker.start()
+        for picker in pickers:
+            picker.join()
+
+        remaining = list(InventoryBatchItem.objects.values_list('quantity', flat=True))
+        self.assertTrue(all(qty >= 0 for qty in remaining))
+        self.assertEqual(sum(results) + sum(remaining), 20)
+        self.assertEqual(-StockTransaction.objects.aggregate(total=Sum('quantity'))['total'], sum(results))
+        self.warehouse_product.refresh_from_db()
+        self.assertEqual(self.warehouse_product.quantity, sum(remaining))
+        self.assertEqual(self.warehouse_product.batched_quantity, sum(remaining))
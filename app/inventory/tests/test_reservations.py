@@ -0,0 +1,200 @@
+'''
+Tests for stock reservations and available to promise.
+'''
+import datetime
+import threading
+import time
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
+from django.contrib.auth import get_user_model
+
+from inventory.models import Product, InventoryBatchItem, StockReservation
+from inventory.reservations import available_to_promise, reserve_order_items
+from warehouse.models import Warehouse, WarehouseProduct
+from operation.models import Order, OrderItem, CourierCompany, PackagingType
+from operation.packing import pack_order, PackingError
+
+
+class ReservationFixtures:
+    def make_stock(self, quantity):
+        self.user = get_user_model().objects.create_user(
+            email='planner@example.com', password='testpass123', name='Planner',
+        )
+        self.warehouse = Warehouse.objects.create(name='Main WH')
+        self.courier = CourierCompany.objects.create(name='DHL', code='DHL')
+        self.packaging_type = PackagingType.objects.create(name='Envelope', warehouse=self.warehouse)
+        product = Product.objects.create(sku='SKU-A', name='Product A', price=1)
+        self.warehouse_product = WarehouseProduct.objects.create(warehouse=self.warehouse, product=product, quantity=quantity)
+        self.batch = InventoryBatchItem.objects.create(
+            warehouse_product=self.warehouse_product, batch_number='B1', quantity=quantity,
+        )
+
+    def make_order_item(self, quantity):
+        order = Order.objects.create(
+            erp_order_id=f'R{Order.objects.count()}', order_date=datetime.date(2025, 1, 15), warehouse=self.warehouse,
+        )
+        return OrderItem.objects.create(
+            order=order, product=self.warehouse_product.product, warehouse_product=self.warehouse_product,
+            quantity_ordered=quantity,
+        )
+
+    def pack(self, order_item, quantity):
+        return pack_order(
+            order_item.order, [{'order_item_id': order_item.pk, 'batch_id': self.batch.pk, 'quantity': quantity}],
+            courier_company=self.courier, packaging_type=self.packaging_type, user=self.user,
+        )
+
+
+class ReserveOrderItemsTests(ReservationFixtures, TestCase):
+    '''Test reserving stock for order items'''
+
+    def setUp(self):
+        self.make_stock(10)
+
+    def test_reserves_first_come_first_served(self):
+        '''test stock is promised in order and shortages are reported'''
+        with self.captureOnCommitCallbacks(execute=True):
+            first, second = self.make_order_item(6), self.make_order_item(6)
+
+        shortages = reserve_order_items([first, second])
+
+        self.assertEqual(shortages, {second.pk: 2})
+        self.assertEqual(
+            dict(StockReservation.objects.values_list('order_item_id', 'quantity')),
+            {first.pk: 6, second.pk: 4},
+        )
+        self.assertEqual(available_to_promise([self.warehouse_product.pk]), {self.warehouse_product.pk: 0})
+
+    def test_reserving_again_is_idempotent(self):
+        '''test re-running the reservation changes nothing'''
+        with self.captureOnCommitCallbacks(execute=True):
+            item = self.make_order_item(4)
+        reserve_order_items([item])
+
+        reserve_order_items([item])
+
+        self.assertEqual(list(StockReservation.objects.values_list('quantity', flat=True)), [4])
+
+    def test_query_count_independent_of_item_count(self):
+        '''test reserving many items takes as many queries as one'''
+        def count_queries(count):
+            with self.captureOnCommitCallbacks(execute=True):
+                items = [self.make_order_item(1) for _ in range(count)]
+            with CaptureQueriesContext(connection) as ctx:
+                reserve_order_items(items)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(4), count_queries(1))
+
+
+class PackingWithReservationsTests(ReservationFixtures, TestCase):
+    '''Test packing against reserved stock'''
+
+    def setUp(self):
+        self.make_stock(10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reserved_item = self.make_order_item(8)
+            self.other_item = self.make_order_item(5)
+        reserve_order_items([self.reserved_item])
+
+    def test_packing_consumes_own_reservation(self):
+        '''test packing an order item releases the stock held for it'''
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pack(self.reserved_item, 8)
+
+        self.assertEqual(StockReservation.objects.get(order_item=self.reserved_item).quantity, 0)
+        self.assertEqual(available_to_promise([self.warehouse_product.pk]), {self.warehouse_product.pk: 2})
+
+    def test_cannot_pack_stock_reserved_for_others(self):
+        '''test packing is refused when it would take stock promised to another order'''
+        with self.assertRaisesMessage(PackingError, 'reserved for other orders'):
+            self.pack(self.other_item, 5)
+
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.quantity, 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pack(self.other_item, 2)
+
+
+class ConcurrentPackingTests(ReservationFixtures, TransactionTestCase):
+    '''Test packers competing for the same stock'''
+
+    def setUp(self):
+        self.make_stock(10)
+        self.item = self.make_order_item(3)
+
+    def test_waiting_packer_gives_up_after_lock_timeout(self):
+        '''test a pack blocked by another transaction fails cleanly instead of hanging'''
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    list(WarehouseProduct.objects.select_for_update().filter(pk=self.warehouse_product.pk))
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait(10)
+            with mock.patch('operation.packing.PACKING_LOCK_TIMEOUT_MS', 200):
+                with self.assertRaisesMessage(PackingError, 'try again'):
+                    self.pack(self.item, 3)
+        finally:
+            release.set()
+            holder.join()
+
+        self.pack(self.item, 3)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.quantity, 7)
+
+    def test_parallel_packers_and_reservers_never_oversell(self):
+        '''test packers and reservers racing for one SKU never drive stock or ATP negative, nor wait past the lock timeout'''
+        pack_items = [self.item] + [self.make_order_item(3) for _ in range(3)]
+        reserve_items = [self.make_order_item(3) for _ in range(4)]
+        packed, waits, start = [], [], threading.Barrier(8)
+
+        def race(work):
+            try:
+                start.wait(10)
+                began = time.monotonic()
+                try:
+                    work()
+                finally:
+                    waits.append(time.monotonic() - began)
+            finally:
+                connection.close()
+
+        def pack(item):
+            try:
+                self.pack(item, 3)
+                packed.append(3)
+            except PackingError:
+                pass
+
+        def reserve(item):
+            reserve_order_items([OrderItem.objects.select_related('order').get(pk=item.pk)])
+
+        workers = [threading.Thread(target=race, args=(lambda item=item: pack(item),)) for item in pack_items]
+        workers += [threading.Thread(target=race, args=(lambda item=item: reserve(item),)) for item in reserve_items]
+        with mock.patch('operation.packing.PACKING_LOCK_TIMEOUT_MS', 500):
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        self.batch.refresh_from_db()
+        self.warehouse_product.refresh_from_db()
+        self.assertGreaterEqual(self.batch.quantity, 0)
+        self.assertEqual(self.batch.quantity + sum(packed), 10)
+        self.assertEqual(self.warehouse_product.quantity, self.batch.quantity)
+        self.assertGreaterEqual(available_to_promise([self.warehouse_product.pk])[self.warehouse_product.pk], 0)
+        # Only the warehouse product lock is contested, so no call waits much longer than one lock timeout.
+        self.assertEqual(len(waits), 8)
+        self.assertLess(max(waits), 0.5 + 2)
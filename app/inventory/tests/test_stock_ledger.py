@@ -0,0 +1,116 @@
+'''
+Tests for the delta-maintained batch stock totals.
+'''
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.db.models import F
+
+from inventory.models import Product, InventoryBatchItem
+from inventory.stock_ledger import reconcile_batched_quantities
+from warehouse.models import Warehouse, WarehouseProduct
+
+
+class BatchedQuantityTests(TestCase):
+    '''Test warehouse totals follow batch changes without re-aggregating'''
+
+    def setUp(self):
+        warehouse = Warehouse.objects.create(name='Main WH')
+        self.product_a = WarehouseProduct.objects.create(
+            warehouse=warehouse, product=Product.objects.create(sku='SKU-A', name='Product A', price=1), quantity=50,
+        )
+        self.product_b = WarehouseProduct.objects.create(
+            warehouse=warehouse, product=Product.objects.create(sku='SKU-B', name='Product B', price=1), quantity=50,
+        )
+
+    def batched(self, warehouse_product):
+        warehouse_product.refresh_from_db()
+        return warehouse_product.batched_quantity
+
+    def test_create_edit_move_and_delete(self):
+        '''test each batch change moves its warehouse product's total'''
+        batch = InventoryBatchItem.objects.create(warehouse_product=self.product_a, batch_number='B1', quantity=10)
+        InventoryBatchItem.objects.create(warehouse_product=self.product_a, batch_number='B2', quantity=5)
+        self.assertEqual(self.batched(self.product_a), 15)
+
+        batch = InventoryBatchItem.objects.get(pk=batch.pk)
+        batch.quantity = 7
+        batch.save()
+        self.assertEqual(self.batched(self.product_a), 12)
+
+        batch.warehouse_product = self.product_b
+        batch.save()
+        self.assertEqual((self.batched(self.product_a), self.batched(self.product_b)), (5, 7))
+
+        InventoryBatchItem.objects.filter(warehouse_product=self.product_a).delete()
+        self.assertEqual(self.batched(self.product_a), 0)
+
+    def test_saving_with_expression(self):
+        '''test saving an F() quantity applies the resulting delta'''
+        batch = InventoryBatchItem.objects.create(warehouse_product=self.product_a, batch_number='B1', quantity=10)
+
+        batch.quantity = F('quantity') + 4
+        batch.save(update_fields=['quantity'])
+
+        self.assertEqual(batch.quantity, 14)
+        self.assertEqual(self.batched(self.product_a), 14)
+
+    def test_saving_does_not_aggregate_batches(self):
+        '''test a batch save updates the total by delta, without summing batches'''
+        batch = InventoryBatchItem.objects.create(warehouse_product=self.product_a, batch_number='B1', quantity=10)
+        batch = InventoryBatchItem.objects.get(pk=batch.pk)
+        batch.quantity = 3
+
+        with CaptureQueriesContext(connection) as ctx:
+            batch.save()
+
+        self.assertFalse(any('SUM(' in query['sql'] for query in ctx.captured_queries))
+        self.assertEqual(self.batched(self.product_a), 3)
+
+    def test_stale_warehouse_product_save_keeps_total(self):
+        '''test saving a warehouse product loaded before a batch change keeps the new total'''
+        stale = WarehouseProduct.objects.get(pk=self.product_a.pk)
+        InventoryBatchItem.objects.create(warehouse_product=self.product_a, batch_number='B1', quantity=10)
+
+        stale.threshold = 5
+        stale.save()
+
+        self.assertEqual(self.batched(self.product_a), 10)
+
+
+class ReconcileStockTests(TestCase):
+    '''Test finding and fixing drifted totals'''
+
+    def setUp(self):
+        warehouse = Warehouse.objects.create(name='Main WH')
+        self.warehouse_product = WarehouseProduct.objects.create(
+            warehouse=warehouse, product=Product.objects.create(sku='SKU-A', name='Product A', price=1), quantity=50,
+        )
+        InventoryBatchItem.objects.create(warehouse_product=self.warehouse_product, batch_number='B1', quantity=10)
+        WarehouseProduct.objects.filter(pk=self.warehouse_product.pk).update(batched_quantity=99)
+
+    def test_dry_run_reports_without_fixing(self):
+        '''test a dry run lists the drift and leaves it in place'''
+        self.assertEqual(reconcile_batched_quantities(dry_run=True), [(self.warehouse_product.pk, 99, 10)])
+        self.warehouse_product.refresh_from_db()
+        self.assertEqual(self.warehouse_product.batched_quantity, 99)
+
+    def test_fixes_drift_in_one_statement(self):
+        '''test reconciling corrects the total with a single query'''
+        with CaptureQueriesContext(connection) as ctx:
+            drifted = reconcile_batched_quantities()
+
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(drifted, [(self.warehouse_product.pk, 99, 10)])
+        self.warehouse_product.refresh_from_db()
+        self.assertEqual(self.warehouse_product.batched_quantity, 10)
+        self.assertEqual(reconcile_batched_quantities(), [])
+
+    def test_command(self):
+        '''test the reconcile_stock command reports what it corrected'''
+        out = StringIO()
+        call_command('reconcile_stock', stdout=out)
+        self.assertIn('1 warehouse products corrected.', out.getvalue())
@@ -15,6 +15,7 @@ app_name = 'inventory'
 
 urlpatterns = [
     path('batchlist/', views.inventory_batch_list_view, name='inventory_batch_list_view'),
+    path('batchlist/<int:wp_pk>/batches/', views.warehouse_product_batches_view, name='warehouse_product_batches'),
     path('batches/export-excel/', views.export_inventory_batch_to_excel, name='export_inventory_batch_excel'),
 
     path('batch/add/', views.add_inventory_batch, name='add_inventory_batch'), # New
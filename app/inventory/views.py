@@ -1,10 +1,11 @@
 # app/inventory/views.py
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseForbidden, HttpResponse
+from django.http import JsonResponse, HttpResponseForbidden
 from django.utils import timezone
+from datetime import timedelta
 from django.views.decorators.http import require_POST, require_GET
-from django.db.models import Sum, Q, Prefetch
+from django.db.models import Q, F, Count, Min, Max, Exists, OuterRef
 from django.db import transaction, IntegrityError
 from django.contrib import messages # Import messages
 from django.forms import inlineformset_factory, formset_factory # Ensure formset_factory is imported
@@ -18,7 +19,7 @@ from .models import (
     StockTakeSession, StockTakeItem, StockDiscrepancy,
      ErpStockCheckSession, ErpStockCheckItem, WarehouseProductDiscrepancy  # New models
 )
-from warehouse.models import Warehouse, WarehouseProduct as NewAggregateWarehouseProduct, Warehouse # <<< ADDED Warehouse import
+from warehouse.models import Warehouse, WarehouseProduct as NewAggregateWarehouseProduct
 from .forms import (
     InventoryBatchItemForm, StockTakeItemForm, StockTakeItemFormSet, # New forms
     StockTakeSessionSelectionForm,
@@ -27,31 +28,30 @@ from .forms import (
     DefaultPickItemForm # To be reused
 )
 from .services import create_stock_take_session_from_csv
+from core.exports import Column, stream_csv, stream_xlsx
 
 from django.contrib.admin.views.decorators import staff_member_required # For superuser/staff views
-from django.http import HttpResponse
-import csv
 import json
-import io
 import openpyxl
 import xlrd
 import logging
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 
 logger = logging.getLogger(__name__)
 
 
-@login_required
 @login_required
 def inventory_batch_list_view(request):
+    """
+    Lists every warehouse product with its batch summary from one annotated
+    query. The batches themselves are fetched per product, when its row is
+    expanded (warehouse_product_batches_view), so rendering the page does not
+    depend on how many batches the warehouse holds.
+    """
     user = request.user
     base_queryset = NewAggregateWarehouseProduct.objects.select_related(
         'product',
         'warehouse',
         'supplier'
-    ).prefetch_related(
-        Prefetch('batches', queryset=InventoryBatchItem.objects.order_by('expiry_date'))
     )
 
     # For non-superusers, restrict to their assigned warehouse. Superusers see all.
@@ -64,34 +64,19 @@ def inventory_batch_list_view(request):
     # This GET parameter is kept in case you want to use it for setting an initial filter state via URL.
     selected_warehouse_id = request.GET.get('warehouse')
 
-    warehouse_products_qs = base_queryset.order_by(
+    today = timezone.now().date()
+    in_stock = Q(batches__quantity__gt=0)
+    warehouse_products_qs = base_queryset.annotate(
+        batch_count=Count('batches', filter=in_stock),
+        empty_batch_count=Count('batches', filter=Q(batches__quantity=0)),
+        next_expiry=Min('batches__expiry_date', filter=in_stock & Q(batches__expiry_date__gte=today)),
+        last_received=Max('batches__date_received', filter=in_stock & Q(batches__date_received__lte=today)),
+        unbatched_quantity=F('quantity') - F('batched_quantity'),
+    ).order_by(
         'product__name',
         'warehouse__name'
     )
 
-    today = timezone.now().date()
-    processed_warehouse_products_list = []
-
-    for wp in warehouse_products_qs:
-        current_aggregate_stock = wp.quantity if wp.quantity is not None else 0
-        sum_of_batched_stock = wp.batches.aggregate(total_qty=Sum('quantity'))['total_qty'] or 0
-        wp.calculated_unbatched_quantity = current_aggregate_stock - sum_of_batched_stock
-        wp.processed_batches = wp.batches.all()
-        processed_warehouse_products_list.append(wp)
-
-    all_batches_qs = InventoryBatchItem.objects.select_related(
-        'warehouse_product__product',
-        'warehouse_product__warehouse'
-    )
-    if not user.is_superuser and user.warehouse:
-        all_batches_qs = all_batches_qs.filter(warehouse_product__warehouse=user.warehouse)
-    elif not user.is_superuser and not user.warehouse:
-        all_batches_qs = all_batches_qs.none()
-
-    all_inventory_batches_for_modals = all_batches_qs.order_by(
-        'warehouse_product__product__name', 'batch_number'
-    )
-
     add_batch_form_instance = InventoryBatchItemForm(request=request)
     user_warehouse = request.user.warehouse if hasattr(request.user, 'warehouse') and request.user.warehouse else None
     default_pick_formset = DefaultPickItemFormSet(
@@ -109,8 +94,8 @@ def inventory_batch_list_view(request):
 
 
     context = {
-        'warehouse_products': processed_warehouse_products_list,
-        'all_inventory_batches': all_inventory_batches_for_modals,
+        'warehouse_products': warehouse_products_qs,
+        'expiry_warning_date': today + timedelta(days=180),
         'add_batch_form': add_batch_form_instance,
         'page_title': 'Batches & Stock Levels',
         'default_pick_formset': default_pick_formset,
@@ -122,61 +107,47 @@ def inventory_batch_list_view(request):
     return render(request, 'inventory/inventory_batch_list.html', context)
 
 
+@login_required
+@require_GET
+def warehouse_product_batches_view(request, wp_pk):
+    """
+    Renders the batch rows (and their edit modals) of one warehouse product for
+    the batch list page.
+    """
+    warehouse_product = get_object_or_404(NewAggregateWarehouseProduct, pk=wp_pk)
+    if not request.user.is_superuser and (not request.user.warehouse or request.user.warehouse != warehouse_product.warehouse):
+        return HttpResponseForbidden('You do not have permission for this warehouse.')
+
+    batches = list(
+        InventoryBatchItem.objects.filter(warehouse_product=warehouse_product)
+        .select_related('warehouse_product__product', 'warehouse_product__warehouse')
+        .order_by(F('expiry_date').asc(nulls_last=True), 'date_received')
+    )
+    return render(request, 'inventory/partials/warehouse_product_batches.html', {
+        'batches': batches,
+        'zero_quantity_count': sum(1 for batch in batches if batch.quantity == 0),
+    })
+
+
 @login_required
 def export_inventory_batch_to_excel(request):
     """
     Exports an Excel file summarizing inventory batches, including total stock
     and stock discrepancy for each product in each warehouse.
     """
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    sheet.title = "Inventory Batch Report"
-
-    headers = [
-        "Product SKU", "Product Name", "Warehouse", "Total Stock (Batched)",
-        "System Stock (On Hand)", "Stock Discrepancy"
-    ]
-    sheet.append(headers)
-
-    # --- THIS IS THE FIX: Use 'batches' instead of 'inventory_batches' ---
     warehouse_products = NewAggregateWarehouseProduct.objects.filter(
-        batches__isnull=False
-    ).distinct()
-
-    batch_totals = NewAggregateWarehouseProduct.objects.filter(
-        id__in=warehouse_products.values_list('id', flat=True)
-    ).annotate(
-        batched_stock=Sum('batches__quantity') # Corrected field name here
-    )
-    # --------------------------------------------------------------------
-
-    batch_stock_dict = {bt.id: bt.batched_stock for bt in batch_totals}
-
-    for wp in warehouse_products:
-        total_batched_stock = batch_stock_dict.get(wp.id, 0)
-        discrepancy = total_batched_stock - wp.quantity
-
-        sheet.append([
-            wp.product.sku,
-            wp.product.name,
-            wp.warehouse.name,
-            total_batched_stock,
-            wp.quantity,
-            discrepancy
-        ])
-
-    # --- Save to an in-memory stream ---
-    excel_stream = io.BytesIO()
-    workbook.save(excel_stream)
-    excel_stream.seek(0)
-
-    response = HttpResponse(
-        excel_stream,
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    response['Content-Disposition'] = 'attachment; filename="inventory_batch_report.xlsx"'
-
-    return response
+        Exists(InventoryBatchItem.objects.filter(warehouse_product=OuterRef('pk')))
+    ).select_related('product', 'warehouse').order_by('product__sku', 'warehouse__name')
+
+    columns = [
+        Column("Product SKU", 'product.sku'),
+        Column("Product Name", 'product.name'),
+        Column("Warehouse", 'warehouse.name'),
+        Column("Total Stock (Batched)", 'batched_quantity'),
+        Column("System Stock (On Hand)", 'quantity'),
+        Column("Stock Discrepancy", lambda wp: wp.batched_quantity - wp.quantity),
+    ]
+    return stream_xlsx('inventory_batch_report.xlsx', warehouse_products, columns, sheet_title="Inventory Batch Report")
 
 
 
@@ -523,35 +494,23 @@ def download_stock_take_session_csv(request, session_pk):
         'warehouse_product__warehouse'
     ).order_by('warehouse_product__product__sku', 'location_label_counted', 'batch_number_counted')
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="stock_take_session_{session.pk}_{session.name.replace(" ", "_")}.csv"'
-
-    writer = csv.writer(response)
-    writer.writerow([
-        'Session ID', 'Session Name', 'Session Warehouse', 'Session Status',
-        'Item ID (System)', 'Product SKU (System)', 'Product Name (System)', 'Warehouse (System)',
-        'Location (Counted)', 'Batch No. (Counted)', 'Expiry (Counted)', 'Quantity (Counted)',
-        'Item Notes', 'Counted At'
-    ])
-
-    for item in items:
-        writer.writerow([
-            session.pk,
-            session.name,
-            session.warehouse.name,
-            session.get_status_display(),
-            item.warehouse_product.pk,
-            item.warehouse_product.product.sku,
-            item.warehouse_product.product.name,
-            item.warehouse_product.warehouse.name, # Should match session.warehouse.name
-            item.location_label_counted if item.location_label_counted else '',
-            item.batch_number_counted if item.batch_number_counted else '',
-            item.expiry_date_counted.strftime('%Y-%m-%d') if item.expiry_date_counted else '',
-            item.counted_quantity,
-            item.notes,
-            item.counted_at.strftime('%Y-%m-%d %H:%M:%S') if item.counted_at else ''
-        ])
-    return response
+    columns = [
+        Column('Session ID', lambda item: session.pk),
+        Column('Session Name', lambda item: session.name),
+        Column('Session Warehouse', lambda item: session.warehouse.name),
+        Column('Session Status', lambda item: session.get_status_display()),
+        Column('Item ID (System)', 'warehouse_product.pk'),
+        Column('Product SKU (System)', 'warehouse_product.product.sku'),
+        Column('Product Name (System)', 'warehouse_product.product.name'),
+        Column('Warehouse (System)', 'warehouse_product.warehouse.name'), # Should match session.warehouse.name
+        Column('Location (Counted)', 'location_label_counted'),
+        Column('Batch No. (Counted)', 'batch_number_counted'),
+        Column('Expiry (Counted)', lambda item: item.expiry_date_counted.strftime('%Y-%m-%d') if item.expiry_date_counted else ''),
+        Column('Quantity (Counted)', 'counted_quantity'),
+        Column('Item Notes', lambda item: item.notes),
+        Column('Counted At', lambda item: item.counted_at.strftime('%Y-%m-%d %H:%M:%S') if item.counted_at else ''),
+    ]
+    return stream_csv(f'stock_take_session_{session.pk}_{session.name.replace(" ", "_")}.csv', items, columns)
 
 @staff_member_required
 @require_POST # Evaluation should be a POST request as it changes data
@@ -760,98 +719,40 @@ def download_stock_take_evaluation_excel(request, session_pk):
         messages.error(request, "You do not have permission to perform this action.")
         return redirect('inventory:stock_take_session_list') # Or appropriate redirect
 
-    session = get_object_or_404(
-        StockTakeSession.objects.select_related(
-            'warehouse', 'initiated_by', 'evaluated_by'
-        ).prefetch_related(
-            'discrepancies__warehouse_product__product',
-            'discrepancies__warehouse_product__warehouse',
-            'discrepancies__system_inventory_batch_item', # For more system details if needed
-            'discrepancies__stock_take_item_reference' # For more counted details if needed
-        ),
-        pk=session_pk
-    )
+    session = get_object_or_404(StockTakeSession, pk=session_pk)
 
     if session.status != 'EVALUATED' and not session.discrepancies.exists():
         messages.warning(request, f"Session '{session.name}' has not been evaluated yet or has no discrepancies to report.")
         return redirect('inventory:stock_take_session_detail', session_pk=session.pk)
 
-    # Create an Excel workbook and select the active sheet
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    sheet.title = f"Evaluation Report - {session.id}"
-
-    # Define Headers
-    headers = [
-        "Product SKU", "Product Name", "Warehouse",
-        "Discrepancy Type",
-        "System Batch", "System Location", "System Expiry", "System Qty",
-        "Counted Batch", "Counted Location", "Counted Expiry", "Counted Qty",
-        "Discrepancy Qty",
-        "Notes", "Resolved", "Resolution Notes", "Resolved By", "Resolved At"
+    discrepancies = session.discrepancies.select_related(
+        'warehouse_product__product', 'warehouse_product__warehouse', 'resolved_by',
+    ).order_by('pk')
+    columns = [
+        Column("Product SKU", 'warehouse_product.product.sku', width=20),
+        Column("Product Name", 'warehouse_product.product.name', width=20),
+        Column("Warehouse", 'warehouse_product.warehouse.name', width=20),
+        Column("Discrepancy Type", lambda d: d.get_discrepancy_type_display(), width=20),
+        Column("System Batch", lambda d: d.system_batch_number or "-", width=20),
+        Column("System Location", lambda d: d.system_location_label or "-", width=20),
+        Column("System Expiry", lambda d: d.system_expiry_date.strftime('%Y-%m-%d') if d.system_expiry_date else "-", width=20),
+        Column("System Qty", 'system_quantity', default="N/A", width=20),
+        Column("Counted Batch", lambda d: d.counted_batch_number or "-", width=20),
+        Column("Counted Location", lambda d: d.counted_location_label or "-", width=20),
+        Column("Counted Expiry", lambda d: d.counted_expiry_date.strftime('%Y-%m-%d') if d.counted_expiry_date else "-", width=20),
+        Column("Counted Qty", 'counted_quantity', default="N/A", width=20),
+        Column("Discrepancy Qty", 'discrepancy_quantity', width=20),
+        Column("Notes", lambda d: d.notes or "-", width=20),
+        Column("Resolved", lambda d: "Yes" if d.is_resolved else "No", width=20),
+        Column("Resolution Notes", lambda d: d.resolution_notes or "-", width=20),
+        Column("Resolved By", lambda d: (d.resolved_by.name or d.resolved_by.email) if d.resolved_by else "-", width=20),
+        Column("Resolved At", lambda d: d.resolved_at.strftime('%Y-%m-%d %H:%M') if d.resolved_at else "-", width=20),
     ]
-    sheet.append(headers)
-
-    # Apply styles to header row
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    for col_num, header_title in enumerate(headers, 1):
-        cell = sheet.cell(row=1, column=col_num)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        sheet.column_dimensions[get_column_letter(col_num)].width = 20 # Adjust width as needed
-
-    # Populate data rows
-    row_num = 2
-    for discrepancy in session.discrepancies.all():
-        resolved_by_name = ""
-        if discrepancy.resolved_by:
-            resolved_by_name = discrepancy.resolved_by.name or discrepancy.resolved_by.email
-
-        data_row = [
-            discrepancy.warehouse_product.product.sku,
-            discrepancy.warehouse_product.product.name,
-            discrepancy.warehouse_product.warehouse.name,
-            discrepancy.get_discrepancy_type_display(),
-            discrepancy.system_batch_number or "-",
-            discrepancy.system_location_label or "-",
-            discrepancy.system_expiry_date.strftime('%Y-%m-%d') if discrepancy.system_expiry_date else "-",
-            discrepancy.system_quantity if discrepancy.system_quantity is not None else "N/A",
-            discrepancy.counted_batch_number or "-",
-            discrepancy.counted_location_label or "-",
-            discrepancy.counted_expiry_date.strftime('%Y-%m-%d') if discrepancy.counted_expiry_date else "-",
-            discrepancy.counted_quantity if discrepancy.counted_quantity is not None else "N/A",
-            discrepancy.discrepancy_quantity,
-            discrepancy.notes or "-",
-            "Yes" if discrepancy.is_resolved else "No",
-            discrepancy.resolution_notes or "-",
-            resolved_by_name or "-",
-            discrepancy.resolved_at.strftime('%Y-%m-%d %H:%M') if discrepancy.resolved_at else "-",
-        ]
-        sheet.append(data_row)
-
-        # Apply alternating row colors for readability (optional)
-        fill_color = "DDEBF7" if row_num % 2 == 0 else "FFFFFF"
-        row_fill = PatternFill(start_color=fill_color, end_color=fill_color, fill_type="solid")
-        for col_num in range(1, len(headers) + 1):
-            sheet.cell(row=row_num, column=col_num).fill = row_fill
-        row_num += 1
-
-    # Auto-size columns (can be slow for very large datasets)
-    # for column_cells in sheet.columns:
-    #     length = max(len(str(cell.value) or "") for cell in column_cells)
-    #     sheet.column_dimensions[get_column_letter(column_cells[0].column)].width = length + 2
-
-    # Prepare the HTTP response
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-    )
     safe_session_name = "".join(c if c.isalnum() else "_" for c in session.name)
-    response['Content-Disposition'] = f'attachment; filename="stock_take_evaluation_{session.pk}_{safe_session_name}.xlsx"'
-    workbook.save(response)
-
-    return response
+    return stream_xlsx(
+        f'stock_take_evaluation_{session.pk}_{safe_session_name}.xlsx', discrepancies, columns,
+        sheet_title=f"Evaluation Report - {session.id}", styled_header=True, banded=True,
+    )
 
 
 @staff_member_required
@@ -1193,85 +1094,42 @@ def download_erp_evaluation_excel(request, session_pk):
         messages.error(request, "You do not have permission to perform this action.")
         return redirect('inventory:erp_stock_check_list')
 
-    session = get_object_or_404(
-        ErpStockCheckSession.objects.select_related(
-            'warehouse', 'uploaded_by', 'evaluated_by'
-        ).prefetch_related(
-            'discrepancies__warehouse_product__product', # For matched items
-            'discrepancies__warehouse_product__warehouse', # For matched items
-            'discrepancies__erp_stock_check_item' # To get raw ERP data if needed
-        ),
-        pk=session_pk
-    )
+    session = get_object_or_404(ErpStockCheckSession, pk=session_pk)
 
     if session.status != 'EVALUATED' and not session.discrepancies.exists():
         messages.warning(request, f"ERP Check Session '{session.name}' has not been evaluated or has no discrepancies.")
         return redirect('inventory:erp_stock_check_detail', session_pk=session.pk)
 
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    sheet.title = f"ERP_Eval_Report_{session.id}"
-
-    headers = [
-        "System Product SKU", "System Product Name", "System Warehouse", # From WarehouseProduct if linked
-        "ERP Warehouse (Raw)", "ERP Product SKU (Raw)", "ERP Product Name (Raw)", # From ErpStockCheckItem or Discrepancy
-        "Discrepancy Type",
-        "System Qty", "ERP Qty", "Discrepancy Qty",
-        "Notes", "Resolved", "Resolution Notes", "Resolved By", "Resolved At"
+    def erp_raw(discrepancy, unmatched_field, item_field):
+        item = discrepancy.erp_stock_check_item
+        return getattr(discrepancy, unmatched_field) or (getattr(item, item_field) if item else "-")
+
+    discrepancies = session.discrepancies.select_related(
+        'warehouse_product__product', 'warehouse_product__warehouse', 'erp_stock_check_item', 'resolved_by',
+    ).order_by('pk')
+    columns = [
+        # System columns come from the WarehouseProduct, when the ERP line was matched to one.
+        Column("System Product SKU", 'warehouse_product.product.sku', default="-", width=22),
+        Column("System Product Name", 'warehouse_product.product.name', default="-", width=22),
+        Column("System Warehouse", 'warehouse_product.warehouse.name', default="-", width=22),
+        Column("ERP Warehouse (Raw)", lambda d: erp_raw(d, 'erp_warehouse_name_for_unmatched', 'erp_warehouse_name_raw'), width=22),
+        Column("ERP Product SKU (Raw)", lambda d: erp_raw(d, 'erp_product_sku_for_unmatched', 'erp_product_sku_raw'), width=22),
+        Column("ERP Product Name (Raw)", lambda d: erp_raw(d, 'erp_product_name_for_unmatched', 'erp_product_name_raw'), width=22),
+        Column("Discrepancy Type", lambda d: d.get_discrepancy_type_display(), width=22),
+        Column("System Qty", 'system_quantity', default="N/A", width=22),
+        Column("ERP Qty", 'erp_quantity', default="N/A", width=22),
+        Column("Discrepancy Qty", 'discrepancy_quantity', width=22),
+        Column("Notes", lambda d: d.notes or "-", width=22),
+        Column("Resolved", lambda d: "Yes" if d.is_resolved else "No", width=22),
+        Column("Resolution Notes", lambda d: d.resolution_notes or "-", width=22),
+        Column("Resolved By", lambda d: (d.resolved_by.name or d.resolved_by.email) if d.resolved_by else "-", width=22),
+        Column("Resolved At", lambda d: d.resolved_at.strftime('%Y-%m-%d %H:%M') if d.resolved_at else "-", width=22),
     ]
-    sheet.append(headers)
-
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid") # Blue
-    for col_num, header_title in enumerate(headers, 1):
-        cell = sheet.cell(row=1, column=col_num)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        sheet.column_dimensions[get_column_letter(col_num)].width = 22
-
-
-    row_num = 2
-    for discrepancy in session.discrepancies.all():
-        system_sku = "-"
-        system_product_name = "-"
-        system_warehouse_name = "-"
-        if discrepancy.warehouse_product:
-            system_sku = discrepancy.warehouse_product.product.sku
-            system_product_name = discrepancy.warehouse_product.product.name
-            system_warehouse_name = discrepancy.warehouse_product.warehouse.name
-
-        erp_wh_raw = discrepancy.erp_warehouse_name_for_unmatched or (discrepancy.erp_stock_check_item.erp_warehouse_name_raw if discrepancy.erp_stock_check_item else "-")
-        erp_sku_raw = discrepancy.erp_product_sku_for_unmatched or (discrepancy.erp_stock_check_item.erp_product_sku_raw if discrepancy.erp_stock_check_item else "-")
-        erp_name_raw = discrepancy.erp_product_name_for_unmatched or (discrepancy.erp_stock_check_item.erp_product_name_raw if discrepancy.erp_stock_check_item else "-")
-
-        resolved_by_name = (discrepancy.resolved_by.name or discrepancy.resolved_by.email) if discrepancy.resolved_by else ""
-
-        data_row = [
-            system_sku, system_product_name, system_warehouse_name,
-            erp_wh_raw, erp_sku_raw, erp_name_raw,
-            discrepancy.get_discrepancy_type_display(),
-            discrepancy.system_quantity if discrepancy.system_quantity is not None else "N/A",
-            discrepancy.erp_quantity if discrepancy.erp_quantity is not None else "N/A",
-            discrepancy.discrepancy_quantity,
-            discrepancy.notes or "-",
-            "Yes" if discrepancy.is_resolved else "No",
-            discrepancy.resolution_notes or "-",
-            resolved_by_name or "-",
-            discrepancy.resolved_at.strftime('%Y-%m-%d %H:%M') if discrepancy.resolved_at else "-",
-        ]
-        sheet.append(data_row)
-        fill_color = "DDEBF7" if row_num % 2 == 0 else "FFFFFF" # Light blue alternating
-        row_fill = PatternFill(start_color=fill_color, end_color=fill_color, fill_type="solid")
-        for col_num in range(1, len(headers) + 1):
-            sheet.cell(row=row_num, column=col_num).fill = row_fill
-        row_num += 1
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     safe_session_name = "".join(c if c.isalnum() else "_" for c in session.name)
-    response['Content-Disposition'] = f'attachment; filename="erp_stock_evaluation_{session.pk}_{safe_session_name}.xlsx"'
-    workbook.save(response)
-    return response
+    return stream_xlsx(
+        f'erp_stock_evaluation_{session.pk}_{safe_session_name}.xlsx', discrepancies, columns,
+        sheet_title=f"ERP_Eval_Report_{session.id}", styled_header=True, banded=True,
+    )
 
 @login_required
 @require_POST # Ensures this action is done via POST for safety
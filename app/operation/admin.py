@@ -11,7 +11,8 @@ from .models import (Order,
                      PackagingType,
                      PackagingTypeMaterialComponent,
                      CourierInvoice,
-                     CourierInvoiceItem
+                     CourierInvoiceItem,
+                     TrackingRefreshRun
                      )
 from inventory.models import PackagingMaterial
 # Inlines allow editing related models on the same page
@@ -227,17 +228,18 @@ class ParcelAdmin(admin.ModelAdmin):
         'shipped_at_formatted',
         'delivered_at_formatted',
     )
-    list_filter = ('courier_company', 'shipped_at', 'order__warehouse', 'created_at', 'created_by')
+    list_filter = ('courier_company', 'shipped_at', 'sla_breached_at', 'order__warehouse', 'created_at', 'created_by')
     search_fields = (
         'parcel_code_system',
         'tracking_number',
         'order__erp_order_id',
         'order__customer__customer_name',
     )
-    readonly_fields = ('created_at','parcel_code_system', 'created_by', 'shipped_at', 'delivered_at') # parcel_code_system is auto-gen
+    readonly_fields = ('created_at','parcel_code_system', 'created_by', 'shipped_at', 'delivered_at', 'tracking_checked_at', 'next_poll_at', 'sla_breached_at', 'latest_event_at', 'latest_event_status', 'latest_event_description') # parcel_code_system is auto-gen
     autocomplete_fields = ['order'] # created_by is set automatically in view
     inlines = [ParcelItemInline]
     date_hierarchy = 'created_at'
+    actions = ['mark_picked_up', 'mark_returned_courier']
 
     fieldsets = (
         (None, {
@@ -246,6 +248,9 @@ class ParcelAdmin(admin.ModelAdmin):
         ('Shipment Details', {
             'fields': ('courier_company', 'tracking_number', 'shipped_at')
         }),
+        ('Tracking', {
+            'fields': ('latest_event_at', 'latest_event_status', 'latest_event_description', 'tracking_checked_at', 'next_poll_at', 'sla_breached_at')
+        }),
         ('Notes & Timestamps', {
             'fields': ('notes', 'created_at', 'created_by') # Added created_by
         }),
@@ -280,6 +285,18 @@ class ParcelAdmin(admin.ModelAdmin):
         return obj.items_in_parcel.count()
     item_in_parcel_count.short_description = 'Items in Parcel'
 
+    def _transition_selected(self, request, queryset, new_status):
+        parcels = Parcel.objects.transition(list(queryset.values_list('pk', flat=True)), new_status, request.user)
+        self.message_user(request, f"{len(parcels)} parcel(s) marked as {dict(Parcel.STATUS_CHOICES)[new_status]}.")
+
+    @admin.action(description="Mark selected parcels as picked up by courier")
+    def mark_picked_up(self, request, queryset):
+        self._transition_selected(request, queryset, 'PICKED_UP')
+
+    @admin.action(description="Mark selected parcels as returned by courier")
+    def mark_returned_courier(self, request, queryset):
+        self._transition_selected(request, queryset, 'RETURNED_COURIER')
+
     def created_by_display(self, obj):
         return obj.created_by.name if obj.created_by and obj.created_by.name else (obj.created_by.email if obj.created_by else "N/A")
     created_by_display.short_description = "Created By"
@@ -338,7 +355,7 @@ class ParcelItemAdmin(admin.ModelAdmin):
 
 @admin.register(CourierCompany)
 class CourierCompanyAdmin(admin.ModelAdmin):
-    list_display = ('name', 'code', 'updated_at')
+    list_display = ('name', 'code', 'transit_sla_days', 'updated_at')
     search_fields = ('name', 'code')
 
 @admin.register(CustomsDeclaration)
@@ -465,3 +482,16 @@ class CourierInvoiceItemAdmin(admin.ModelAdmin):
 
     # You can also add raw_id_fields for easier linking of parcels
     raw_id_fields = ('parcel',)
+
+
+@admin.register(TrackingRefreshRun)
+class TrackingRefreshRunAdmin(admin.ModelAdmin):
+    """
+    Read-only history of tracking refresh runs (operation/tracking_refresh.py).
+    """
+    list_display = ('started_at', 'trigger', 'parcels_selected', 'parcels_updated', 'parcels_skipped', 'parcels_failed', 'finished_at')
+    list_filter = ('trigger',)
+    readonly_fields = ('trigger', 'started_at', 'finished_at', 'parcels_selected', 'parcels_updated', 'parcels_skipped', 'parcels_failed', 'errors')
+
+    def has_add_permission(self, request):
+        return False
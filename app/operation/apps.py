@@ -5,3 +5,6 @@ class OperationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'operation'
 
+
+    def ready(self):
+        from . import signals  # noqa: F401
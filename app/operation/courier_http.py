@@ -0,0 +1,239 @@
+# app/operation/courier_http.py
+"""
+Shared HTTP clients for the courier APIs.
+
+There is one CourierClient per courier in COURIER_CLIENTS. Each client:
+
+- sends every call through one requests.Session. Connections are kept alive
+  and reused, so a call skips the TCP and TLS handshakes;
+- retries connection errors, timeouts, 429 and 5xx. The wait between tries
+  is exponential backoff with full jitter. A Retry-After header is honoured
+  up to the backoff cap;
+- has a circuit breaker. After COURIER_BREAKER_FAILURES calls in a row fail
+  (5xx after the retries, or an exception), the courier is failed fast with
+  CourierUnavailable for COURIER_BREAKER_RESET_SECONDS. Then one trial call
+  goes through, and whatever it ends in closes or re-opens the breaker.
+
+CourierUnavailable is a requests.ConnectionError, so callers that already
+handle requests.RequestException treat an open breaker as a failed call.
+
+cached_token() refreshes an OAuth token single-flight. When the cached token
+has expired, one caller fetches a new one. Concurrent callers wait for that
+token and do not each ask the token endpoint.
+"""
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+COURIER_HTTP_POOL_SIZE = getattr(settings, 'COURIER_HTTP_POOL_SIZE', 10)
+# (connect, read) seconds.
+COURIER_HTTP_TIMEOUT = getattr(settings, 'COURIER_HTTP_TIMEOUT', (3.05, 15))
+COURIER_HTTP_MAX_RETRIES = getattr(settings, 'COURIER_HTTP_MAX_RETRIES', 2)
+COURIER_HTTP_BACKOFF_SECONDS = getattr(settings, 'COURIER_HTTP_BACKOFF_SECONDS', 0.5)
+COURIER_HTTP_MAX_BACKOFF_SECONDS = getattr(settings, 'COURIER_HTTP_MAX_BACKOFF_SECONDS', 8)
+COURIER_BREAKER_FAILURES = getattr(settings, 'COURIER_BREAKER_FAILURES', 5)
+COURIER_BREAKER_RESET_SECONDS = getattr(settings, 'COURIER_BREAKER_RESET_SECONDS', 30)
+# Longest a caller waits for another process to finish refreshing a token before fetching one itself.
+TOKEN_REFRESH_WAIT_SECONDS = 10
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CourierUnavailable(requests.ConnectionError):
+    """Raised without calling the courier while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Thread-safe consecutive-failure circuit breaker.
+
+    CLOSED lets every call through. `failure_threshold` failures in a row
+    make it OPEN: calls are refused for `reset_seconds`. After that it is
+    HALF_OPEN and lets one trial call through. Other calls are refused until
+    the trial's result closes the breaker or opens it again.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'CLOSED', 'OPEN', 'HALF_OPEN'
+
+    def __init__(self, failure_threshold, reset_seconds, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = None
+
+    def allow(self):
+        """Returns whether a call may go through now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self._clock() - self._opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        """Returns True if this failure opened the breaker."""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+                return True
+            return False
+
+
+class CourierClient:
+    """Pooled, retrying HTTP client for one courier API. Safe to share between threads."""
+
+    def __init__(self, name, pool_size=None, timeout=None, max_retries=None, backoff_seconds=None,
+                 max_backoff_seconds=None, breaker=None, sleep=time.sleep):
+        self.name = name
+        self.timeout = timeout or COURIER_HTTP_TIMEOUT
+        self.max_retries = COURIER_HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = COURIER_HTTP_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.max_backoff_seconds = COURIER_HTTP_MAX_BACKOFF_SECONDS if max_backoff_seconds is None else max_backoff_seconds
+        self.breaker = breaker or CircuitBreaker(COURIER_BREAKER_FAILURES, COURIER_BREAKER_RESET_SECONDS)
+        self._sleep = sleep
+
+        self.session = requests.Session()
+        # Retries are done in request(), where the breaker can see them.
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size or COURIER_HTTP_POOL_SIZE, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _backoff(self, attempt, response=None):
+        cap = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(self.max_backoff_seconds, int(retry_after))
+        return random.uniform(0, cap)
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends the request, retrying as described in the module docstring.
+
+        Returns:
+            requests.Response: the last response, which may still be a 429 or
+            5xx once the retries are used up. Callers call raise_for_status().
+
+        Raises:
+            CourierUnavailable: the breaker is open; the courier was not called.
+            requests.RequestException: the last try failed to connect or timed out.
+        """
+        if not self.breaker.allow():
+            raise CourierUnavailable(f"{self.name} API is unavailable; failing fast until the circuit breaker resets.")
+        kwargs.setdefault('timeout', self.timeout)
+
+        # Every way out of the call settles the breaker, so a half-open trial can never leave it stuck.
+        # The courier answering, even with a 429, counts as a success; 5xx and exceptions count as failures.
+        succeeded = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                last_try = attempt == self.max_retries
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if last_try:
+                        raise
+                    logger.warning(f"[{self.name}] {method} {url} failed ({e}); retry {attempt + 1} of {self.max_retries}.")
+                    delay = self._backoff(attempt)
+                else:
+                    if response.status_code not in RETRY_STATUSES or (last_try and response.status_code == 429):
+                        succeeded = True
+                        return response
+                    if last_try:
+                        return response
+                    logger.warning(
+                        f"[{self.name}] {method} {url} returned {response.status_code}; "
+                        f"retry {attempt + 1} of {self.max_retries}."
+                    )
+                    delay = self._backoff(attempt, response)
+                    response.close()
+                self._sleep(delay)
+        finally:
+            if succeeded:
+                self.breaker.record_success()
+            else:
+                self._record_failure()
+
+    def _record_failure(self):
+        if self.breaker.record_failure():
+            logger.error(f"[{self.name}] Circuit breaker opened after {self.breaker.failures} failed calls.")
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+COURIER_CLIENTS = {
+    'dhl': CourierClient('DHL'),
+    'fedex': CourierClient('FedEx'),
+    'ups': CourierClient('UPS'),
+}
+
+
+_token_locks = {}
+_token_locks_guard = threading.Lock()
+
+
+def _token_lock(cache_key):
+    with _token_locks_guard:
+        return _token_locks.setdefault(cache_key, threading.Lock())
+
+
+def cached_token(cache_key, fetch, wait_seconds=TOKEN_REFRESH_WAIT_SECONDS, poll_seconds=0.1):
+    """
+    Returns the token cached under `cache_key`, fetching it single-flight.
+
+    `fetch()` returns (token, cache timeout in seconds), or (None, 0) on failure.
+    Threads of one process queue on a lock. Processes take a short lease with
+    cache.add() on the shared (Redis) cache, and the others poll for the new
+    token.
+    If the lease holder has not finished after `wait_seconds`, the waiter
+    fetches a token itself.
+    """
+    token = cache.get(cache_key)
+    if token:
+        return token
+
+    with _token_lock(cache_key):
+        token = cache.get(cache_key)
+        if token:
+            return token
+
+        lease_key = f'{cache_key}:refreshing'
+        deadline = time.monotonic() + wait_seconds
+        holds_lease = cache.add(lease_key, True, timeout=wait_seconds)
+        while not holds_lease and time.monotonic() < deadline:
+            time.sleep(poll_seconds)
+            token = cache.get(cache_key)
+            if token:
+                return token
+            holds_lease = cache.add(lease_key, True, timeout=wait_seconds)
+        try:
+            token, timeout = fetch()
+            if token:
+                cache.set(cache_key, token, timeout=max(1, timeout))
+            return token
+        finally:
+            # A caller that gave up waiting never took the lease, and must not drop another process's.
+            if holds_lease:
+                cache.delete(lease_key)
@@ -0,0 +1,111 @@
+# app/operation/invoice_reconciliation.py
+"""
+Set-based reconciliation of courier invoice lines against CourierInvoiceItem.
+
+The invoice parsers in operation.services turn a file into InvoiceLine
+objects and hand them to reconcile_invoice_lines(). For each chunk of
+tracking numbers it:
+
+- loads the matching parcels with one IN query and the existing invoice items
+  with another, the latter locked FOR UPDATE so two uploads billing the same
+  tracking number cannot lose a charge;
+- applies every line in file order in memory. A tracking number already
+  billed gets the charge added to actual_cost and appended to cost_history.
+  It takes the line's values for the courier's update_fields, and is linked
+  to its parcel if it was not linked yet. A new tracking number becomes a new
+  item, and later lines for it in the same file update that item;
+- writes the result with one bulk_create and one bulk_update.
+
+Dispute fields are never written, so dispute state survives re-billing.
+"""
+from django.conf import settings
+
+from .models import CourierInvoiceItem, Parcel
+
+INVOICE_RECONCILE_CHUNK_SIZE = getattr(settings, 'INVOICE_RECONCILE_CHUNK_SIZE', 2000)
+
+
+class InvoiceLine:
+    """
+    One billed charge for a tracking number.
+
+    Args:
+        tracking_number (str)
+        cost (Decimal): added to the item's actual_cost.
+        charge (dict): appended to the item's cost_history.
+        fields (dict): other CourierInvoiceItem values (weights, receiver_state,
+            destination_name), used in full for a new item and as update_fields
+            allow for an existing one.
+    """
+
+    def __init__(self, tracking_number, cost, charge, **fields):
+        self.tracking_number = tracking_number
+        self.cost = cost
+        self.charge = charge
+        self.fields = fields
+
+
+def _chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def reconcile_invoice_lines(invoice, lines, update_fields=(), chunk_size=None):
+    """
+    Bills `lines` to `invoice`. Call inside a transaction.
+
+    Args:
+        invoice (CourierInvoice): becomes every touched item's courier_invoice.
+        lines (list[InvoiceLine]): in file order.
+        update_fields: the `fields` of a line that overwrite an existing item.
+
+    Returns:
+        tuple: (created, updated) line counts. A tracking number that is new
+        and then repeated in the file counts once as created and then once per
+        repeat as updated.
+    """
+    chunk_size = chunk_size or INVOICE_RECONCILE_CHUNK_SIZE
+    lines_by_number = {}
+    for line in lines:
+        lines_by_number.setdefault(line.tracking_number, []).append(line)
+
+    created, updated = 0, 0
+    written_fields = ['courier_invoice', 'actual_cost', 'cost_history', 'parcel', *update_fields]
+    for tracking_numbers in _chunks(list(lines_by_number), chunk_size):
+        parcels = {}
+        # Newest parcel first, as Parcel.objects.filter(tracking_number=...).first() picked.
+        for parcel in Parcel.objects.filter(tracking_number__in=tracking_numbers).order_by('-created_at', '-pk'):
+            parcels.setdefault(parcel.tracking_number, parcel)
+        existing = {
+            item.tracking_number: item
+            for item in CourierInvoiceItem.objects.select_for_update().filter(tracking_number__in=tracking_numbers)
+        }
+
+        to_create, to_update = [], []
+        for tracking_number in tracking_numbers:
+            parcel = parcels.get(tracking_number)
+            item = existing.get(tracking_number)
+            for line in lines_by_number[tracking_number]:
+                if item is None:
+                    item = CourierInvoiceItem(
+                        tracking_number=tracking_number, courier_invoice=invoice, actual_cost=line.cost,
+                        cost_history=[line.charge], parcel=parcel, **line.fields,
+                    )
+                    to_create.append(item)
+                    created += 1
+                    continue
+                item.actual_cost += line.cost
+                item.courier_invoice = invoice
+                for field in update_fields:
+                    setattr(item, field, line.fields.get(field))
+                if parcel and not item.parcel_id:
+                    item.parcel = parcel
+                item.cost_history = (item.cost_history or []) + [line.charge]
+                updated += 1
+            if item.pk:
+                to_update.append(item)
+
+        CourierInvoiceItem.objects.bulk_create(to_create, batch_size=chunk_size)
+        if to_update:
+            CourierInvoiceItem.objects.bulk_update(to_update, written_fields, batch_size=chunk_size)
+    return created, updated
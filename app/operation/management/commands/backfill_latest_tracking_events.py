@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from operation.services import backfill_latest_tracking_events
+
+
+class Command(BaseCommand):
+    '''Fills the parcels' latest tracking event fields from their tracking logs.'''
+
+    help = (
+        "Copies every parcel's newest tracking log onto Parcel.latest_event_at, "
+        "latest_event_status and latest_event_description, one UPDATE per batch. "
+        "Run once after deploying the fields; tracking ingestion keeps them current "
+        "afterwards. Safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Parcels per UPDATE statement.')
+
+    def handle(self, *args, **options):
+        '''Entry point for command.'''
+        backfilled = backfill_latest_tracking_events(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{backfilled} parcels backfilled."))
@@ -0,0 +1,82 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from inventory.models import Product
+from warehouse.models import Warehouse
+from operation.order_import import commit_order_import
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    '''Benchmarks the bulk order import commit engine against synthetic files.'''
+
+    help = (
+        "Runs commit_order_import on synthetic import files of increasing size and "
+        "reports lines/second and query counts. All data is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[500, 1000, 5000, 10000],
+                            help='Number of spreadsheet lines per run.')
+        parser.add_argument('--lines-per-order', type=int, default=3)
+        parser.add_argument('--products', type=int, default=200)
+
+    def _build_rows(self, size, lines_per_order, warehouse, products, run_tag):
+        rows = []
+        for line in range(size):
+            order_no = line // lines_per_order
+            product = products[line % len(products)]
+            rows.append({
+                'Order_ID': f"BENCH-{run_tag}-{order_no}",
+                'Order_Date': '2025-01-15',
+                'Warehouse_name': warehouse.name,
+                'Customer_Name': f"Bench Customer {run_tag}-{order_no % 250}",
+                'company': '-',
+                'phone': str(60100000000 + order_no % 250),
+                'Product_Name': product.name,
+                'Quantity': 1 + line % 5,
+                'isCold': 'no',
+                'confirmed_product_id': product.pk,
+            })
+        return rows
+
+    def handle(self, *args, **options):
+        '''Entry point for command.'''
+        user = get_user_model().objects.filter(is_superuser=True).first()
+        self.stdout.write(f"{'lines':>8} {'orders':>8} {'seconds':>9} {'lines/s':>10} {'queries':>8}")
+
+        for size in options['sizes']:
+            run_tag = uuid.uuid4().hex[:6]
+            try:
+                with transaction.atomic():
+                    warehouse = Warehouse.objects.create(name=f"Bench Warehouse {run_tag}")
+                    products = Product.objects.bulk_create([
+                        Product(sku=f"BENCH-{run_tag}-{i}", name=f"Bench Product {run_tag} {i}", price=1)
+                        for i in range(options['products'])
+                    ])
+                    rows = self._build_rows(size, options['lines_per_order'], warehouse, products, run_tag)
+
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        created, updated, errors = commit_order_import(rows, user)
+                        elapsed = time.perf_counter() - started
+
+                    self.stdout.write(
+                        f"{size:>8} {created + updated:>8} {elapsed:>9.3f} "
+                        f"{size / elapsed if elapsed else 0:>10.0f} {len(queries):>8}"
+                    )
+                    if errors:
+                        self.stdout.write(self.style.WARNING(f"  {len(errors)} orders reported errors, e.g. {errors[0]}"))
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished; all benchmark data was rolled back.'))
@@ -0,0 +1,61 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from operation.parcel_codes import PARCEL_CODE_ALPHABET, allocate_parcel_codes
+
+LEGACY_CODE_SPACE = len(PARCEL_CODE_ALPHABET) ** 4
+
+
+class Command(BaseCommand):
+    '''Benchmarks parcel code allocation as the parcel table fills up.'''
+
+    help = (
+        "Compares the legacy random-code loop with the sequence allocator at increasing "
+        "fill levels of the 4-character code space. The legacy loop's existence checks "
+        "are simulated; the sequence allocator runs against the database and never reads "
+        "the parcel table, so its cost does not depend on the fill level. Allocating "
+        "consumes sequence values, which only leaves gaps in the codes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fill-levels', nargs='+', type=float, default=[0.0, 0.25, 0.5, 0.75, 0.9, 0.99],
+                            help='Fractions of the legacy 4-character code space already taken.')
+        parser.add_argument('--codes', type=int, default=1000, help='Codes allocated per fill level.')
+        parser.add_argument('--batch-size', type=int, default=100, help='Codes per sequence allocation query.')
+
+    def _legacy_round_trips(self, fill, codes):
+        # Each attempt is one SELECT ... EXISTS; an attempt hits a taken code with probability `fill`.
+        round_trips = 0
+        for _ in range(codes):
+            round_trips += 1
+            while random.random() < fill:
+                round_trips += 1
+        return round_trips
+
+    def handle(self, *args, **options):
+        '''Entry point for command.'''
+        codes, batch_size = options['codes'], options['batch_size']
+        self.stdout.write(
+            f"{'fill':>6} {'taken codes':>12} {'legacy queries/code':>20} "
+            f"{'sequence queries/code':>22} {'sequence us/code':>17}"
+        )
+        for fill in options['fill_levels']:
+            legacy = self._legacy_round_trips(fill, codes) / codes
+
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                allocated = 0
+                while allocated < codes:
+                    allocated += len(allocate_parcel_codes(min(batch_size, codes - allocated)))
+                elapsed = time.perf_counter() - started
+
+            self.stdout.write(
+                f"{fill:>6.2f} {int(fill * LEGACY_CODE_SPACE):>12} {legacy:>20.2f} "
+                f"{len(queries) / codes:>22.3f} {elapsed / codes * 1e6:>17.1f}"
+            )
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished.'))
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-16 21:13
+
+from django.conf import settings
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0024_alter_packagingstocktransaction_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('operation', '0051_alter_packagingtype_options_packagingtype_warehouse_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_filename', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('STAGED', 'Staged'), ('COMMITTED', 'Committed')], db_index=True, default='STAGED', max_length=20)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('committed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_import_batches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Order Import Batch',
+                'verbose_name_plural': 'Order Import Batches',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row_index', models.PositiveIntegerField(help_text="Position of the line among the batch's valid rows.")),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='The parsed row as produced by the import reader.')),
+                ('similarity_score', models.PositiveSmallIntegerField(default=0)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='operation.importbatch')),
+                ('confirmed_product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.product')),
+                ('suggested_product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.product')),
+            ],
+            options={
+                'ordering': ['row_index'],
+                'unique_together': {('batch', 'row_index')},
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-16 21:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('operation', '0052_importbatch_importrow'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importbatch',
+            name='status',
+            field=models.CharField(choices=[('PARSING', 'Parsing'), ('STAGED', 'Staged'), ('COMMITTING', 'Committing'), ('COMMITTED', 'Committed'), ('FAILED', 'Failed')], db_index=True, default='STAGED', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='OrderImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('STAGE', 'Read file'), ('COMMIT', 'Create orders')], max_length=10)),
+                ('state', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed')], db_index=True, default='PENDING', max_length=10)),
+                ('source_file', models.FileField(blank=True, help_text='The uploaded file, kept until it has been read.', upload_to='order_imports/')),
+                ('rows_total', models.PositiveIntegerField(default=0)),
+                ('rows_processed', models.PositiveIntegerField(default=0)),
+                ('orders_created', models.PositiveIntegerField(default=0)),
+                ('orders_updated', models.PositiveIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list, help_text='Per-order problems reported by the job.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='operation.importbatch')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_import_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Order Import Job',
+                'verbose_name_plural': 'Order Import Jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
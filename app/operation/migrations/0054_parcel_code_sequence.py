@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-16 21:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operation', '0053_alter_importbatch_status_orderimportjob'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE SEQUENCE IF NOT EXISTS operation_parcel_code_seq START WITH 1",
+            reverse_sql="DROP SEQUENCE IF EXISTS operation_parcel_code_seq",
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-16 22:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operation', '0054_parcel_code_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parcel',
+            name='tracking_checked_at',
+            field=models.DateTimeField(blank=True, help_text="When the courier API was last asked for this parcel's tracking.", null=True),
+        ),
+        migrations.CreateModel(
+            name='TrackingRefreshRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigger', models.CharField(choices=[('SCHEDULED', 'Scheduled'), ('MANUAL', 'Manual')], default='SCHEDULED', max_length=10)),
+                ('started_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('parcels_selected', models.PositiveIntegerField(default=0)),
+                ('parcels_updated', models.PositiveIntegerField(default=0, help_text='Parcels whose tracking was fetched and applied.')),
+                ('parcels_skipped', models.PositiveIntegerField(default=0, help_text="Parcels with no courier API, or not reached within the run's rate limits.")),
+                ('parcels_failed', models.PositiveIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list, help_text='Per-parcel failures, capped.')),
+            ],
+            options={
+                'verbose_name': 'Tracking Refresh Run',
+                'verbose_name_plural': 'Tracking Refresh Runs',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
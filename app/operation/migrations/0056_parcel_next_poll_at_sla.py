@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operation', '0055_parcel_tracking_checked_at_trackingrefreshrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='couriercompany',
+            name='transit_sla_days',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Days an in-flight parcel may take from shipment before it is flagged as breaching the transit SLA. Blank uses TRACKING_DEFAULT_TRANSIT_SLA_DAYS.', null=True),
+        ),
+        migrations.AddField(
+            model_name='parcel',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When the scheduled tracking refresh should next ask the courier API about this parcel.', null=True),
+        ),
+        migrations.AddField(
+            model_name='parcel',
+            name='sla_breached_at',
+            field=models.DateTimeField(blank=True, help_text="When the parcel was found still in flight past its courier's transit SLA.", null=True),
+        ),
+    ]
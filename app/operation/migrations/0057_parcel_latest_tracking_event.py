@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operation', '0056_parcel_next_poll_at_sla'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parcel',
+            name='latest_event_at',
+            field=models.DateTimeField(blank=True, help_text='Timestamp of the newest tracking event.', null=True),
+        ),
+        migrations.AddField(
+            model_name='parcel',
+            name='latest_event_description',
+            field=models.CharField(blank=True, default='', help_text='Description of the newest tracking event.', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='parcel',
+            name='latest_event_status',
+            field=models.CharField(blank=True, choices=[('IN_TRANSIT', 'In Transit'), ('DELIVERED', 'Delivered')], default='', help_text='Simplified status of the newest tracking event.', max_length=20),
+            preserve_default=False,
+        ),
+    ]
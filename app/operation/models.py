@@ -2,8 +2,7 @@
 from django.db import models, transaction as db_transaction
 from django.conf import settings
 from django.utils import timezone
-from django.db.models import Sum, Q, F
-from django.apps import apps
+from django.db.models import Sum, Q, F, Case, When, Value, IntegerField
 from django.core.serializers.json import DjangoJSONEncoder
 
 
@@ -12,28 +11,110 @@ import random
 import string
 import logging
 import json
+from collections import defaultdict
 from decimal import Decimal
 
 from inventory.models import Product, InventoryBatchItem, StockTransaction, PackagingMaterial
 from warehouse.models import Warehouse, WarehouseProduct
 from customers.models import Customer
 
+from .parcel_codes import allocate_parcel_codes
+from .order_status import (
+    mark_orders_dirty, recompute_order_statuses, recompute_order_items, SHIPPED_PARCEL_STATUSES,
+)
+
 logger = logging.getLogger(__name__)
 
 def generate_parcel_code(warehouse_name=None, order_erp_id=None, order_date=None):
     """
-    Generates a 4-character random code that is guaranteed to be unique
-    by checking against the correct field in the Parcel model.
+    Legacy random 4-character code. Kept without database access for the
+    historical migrations that import it; new parcels get their codes from
+    operation.parcel_codes.allocate_parcel_codes.
     """
-    Parcel = apps.get_model('operation', 'Parcel')
     char_set = "123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+    return ''.join(random.choices(char_set, k=4))
+
+
+def grouped_delta(deltas):
+    """CASE expression mapping each pk in `deltas` to its delta, for one grouped UPDATE."""
+    return Case(
+        *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
 
-    while True:
-        new_code = ''.join(random.choices(char_set, k=4))
+# Parcel statuses that put shipped stock back into its batches.
+PARCEL_RETURN_STATUSES = ['RETURNED_COURIER', 'CANCELLED']
+# Timestamp field stamped when a parcel enters each status.
+PARCEL_STATUS_TIMESTAMP_FIELDS = {
+    'PICKED_UP': 'shipped_at',
+    'RETURNED_COURIER': 'returned_at',
+    'CANCELLED': 'cancelled_at',
+    'DELIVERED': 'delivered_at',
+    'BILLED': 'billed_at',
+}
+# An in-transit parcel whose courier reports no events for this long is marked DELIVERY_FAILED.
+TRACKING_DELIVERY_FAILED_DAYS = getattr(settings, 'TRACKING_DELIVERY_FAILED_DAYS', 20)
+# Stored values Parcel.save() compares against to tell what changed since the row was read.
+PARCEL_LOADED_FIELDS = ('status', 'tracking_number', *PARCEL_STATUS_TIMESTAMP_FIELDS.values())
 
-        # Corrected from 'code' to 'parcel_code_system'
-        if not Parcel.objects.filter(parcel_code_system=new_code).exists():
-            return new_code
+
+def return_parcel_stock(parcels, user=None):
+    """
+    Puts the stock shipped in `parcels` back into its batches: one grouped
+    UPDATE each for the batches, their warehouse products and the order items,
+    and one bulk insert of RETURN_IN stock transactions. Each parcel's `status`
+    must already hold the return status it is moving to.
+    """
+    parcels_by_pk = {parcel.pk: parcel for parcel in parcels}
+    parcel_items = list(
+        ParcelItem.objects.filter(
+            parcel__in=parcels_by_pk,
+            shipped_from_batch__isnull=False,
+            quantity_shipped_in_this_parcel__gt=0,
+        ).select_related('shipped_from_batch__warehouse_product__warehouse', 'shipped_from_batch__warehouse_product__product')
+    )
+    if not parcel_items:
+        return
+
+    returned_by_batch = defaultdict(int)
+    returned_by_warehouse_product = defaultdict(int)
+    returned_by_order_item = defaultdict(int)
+    stock_transactions = []
+    for item in parcel_items:
+        parcel = parcels_by_pk[item.parcel_id]
+        batch = item.shipped_from_batch
+        returned_qty = item.quantity_shipped_in_this_parcel
+        returned_by_batch[batch.pk] += returned_qty
+        returned_by_warehouse_product[batch.warehouse_product_id] += returned_qty
+        returned_by_order_item[item.order_item_id] += returned_qty
+        stock_transactions.append(StockTransaction(
+            warehouse=batch.warehouse_product.warehouse,
+            warehouse_product=batch.warehouse_product,
+            product=batch.warehouse_product.product,
+            transaction_type=StockTransaction.TransactionTypes.RETURN_IN,
+            quantity=returned_qty,
+            batch_item_involved=batch,
+            reference_note=f"{parcel.get_status_display()} - P:{parcel.parcel_code_system}, O:{parcel.order.erp_order_id}, B:{batch.batch_number}",
+            related_order=parcel.order,
+            recorded_by=user,
+        ))
+
+    InventoryBatchItem.objects.filter(pk__in=returned_by_batch).update(
+        quantity=F('quantity') + grouped_delta(returned_by_batch)
+    )
+    WarehouseProduct.objects.filter(pk__in=returned_by_warehouse_product).update(
+        quantity=F('quantity') + grouped_delta(returned_by_warehouse_product),
+        batched_quantity=F('batched_quantity') + grouped_delta(returned_by_warehouse_product),
+    )
+    OrderItem.objects.filter(pk__in=returned_by_order_item).update(
+        quantity_returned_to_stock=F('quantity_returned_to_stock') + grouped_delta(returned_by_order_item),
+        quantity_shipped=F('quantity_shipped') - grouped_delta(returned_by_order_item),
+        status='ITEM_RETURNED_RESTOCKED',
+    )
+    StockTransaction.objects.bulk_create(stock_transactions)
+    logger.info(f"Returned stock for {len(parcel_items)} parcel items across {len(parcels_by_pk)} parcels to {len(returned_by_batch)} batches.")
 
 
 
@@ -41,6 +122,10 @@ class CourierCompany(models.Model):
     name = models.CharField(max_length=100, unique=True)
     code = models.CharField(max_length=20, unique=True, blank=True, null=True, help_text="Short code for the courier, e.g., DHL, FEDEX")
     is_active = models.BooleanField(default=True, help_text="Uncheck this to hide the courier from selection lists.") # ADD THIS LINE
+    transit_sla_days = models.PositiveSmallIntegerField(
+        null=True, blank=True,
+        help_text="Days an in-flight parcel may take from shipment before it is flagged as breaching the transit SLA. Blank uses TRACKING_DEFAULT_TRANSIT_SLA_DAYS.",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -128,55 +213,22 @@ class Order(models.Model):
         return total_removed
 
     def update_status_based_on_items_and_parcels(self):
-        current_status_before_update = self.status
-        logger.debug(f"Order {self.erp_order_id}: Starting update_status. Current status: {current_status_before_update}")
-
-        terminal_statuses = ['DELIVERED', 'ADJUSTED_TO_CLOSE', 'INVOICE_ISSUED', 'CANCELLED']
-        if current_status_before_update in terminal_statuses and not (current_status_before_update in ['RETURNED_COURIER', 'DELIVERY_FAILED'] and self.items.filter(status__in=['PENDING_PROCESSING', 'PACKED', 'ITEM_SHIPPED']).exists()):
-            logger.debug(f"Order {self.erp_order_id}: In terminal status {current_status_before_update}. No status change.")
-            return
-
-        if not self.items.exists():
-            self.status = 'NEW_ORDER'
-            if current_status_before_update != self.status:
-                logger.info(f"Order {self.erp_order_id} status updated to {self.get_status_display()} (no items). Prev: {current_status_before_update}")
-            self.save(update_fields=['status'])
-            return
-
-        all_items_accounted_for = True
-        any_item_partially_or_fully_packed = False
-
-        for item in self.items.all():
-            total_removed_for_item = self.get_total_removed_quantity_for_item(item.id)
-            effective_ordered_qty = item.quantity_ordered
-            if (item.quantity_packed + total_removed_for_item) < effective_ordered_qty:
-                all_items_accounted_for = False
-            if item.quantity_packed > 0:
-                any_item_partially_or_fully_packed = True
-
-        new_status_candidate = self.status
-        if all_items_accounted_for:
-            if any_item_partially_or_fully_packed:
-                 new_status_candidate = 'FULLY_SHIPPED'
-            elif self.status == 'PARTIALLY_SHIPPED':
-                 new_status_candidate = 'FULLY_SHIPPED'
-        elif any_item_partially_or_fully_packed or (self.items_removed_log and len(self.items_removed_log) > 0):
-             new_status_candidate = 'PARTIALLY_SHIPPED'
-        else:
-             new_status_candidate = 'NEW_ORDER'
-
-        if self.status != new_status_candidate:
-            self.status = new_status_candidate
-            logger.info(f"Order {self.erp_order_id} status auto-updated (considering removed items): {current_status_before_update} -> {self.get_status_display()}.")
-        else:
-            logger.debug(f"Order {self.erp_order_id}: Status remains {self.get_status_display()} (considering removed items).")
+        """
+        Recomputes and stores this order's status now. Saves that touch the
+        order's items or parcels should call mark_orders_dirty instead, which
+        coalesces the recomputation into one query on commit.
+        """
+        changed = recompute_order_statuses([self.pk])
+        if self.pk in changed:
+            self.status = changed[self.pk]
 
     def save(self, *args, **kwargs):
         if self.erp_order_id is not None and not isinstance(self.erp_order_id, str):
             self.erp_order_id = str(self.erp_order_id)
-        if not self._state.adding:
-             self.update_status_based_on_items_and_parcels()
+        is_new_order = self._state.adding
         super().save(*args, **kwargs)
+        if not is_new_order:
+            mark_orders_dirty([self.pk])
 
 class OrderItem(models.Model):
     ITEM_STATUS_CHOICES = [
@@ -229,8 +281,72 @@ class OrderItem(models.Model):
     def save(self, *args, **kwargs):
         skip_order_update_flag = kwargs.pop('skip_order_update', False)
         super().save(*args, **kwargs)
-        if not skip_order_update_flag and self.order:
-             self.order.save()
+        if not skip_order_update_flag and self.order_id:
+            mark_orders_dirty([self.order_id])
+
+class ParcelManager(models.Manager):
+
+    def transition(self, parcel_ids, new_status, user=None):
+        """
+        Moves many parcels to `new_status` in one transaction, applying the
+        same timestamp, restock and OrderItem rules as Parcel.save() with
+        grouped UPDATEs and bulk inserts instead of per-parcel saves.
+
+        Returns:
+            list: the parcels, with their new status and timestamps.
+        """
+        timestamp_field = PARCEL_STATUS_TIMESTAMP_FIELDS.get(new_status)
+        now = timezone.now()
+        with db_transaction.atomic():
+            parcels = list(self.select_for_update(of=('self',)).select_related('order').filter(pk__in=parcel_ids))
+            changing = [parcel for parcel in parcels if parcel.status != new_status]
+            returning = [
+                parcel for parcel in changing
+                if new_status in PARCEL_RETURN_STATUSES and parcel.status in SHIPPED_PARCEL_STATUSES
+            ]
+
+            changing_pks = {parcel.pk for parcel in changing}
+            if changing:
+                changes = {'status': new_status}
+                if timestamp_field:
+                    changes[timestamp_field] = now
+                self.filter(pk__in=changing_pks).update(**changes)
+            if timestamp_field:
+                # A parcel already in the status gets its timestamp only if it is missing.
+                self.filter(
+                    pk__in=[parcel.pk for parcel in parcels if parcel.pk not in changing_pks],
+                    **{f'{timestamp_field}__isnull': True},
+                ).update(**{timestamp_field: now})
+
+            for parcel in parcels:
+                if timestamp_field and (parcel.pk in changing_pks or getattr(parcel, timestamp_field) is None):
+                    setattr(parcel, timestamp_field, now)
+                parcel.status = new_status
+                parcel._remember_loaded_values()
+
+            if returning:
+                return_parcel_stock(returning, user=user)
+            if changing:
+                recompute_order_items(
+                    ParcelItem.objects.filter(parcel__in=changing).values_list('order_item_id', flat=True),
+                    new_status,
+                )
+            mark_orders_dirty([parcel.order_id for parcel in parcels])
+
+        logger.info(f"Parcel transition to {new_status}: {len(changing)} of {len(parcels)} parcels changed, {len(returning)} restocked.")
+        return parcels
+
+
+LATEST_EVENT_STATUS_CHOICES = [
+    ('IN_TRANSIT', 'In Transit'),
+    ('DELIVERED', 'Delivered'),
+]
+
+
+def simplify_tracking_description(description):
+    """The LATEST_EVENT_STATUS_CHOICES key for a courier event description."""
+    return 'DELIVERED' if 'delivered' in (description or '').lower() else 'IN_TRANSIT'
+
 
 class Parcel(models.Model):
 
@@ -309,7 +425,15 @@ class Parcel(models.Model):
         help_text="Estimated shipping cost for this parcel."
     )
     actual_shipping_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    tracking_checked_at = models.DateTimeField(null=True, blank=True, help_text="When the courier API was last asked for this parcel's tracking.")
+    next_poll_at = models.DateTimeField(null=True, blank=True, db_index=True, help_text="When the scheduled tracking refresh should next ask the courier API about this parcel.")
+    sla_breached_at = models.DateTimeField(null=True, blank=True, help_text="When the parcel was found still in flight past its courier's transit SLA.")
+    # Copy of the newest ParcelTrackingLog, kept by tracking ingestion so lists never read the logs.
+    latest_event_at = models.DateTimeField(null=True, blank=True, help_text="Timestamp of the newest tracking event.")
+    latest_event_status = models.CharField(max_length=20, choices=LATEST_EVENT_STATUS_CHOICES, blank=True, help_text="Simplified status of the newest tracking event.")
+    latest_event_description = models.CharField(max_length=255, blank=True, help_text="Description of the newest tracking event.")
 
+    objects = ParcelManager()
 
     class Meta:
         ordering = ['-created_at']
@@ -336,112 +460,99 @@ class Parcel(models.Model):
     @property
     def simplified_tracking_status(self):
         """
-        Returns a simplified status string based on the latest tracking log
-        and the time since the parcel was shipped.
+        Returns a simplified status string based on the latest tracking event
+        and the time since the parcel was shipped. Reads only the parcel's own
+        latest_event_* fields.
         """
         if not self.tracking_number:
             return ""
 
-        latest_log = self.tracking_logs.first()
-
-        if not latest_log:
+        if not self.latest_event_at:
             return "Awaiting Tracking Update"
 
         # Rule 1: If the latest status description contains "Delivered"
-        if 'delivered' in latest_log.status_description.lower():
+        if self.latest_event_status == 'DELIVERED':
             return "Delivered"
 
-        # Rule 3: If status is "In Transit" for more than 20 days
+        # Rule 3: If status is "In Transit" for more than TRACKING_DELIVERY_FAILED_DAYS
         if self.shipped_at:
             days_in_transit = (timezone.now() - self.shipped_at).days
-            if days_in_transit > 20:
+            if days_in_transit > TRACKING_DELIVERY_FAILED_DAYS:
                 return "Failed"
 
         # Rule 2: If none of the above, it's "In Transit"
         return "In Transit"
 
+    def set_latest_tracking_event(self, timestamp, description):
+        """
+        Records the event as the parcel's latest unless a newer one is already
+        recorded. Does not save.
+
+        Returns:
+            list: names of the fields that changed.
+        """
+        if timestamp is None or (self.latest_event_at and timestamp < self.latest_event_at):
+            return []
+        values = {
+            'latest_event_at': timestamp,
+            'latest_event_status': simplify_tracking_description(description),
+            'latest_event_description': (description or '')[:255],
+        }
+        changed = [field for field, value in values.items() if getattr(self, field) != value]
+        for field in changed:
+            setattr(self, field, values[field])
+        return changed
+
     def get_packaging_type_display(self):
         if self.packaging_type:
             return self.packaging_type.name
         return "N/A"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status and timestamps so save() can detect changes without re-reading the row.
+        if all(field in instance.__dict__ for field in PARCEL_LOADED_FIELDS):
+            instance._remember_loaded_values()
+        return instance
+
+    def _remember_loaded_values(self):
+        self._loaded_values = {field: getattr(self, field) for field in PARCEL_LOADED_FIELDS}
+
     def save(self, *args, **kwargs):
         old_status = None
         is_new_parcel = self._state.adding
         original_tracking_number = None
+        loaded_values = {}
 
         if not is_new_parcel and self.pk:
-            try:
-                previous_instance = Parcel.objects.get(pk=self.pk)
-                old_status = previous_instance.status
-                original_tracking_number = previous_instance.tracking_number
-            except Parcel.DoesNotExist:
-                pass
+            loaded_values = getattr(self, '_loaded_values', None)
+            if loaded_values is None:
+                loaded_values = Parcel.objects.filter(pk=self.pk).values(*PARCEL_LOADED_FIELDS).first() or {}
+            old_status = loaded_values.get('status')
+            original_tracking_number = loaded_values.get('tracking_number')
 
         if not self.parcel_code_system:
-            while True:
-                wh_name = self.order.warehouse.name if self.order and self.order.warehouse else None
-                erp_id = self.order.erp_order_id if self.order else None
-                new_code = generate_parcel_code(warehouse_name=wh_name, order_erp_id=erp_id)
-                if not Parcel.objects.filter(parcel_code_system=new_code).exclude(pk=self.pk).exists():
-                    self.parcel_code_system = new_code
-                    break
+            self.parcel_code_system = allocate_parcel_codes(1)[0]
 
         if self.status == 'PREPARING_TO_PACK' and self.tracking_number and self.courier_company:
             if is_new_parcel or (old_status == 'PREPARING_TO_PACK' and not original_tracking_number):
                 self.status = 'READY_TO_SHIP'
                 logger.info(f"Parcel {self.parcel_code_system}: Status auto-changed to READY_TO_SHIP.")
 
-        if self.status == 'PICKED_UP' and (old_status != 'PICKED_UP' or not self.shipped_at):
-            self.shipped_at = timezone.now()
-        elif self.status == 'RETURNED_COURIER' and (old_status != 'RETURNED_COURIER' or not self.returned_at):
-            self.returned_at = timezone.now()
-        elif self.status == 'CANCELLED' and (old_status != 'CANCELLED' or not self.cancelled_at):
-            self.cancelled_at = timezone.now()
-        elif self.status == 'DELIVERED' and (old_status != 'DELIVERED' or not self.delivered_at):
-            self.delivered_at = timezone.now()
-        elif self.status == 'BILLED' and (old_status != 'BILLED' or not self.billed_at):
-            self.billed_at = timezone.now()
-
-        stock_deducted_states = ['PICKED_UP', 'IN_TRANSIT', 'DELIVERED', 'DELIVERY_FAILED']
-        is_status_change_to_return_or_cancel = self.status in ['RETURNED_COURIER', 'CANCELLED']
-        was_stock_previously_deducted = old_status in stock_deducted_states
-        needs_stock_return = is_status_change_to_return_or_cancel and was_stock_previously_deducted
+        timestamp_field = PARCEL_STATUS_TIMESTAMP_FIELDS.get(self.status)
+        if timestamp_field:
+            stamp = getattr(self, timestamp_field)
+            # Keep a time the caller set, such as the courier's delivery scan; otherwise stamp the transition now.
+            set_by_caller = stamp is not None and stamp != loaded_values.get(timestamp_field)
+            if not set_by_caller and (old_status != self.status or not stamp):
+                setattr(self, timestamp_field, timezone.now())
 
+        needs_stock_return = self.status in PARCEL_RETURN_STATUSES and old_status in SHIPPED_PARCEL_STATUSES
         if needs_stock_return:
             logger.info(f"Parcel {self.id} status changed from {old_status} to {self.status}. Processing stock return.")
             with db_transaction.atomic():
-                for item_in_parcel in self.items_in_parcel.select_related('shipped_from_batch__warehouse_product__warehouse', 'shipped_from_batch__warehouse_product__product', 'order_item').all():
-                    if item_in_parcel.shipped_from_batch and item_in_parcel.quantity_shipped_in_this_parcel > 0:
-                        if item_in_parcel.order_item.status == 'ITEM_RETURNED_RESTOCKED' and old_status == self.status:
-                             logger.warning(f"Stock for OI {item_in_parcel.order_item.id} in ParcelItem {item_in_parcel.id} seems already restocked. Skipping additional return.")
-                             continue
-                        batch = item_in_parcel.shipped_from_batch
-                        returned_qty = item_in_parcel.quantity_shipped_in_this_parcel
-                        original_batch_qty = batch.quantity
-                        batch.quantity = F('quantity') + returned_qty
-                        batch.save(update_fields=['quantity'])
-                        batch.refresh_from_db()
-                        logger.info(f"Batch {batch.id} quantity: {original_batch_qty} -> {batch.quantity} (+{returned_qty})")
-                        StockTransaction.objects.create(
-                            warehouse=batch.warehouse_product.warehouse,
-                            warehouse_product=batch.warehouse_product,
-                            product=batch.warehouse_product.product,
-                            transaction_type='RETURN_IN',
-                            quantity=returned_qty,
-                            reference_note=f"{self.get_status_display()} - P:{self.parcel_code_system}, O:{self.order.erp_order_id}, B:{batch.batch_number}",
-                            related_order=self.order
-                        )
-                        order_item = item_in_parcel.order_item
-                        original_oi_returned_qty = order_item.quantity_returned_to_stock
-                        order_item.quantity_returned_to_stock = F('quantity_returned_to_stock') + returned_qty
-                        order_item.status = 'ITEM_RETURNED_RESTOCKED'
-                        order_item.quantity_shipped = F('quantity_shipped') - returned_qty
-                        order_item.save(update_fields=['quantity_returned_to_stock', 'quantity_shipped', 'status'])
-                        order_item.refresh_from_db()
-                        logger.info(f"OI {order_item.id} returned_qty: {original_oi_returned_qty} -> {order_item.quantity_returned_to_stock}, shipped_qty reduced, status -> ITEM_RETURNED_RESTOCKED")
-                    else:
-                        logger.warning(f"ParcelItem {item_in_parcel.id} for Parcel {self.id} has no batch or zero quantity, skipping stock return.")
+                return_parcel_stock([self])
 
         if self.declared_value is not None:
             conversion_rate = Decimal('4.3')
@@ -452,12 +563,12 @@ class Parcel(models.Model):
             self.declared_value_myr = None
 
         super().save(*args, **kwargs)
+        self._remember_loaded_values()
 
-        if old_status != self.status or is_new_parcel:
-            for pi in self.items_in_parcel.all():
-                pi.save()
-        elif self.order:
-            self.order.save()
+        if old_status != self.status and not is_new_parcel:
+            recompute_order_items(self.items_in_parcel.values_list('order_item_id', flat=True), self.status)
+        if self.order_id:
+            mark_orders_dirty([self.order_id])
 
 class ParcelItem(models.Model):
     parcel = models.ForeignKey(Parcel, on_delete=models.CASCADE, related_name='items_in_parcel')
@@ -516,7 +627,7 @@ class ParcelItem(models.Model):
                 elif self.order_item.quantity_packed == 0 :
                      self.order_item.status = 'PENDING_PROCESSING'
             self.order_item.save(skip_order_update=True)
-            self.order_item.order.save()
+            mark_orders_dirty([self.order_item.order_id])
 
     @db_transaction.atomic
     def delete(self, *args, **kwargs):
@@ -536,7 +647,7 @@ class ParcelItem(models.Model):
                 else:
                     oi.status = 'PACKED'
             oi.save(skip_order_update=True)
-            oi.order.save()
+            mark_orders_dirty([oi.order_id])
 
 class CustomsDeclaration(models.Model):
     description = models.TextField(help_text="Unique description of the goods for customs purposes.")
@@ -835,3 +946,133 @@ class ProductMapping(models.Model):
 
     def __str__(self):
         return f'"{self.imported_name}" -> "{self.mapped_product.name}"'
+
+
+class ImportBatch(models.Model):
+    """
+    An uploaded order file staged for confirmation. Its rows live in ImportRow,
+    so nothing about the import is kept in the user's session.
+    """
+    STATUS_CHOICES = [
+        ('PARSING', 'Parsing'),
+        ('STAGED', 'Staged'),
+        ('COMMITTING', 'Committing'),
+        ('COMMITTED', 'Committed'),
+        ('FAILED', 'Failed'),
+    ]
+
+    original_filename = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='STAGED', db_index=True)
+    row_count = models.PositiveIntegerField(default=0)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_import_batches')
+    created_at = models.DateTimeField(auto_now_add=True)
+    committed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Order Import Batch"
+        verbose_name_plural = "Order Import Batches"
+
+    def __str__(self):
+        return f"Import #{self.pk} ({self.original_filename or 'unnamed file'}, {self.row_count} rows)"
+
+
+class ImportRow(models.Model):
+    """
+    A single parsed spreadsheet line of an ImportBatch together with its
+    suggested and user-confirmed product.
+    """
+    batch = models.ForeignKey(ImportBatch, on_delete=models.CASCADE, related_name='rows')
+    row_index = models.PositiveIntegerField(help_text="Position of the line among the batch's valid rows.")
+    data = models.JSONField(encoder=DjangoJSONEncoder, help_text="The parsed row as produced by the import reader.")
+    suggested_product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    similarity_score = models.PositiveSmallIntegerField(default=0)
+    confirmed_product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        ordering = ['row_index']
+        unique_together = ('batch', 'row_index')
+
+    def __str__(self):
+        return f"Import #{self.batch_id} row {self.row_index}: {self.data.get('Product_Name')}"
+
+
+class OrderImportJob(models.Model):
+    """
+    A background (Celery) step of an order import: parsing the uploaded file
+    into its ImportBatch, or committing the confirmed batch as orders.
+    """
+    KIND_CHOICES = [
+        ('STAGE', 'Read file'),
+        ('COMMIT', 'Create orders'),
+    ]
+    STATE_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('SUCCEEDED', 'Succeeded'),
+        ('FAILED', 'Failed'),
+    ]
+    ACTIVE_STATES = ['PENDING', 'RUNNING']
+
+    batch = models.ForeignKey(ImportBatch, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='PENDING', db_index=True)
+    source_file = models.FileField(upload_to='order_imports/', blank=True, help_text="The uploaded file, kept until it has been read.")
+    rows_total = models.PositiveIntegerField(default=0)
+    rows_processed = models.PositiveIntegerField(default=0)
+    orders_created = models.PositiveIntegerField(default=0)
+    orders_updated = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True, help_text="Per-order problems reported by the job.")
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_import_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Order Import Job"
+        verbose_name_plural = "Order Import Jobs"
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job #{self.pk} for import #{self.batch_id} ({self.state})"
+
+    @property
+    def is_active(self):
+        return self.state in self.ACTIVE_STATES
+
+    @property
+    def progress_percent(self):
+        if not self.rows_total:
+            return 100 if self.state == 'SUCCEEDED' else 0
+        return min(100, int(self.rows_processed * 100 / self.rows_total))
+
+
+class TrackingRefreshRun(models.Model):
+    """
+    Summary of one pass of operation.tracking_refresh over in-flight parcels,
+    run on the Celery beat schedule or from 'Trace Selected'.
+    """
+    TRIGGER_CHOICES = [
+        ('SCHEDULED', 'Scheduled'),
+        ('MANUAL', 'Manual'),
+    ]
+
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES, default='SCHEDULED')
+    started_at = models.DateTimeField(default=timezone.now, db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    parcels_selected = models.PositiveIntegerField(default=0)
+    parcels_updated = models.PositiveIntegerField(default=0, help_text="Parcels whose tracking was fetched and applied.")
+    parcels_skipped = models.PositiveIntegerField(default=0, help_text="Parcels with no courier API, or not reached within the run's rate limits.")
+    parcels_failed = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True, help_text="Per-parcel failures, capped.")
+
+    class Meta:
+        ordering = ['-started_at']
+        verbose_name = "Tracking Refresh Run"
+        verbose_name_plural = "Tracking Refresh Runs"
+
+    def __str__(self):
+        return (
+            f"{self.get_trigger_display()} tracking refresh at {self.started_at:%Y-%m-%d %H:%M}: "
+            f"{self.parcels_updated} updated, {self.parcels_skipped} skipped, {self.parcels_failed} failed"
+        )
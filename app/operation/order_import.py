@@ -0,0 +1,694 @@
+# app/operation/order_import.py
+"""
+Streaming reader and bulk commit engine for the Excel order import.
+
+Uploaded files are read with a streaming row pipeline (sheet rows -> header
+mapping -> Order_ID forward-fill -> validation) so only one spreadsheet row is
+held in memory by the reader at a time.
+
+The confirmation step of the import produces one dict per spreadsheet line
+(see `import_orders_from_excel`). Committing those rows one query at a time
+does not scale to month-end ERP exports, so this module takes the orders in
+bounded chunks, resolves every warehouse, product, warehouse product, customer
+and existing order of a chunk with a handful of IN (...) queries, then writes
+the chunk's orders and their items with bulk_create/bulk_update. Only one
+chunk of orders is held in memory at a time.
+
+Every order of a chunk is validated before it is written. An order that cannot
+be imported is reported in the returned error list and skipped; the rest of
+the file is still committed.
+
+Between upload and commit the parsed rows are staged in the ImportBatch and
+ImportRow tables, written in chunks while the file streams, so the
+confirmation page can be paginated and the commit reads them back with a
+server-side cursor instead of round-tripping the whole file via the session.
+
+Both the file read and the commit run as OrderImportJob background jobs (see
+operation/tasks.py), which record their progress for the order list page.
+"""
+import logging
+from itertools import islice
+
+import openpyxl
+import pandas as pd
+import xlrd
+
+from django.db import transaction, IntegrityError
+from django.db.models.fields.json import KT
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from inventory.models import Product
+from inventory.reservations import reserve_order_items
+from warehouse.models import Warehouse, WarehouseProduct
+from customers.utils import normalize_phone, customer_import_keys, resolve_customers_from_import
+
+from .models import Order, OrderItem, ParcelItem, ProductMapping, ImportBatch, ImportRow, OrderImportJob
+from .product_matching import get_product_match_index, get_learned_mappings, invalidate_learned_mappings
+
+logger = logging.getLogger(__name__)
+
+# Number of orders written per transaction. Each chunk commits on its own so
+# a large file never holds row locks for the whole import.
+ORDER_IMPORT_CHUNK_SIZE = 500
+# batch_size handed to bulk_create/bulk_update.
+ORDER_IMPORT_BATCH_SIZE = 1000
+
+COLD_FLAG_VALUES = ['yes', 'true', '1']
+
+# Internal row key -> column header expected in the uploaded file.
+ORDER_IMPORT_HEADER_MAP = {
+    'Order_ID': 'Order ID', 'Order_Date': 'Order date', 'Warehouse_name': 'Warehouse name',
+    'title': 'title', 'comment': 'comment', 'Customer_Name': 'Address name', 'company': 'company',
+    'address': 'address', 'country': 'country', 'city': 'city', 'state': 'state',
+    'zip': 'zip', 'phone': 'phone', 'email': 'Email', 'Vat_number': 'Vat number',
+    'Product_Name': 'Product name', 'Quantity': 'Product quantity', 'isCold': 'isCold'
+}
+ORDER_IMPORT_REQUIRED_KEYS = ['Order_ID', 'Product_Name', 'Quantity']
+# Keys that belong to the line itself and are never forward-filled from the order's first row.
+ORDER_IMPORT_LINE_KEYS = ['Product_Name', 'Quantity', 'isCold']
+
+
+def _clean_value(value):
+    """Returns None for blank/NaN spreadsheet cells, the value otherwise."""
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+def _clean_phone(phone_raw):
+    phone_raw = _clean_value(phone_raw)
+    if not phone_raw:
+        return None
+    # Numeric cells arrive as floats (60123456789.0); drop the decimal part before stripping non-digits.
+    if isinstance(phone_raw, float) and phone_raw.is_integer():
+        phone_raw = int(phone_raw)
+    return normalize_phone(phone_raw) or None
+
+
+def _parse_order_date(order_date_raw):
+    parsed = pd.to_datetime(order_date_raw, errors='coerce')
+    if pd.isna(parsed):
+        return timezone.now().date()
+    return parsed.date()
+
+
+def _iter_xlsx_values(excel_file):
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        for row_values in workbook.active.iter_rows(min_row=1, values_only=True):
+            yield row_values
+    finally:
+        workbook.close()
+
+
+def _iter_xls_values(excel_file):
+    # BIFF (.xls) files cannot be parsed incrementally; when the upload was spooled
+    # to disk xlrd memory-maps it instead of holding a second copy in memory.
+    if hasattr(excel_file, 'temporary_file_path'):
+        workbook = xlrd.open_workbook(excel_file.temporary_file_path(), on_demand=True)
+    else:
+        workbook = xlrd.open_workbook(file_contents=excel_file.read(), on_demand=True)
+    try:
+        sheet = workbook.sheet_by_index(0)
+        for row_idx in range(sheet.nrows):
+            yield sheet.row_values(row_idx)
+    finally:
+        workbook.release_resources()
+
+
+def _map_rows(rows_iterator, index_map):
+    """Turns raw sheet rows into row dicts keyed by ORDER_IMPORT_HEADER_MAP keys, skipping blank rows."""
+    for row_idx, row_values in enumerate(rows_iterator, start=2):
+        if not any(c is not None and str(c).strip() for c in row_values):
+            continue
+        row_dict = {key: row_values[idx] if idx < len(row_values) else None for key, idx in index_map.items()}
+        row_dict['row_number'] = row_idx
+        yield row_dict
+
+
+def _clean_rows(row_dicts):
+    for row_dict in row_dicts:
+        order_id_raw = row_dict.get('Order_ID')
+        if order_id_raw:
+            try:
+                row_dict['Order_ID'] = str(int(float(order_id_raw)))
+            except (ValueError, TypeError):
+                row_dict['Order_ID'] = str(order_id_raw).strip()
+
+        company_raw = row_dict.get('company')
+        row_dict['company'] = str(company_raw).strip() if company_raw and pd.notna(company_raw) else '-'
+        yield row_dict
+
+
+def _forward_fill_orders(row_dicts):
+    """Continuation lines of an order leave Order_ID blank; copy the order-level fields from the order's first line."""
+    last_order_details = {}
+    for row_dict in row_dicts:
+        if not row_dict.get('Order_ID'):
+            row_dict.update({k: v for k, v in last_order_details.items() if k not in ORDER_IMPORT_LINE_KEYS + ['row_number']})
+        else:
+            last_order_details = row_dict.copy()
+        yield row_dict
+
+
+def _valid_rows(row_dicts):
+    for row_dict in row_dicts:
+        if all(row_dict.get(key) for key in ORDER_IMPORT_REQUIRED_KEYS):
+            yield row_dict
+
+
+def read_order_import_rows(excel_file):
+    """
+    Opens an uploaded .xlsx/.xls order file and returns a generator of validated
+    row dicts. The header row is read eagerly so format and header problems are
+    reported before any row is consumed.
+
+    Raises:
+        ValueError: if the file format is unsupported, the file is empty, or a
+        required header is missing.
+    """
+    file_name = excel_file.name.lower()
+    if file_name.endswith('.xlsx'):
+        rows_iterator = _iter_xlsx_values(excel_file)
+    elif file_name.endswith('.xls'):
+        rows_iterator = _iter_xls_values(excel_file)
+    else:
+        raise ValueError("Unsupported file format. Please use .xlsx or .xls.")
+
+    header_values = next(rows_iterator, None)
+    if header_values is None:
+        raise ValueError("The uploaded file is empty.")
+    headers = [str(h).strip() if h is not None else '' for h in header_values]
+
+    missing = [v for k, v in ORDER_IMPORT_HEADER_MAP.items() if k in ORDER_IMPORT_REQUIRED_KEYS and v not in headers]
+    if missing:
+        rows_iterator.close()
+        raise ValueError(f"Required headers not found in file: {', '.join(missing)}")
+
+    index_map = {key: headers.index(value) for key, value in ORDER_IMPORT_HEADER_MAP.items() if value in headers}
+    return _valid_rows(_forward_fill_orders(_clean_rows(_map_rows(rows_iterator, index_map))))
+
+
+def _row_product_name(row):
+    return str(row.get('Product_Name', '')).strip()
+
+
+def stage_order_import(rows, batch, chunk_size=ORDER_IMPORT_CHUNK_SIZE, progress=None):
+    """
+    Writes parsed import rows into `batch`, `chunk_size` rows per bulk insert,
+    together with a suggested product for each line. Rows already staged for
+    the batch (from an interrupted earlier run) are replaced.
+
+    Learned ProductMapping entries take priority (score 100); every other
+    distinct product name is fuzzy-matched once across the whole file.
+
+    `progress`, if given, is called with the number of rows written after each
+    chunk. Chunks are committed as they are written so progress is visible to
+    other connections.
+
+    Returns:
+        ImportBatch: the staged batch. Its row_count is 0 if `rows` was empty.
+    """
+    learned_mappings = get_learned_mappings()
+    match_index = get_product_match_index()
+    suggestions = {}
+
+    batch.rows.all().delete()
+    rows = iter(rows)
+    row_index = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        new_names = {_row_product_name(row) for row in chunk} - suggestions.keys()
+        suggestions.update({name: (learned_mappings[name], 100) for name in new_names if name in learned_mappings})
+        suggestions.update(match_index.match(name for name in new_names if name not in suggestions))
+        suggestions.update({name: (None, 0) for name in new_names if name not in suggestions})
+
+        staged_rows = []
+        for row in chunk:
+            suggested_product_id, score = suggestions[_row_product_name(row)]
+            staged_rows.append(ImportRow(
+                batch=batch, row_index=row_index, data=row,
+                suggested_product_id=suggested_product_id, similarity_score=score,
+            ))
+            row_index += 1
+        ImportRow.objects.bulk_create(staged_rows, batch_size=ORDER_IMPORT_BATCH_SIZE)
+        if progress:
+            progress(len(chunk))
+
+    batch.row_count = row_index
+    batch.status = 'STAGED'
+    batch.save(update_fields=['row_count', 'status'])
+
+    logger.info(f"[OrderImport] Staged {row_index} rows as import batch {batch.pk}.")
+    return batch
+
+
+def iter_staged_rows(batch, by_order=False):
+    """
+    Yields the batch's rows as import row dicts, in file order, through a
+    server-side cursor. With `by_order`, the rows come grouped by Order_ID
+    (file order within each order), as commit_order_import needs them.
+    'confirmed_product_id' falls back to the suggestion for rows the user did
+    not change.
+    """
+    ordering = (KT('data__Order_ID'), 'row_index') if by_order else ('row_index',)
+    staged_rows = (
+        batch.rows.order_by(*ordering)
+        .values_list('data', 'confirmed_product_id', 'suggested_product_id')
+        .iterator(chunk_size=ORDER_IMPORT_BATCH_SIZE)
+    )
+    for data, confirmed_product_id, suggested_product_id in staged_rows:
+        data['confirmed_product_id'] = confirmed_product_id or suggested_product_id
+        yield data
+
+
+def group_rows_by_order(rows, orders_per_group):
+    """
+    Groups the confirmed import rows by their (string) Order_ID and yields
+    {order_id: rows} dicts of at most `orders_per_group` orders, keeping file
+    order. An order's rows must be adjacent, as iter_staged_rows(batch,
+    by_order=True) yields them, so that only one group is held in memory.
+    """
+    orders = {}
+    for row in rows:
+        order_id = str(row.get('Order_ID'))
+        if order_id not in orders and len(orders) >= orders_per_group:
+            yield orders
+            orders = {}
+        orders.setdefault(order_id, []).append(row)
+    if orders:
+        yield orders
+
+
+def _resolve_warehouses(orders):
+    names = set()
+    for items in orders.values():
+        name = _clean_value(items[0].get('Warehouse_name'))
+        if name:
+            names.add(str(name).strip().lower())
+    if not names:
+        return {}
+    warehouses = {}
+    for warehouse in Warehouse.objects.annotate(name_lower=Lower('name')).filter(name_lower__in=names).order_by('pk'):
+        warehouses.setdefault(warehouse.name_lower, warehouse)
+    return warehouses
+
+
+def _cell_text(value):
+    """Text of a spreadsheet cell; whole-number floats (e.g. ZIP 50450.0) lose their decimal part."""
+    value = _clean_value(value)
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _customer_record(plan):
+    first_item = plan['items'][0]
+    return {
+        'customer_name': plan['customer_name'],
+        'company_name': first_item.get('company', ''),
+        'phone_number': plan['phone'],
+        'email': _clean_value(first_item.get('email')),
+        'address_info': {
+            'address_line1': first_item.get('address') or '',
+            'city': first_item.get('city') or '',
+            'state': first_item.get('state') or '',
+            'zip_code': _cell_text(first_item.get('zip')),
+            'country': first_item.get('country') or '',
+        },
+        'vat_number': first_item.get('Vat_number'),
+    }
+
+
+def _resolve_customers(plans):
+    """
+    Resolves the customer of every planned order with one bulk lookup by
+    normalized phone, email and name + ZIP code, bulk-creating the customers
+    that do not exist yet (see customers.utils.resolve_customers_from_import).
+    """
+    records = {plan['order_id']: _customer_record(plan) for plan in plans}
+    customers = resolve_customers_from_import(records.values())
+
+    errors = {}
+    for plan in plans:
+        record = records[plan['order_id']]
+        keys = customer_import_keys(record['customer_name'], record['phone_number'], record['email'], record['address_info']['zip_code'])
+        customer = customers.get(keys[0]) if keys else None
+        if not customer:
+            errors[plan['order_id']] = f"Order {plan['order_id']}: could not resolve customer '{plan['customer_name']}'."
+            continue
+        plan['customer'] = customer
+    return errors
+
+
+def _resolve_warehouse_products(plans):
+    """
+    Returns a {(warehouse_id, product_id): WarehouseProduct} map for every line in
+    the plans, bulk-creating the missing pairs with a zero quantity.
+    """
+    pairs = {(plan['warehouse'].pk, line['product'].pk) for plan in plans for line in plan['lines']}
+    if not pairs:
+        return {}
+
+    def _load():
+        warehouse_ids = {w for w, _ in pairs}
+        product_ids = {p for _, p in pairs}
+        return {
+            (wp.warehouse_id, wp.product_id): wp
+            for wp in WarehouseProduct.objects.filter(warehouse_id__in=warehouse_ids, product_id__in=product_ids)
+            if (wp.warehouse_id, wp.product_id) in pairs
+        }
+
+    warehouse_products = _load()
+    missing = pairs - set(warehouse_products)
+    if missing:
+        WarehouseProduct.objects.bulk_create(
+            [WarehouseProduct(warehouse_id=w, product_id=p, quantity=0) for w, p in missing],
+            batch_size=ORDER_IMPORT_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        logger.info(f"[OrderImport] Created {len(missing)} missing warehouse products.")
+        warehouse_products = _load()
+    return warehouse_products
+
+
+def _build_plans(orders):
+    """
+    Validates every order group against data resolved in bulk. Returns the list of
+    importable order plans and a list of per-order error messages.
+    """
+    errors = []
+    warehouses = _resolve_warehouses(orders)
+
+    product_ids = set()
+    for items in orders.values():
+        for item in items:
+            try:
+                product_ids.add(int(item['confirmed_product_id']))
+            except (KeyError, ValueError, TypeError):
+                pass
+    products = Product.objects.in_bulk(product_ids) if product_ids else {}
+
+    existing_orders = Order.objects.in_bulk(list(orders), field_name='erp_order_id') if orders else {}
+    orders_with_shipments = set()
+    if existing_orders:
+        orders_with_shipments = set(
+            ParcelItem.objects.filter(order_item__order__in=existing_orders.values())
+            .values_list('order_item__order__erp_order_id', flat=True)
+            .distinct()
+        )
+
+    plans = []
+    for order_id, items in orders.items():
+        first_item = items[0]
+
+        warehouse_name = _clean_value(first_item.get('Warehouse_name'))
+        if not warehouse_name:
+            errors.append(f"Order {order_id}: 'Warehouse name' is missing.")
+            continue
+        warehouse = warehouses.get(str(warehouse_name).strip().lower())
+        if not warehouse:
+            errors.append(f"Order {order_id}: Warehouse '{warehouse_name}' not found.")
+            continue
+
+        if order_id in orders_with_shipments:
+            errors.append(f"Order {order_id}: already has packed items and cannot be re-imported.")
+            continue
+
+        lines = []
+        line_error = None
+        for item_data in items:
+            product = None
+            try:
+                product = products.get(int(item_data['confirmed_product_id']))
+            except (KeyError, ValueError, TypeError):
+                pass
+            if not product:
+                line_error = f"Order {order_id}: product for '{item_data.get('Product_Name')}' not found."
+                break
+            try:
+                quantity = int(float(item_data.get('Quantity', 0)))
+            except (ValueError, TypeError):
+                line_error = f"Order {order_id}: invalid quantity '{item_data.get('Quantity')}' for '{item_data.get('Product_Name')}'."
+                break
+            lines.append({
+                'product': product,
+                'quantity': quantity,
+                'erp_product_name': str(item_data.get('Product_Name', '')).strip()[:255],
+                'is_cold': str(item_data.get('isCold')).lower() in COLD_FLAG_VALUES,
+            })
+        if line_error:
+            errors.append(line_error)
+            continue
+
+        plans.append({
+            'order_id': order_id,
+            'items': items,
+            'lines': lines,
+            'warehouse': warehouse,
+            'existing_order': existing_orders.get(order_id),
+            'phone': _clean_phone(first_item.get('phone')),
+            'customer_name': first_item.get('Customer_Name', '') or '',
+            'order_date': _parse_order_date(first_item.get('Order_Date')),
+            'title_notes': first_item.get('title'),
+            'shipping_notes': first_item.get('comment'),
+            'is_cold': any(line['is_cold'] for line in lines),
+        })
+    return plans, errors
+
+
+def _write_chunk(plans, warehouse_products, user):
+    now = timezone.now()
+    orders_to_create, orders_to_update = [], []
+
+    for plan in plans:
+        order = plan['existing_order'] or Order(erp_order_id=plan['order_id'])
+        order.customer = plan['customer']
+        order.order_date = plan['order_date']
+        order.warehouse = plan['warehouse']
+        order.title_notes = plan['title_notes']
+        order.shipping_notes = plan['shipping_notes']
+        order.status = 'NEW_ORDER'
+        order.imported_by = user
+        if plan['is_cold']:
+            order.is_cold_chain = True
+        if plan['existing_order']:
+            order.last_updated_at = now
+            orders_to_update.append(order)
+        else:
+            orders_to_create.append(order)
+        plan['order'] = order
+
+    if orders_to_update:
+        Order.objects.bulk_update(
+            orders_to_update,
+            ['customer', 'order_date', 'warehouse', 'title_notes', 'shipping_notes',
+             'status', 'imported_by', 'is_cold_chain', 'last_updated_at'],
+            batch_size=ORDER_IMPORT_BATCH_SIZE,
+        )
+        OrderItem.objects.filter(order__in=orders_to_update).delete()
+    if orders_to_create:
+        Order.objects.bulk_create(orders_to_create, batch_size=ORDER_IMPORT_BATCH_SIZE)
+
+    order_items = []
+    for plan in plans:
+        for line in plan['lines']:
+            order_items.append(OrderItem(
+                order=plan['order'],
+                product=line['product'],
+                warehouse_product=warehouse_products[(plan['warehouse'].pk, line['product'].pk)],
+                erp_product_name=line['erp_product_name'],
+                quantity_ordered=line['quantity'],
+                is_cold_item=line['is_cold'],
+            ))
+    OrderItem.objects.bulk_create(order_items, batch_size=ORDER_IMPORT_BATCH_SIZE)
+    # Promise stock to the new items in the same transaction; short items stay unreserved until restocked.
+    reserve_order_items(order_items)
+    return len(orders_to_create), len(orders_to_update)
+
+
+def _commit_orders(orders, user, errors):
+    """Validates and writes one chunk of orders in its own transaction, adding skipped orders to `errors`."""
+    plans, plan_errors = _build_plans(orders)
+    errors.extend(plan_errors)
+    if not plans:
+        return 0, 0
+
+    with transaction.atomic():
+        customer_errors = _resolve_customers(plans)
+    if customer_errors:
+        errors.extend(customer_errors.values())
+        plans = [plan for plan in plans if plan['order_id'] not in customer_errors]
+        if not plans:
+            return 0, 0
+
+    warehouse_products = _resolve_warehouse_products(plans)
+    try:
+        with transaction.atomic():
+            created, updated = _write_chunk(plans, warehouse_products, user)
+    except IntegrityError as e:
+        logger.error(f"[OrderImport] Chunk of {len(plans)} orders failed: {e}", exc_info=True)
+        errors.extend(f"Order {plan['order_id']}: not imported because its batch failed ({e})." for plan in plans)
+        return 0, 0
+    logger.info(f"[OrderImport] Committed chunk: {created} created, {updated} updated.")
+    return created, updated
+
+
+def commit_order_import(rows, user, chunk_size=ORDER_IMPORT_CHUNK_SIZE, progress=None):
+    """
+    Creates or replaces the orders described by the confirmed import rows.
+
+    Each row must carry a 'confirmed_product_id', and the rows of one order
+    must be adjacent (see group_rows_by_order). Orders are validated and
+    committed in chunks of `chunk_size`, each in its own transaction. Orders
+    are matched on erp_order_id, so running the same rows again updates rather
+    than duplicates them.
+
+    `progress`, if given, is called with the number of rows handled after each
+    chunk, skipped orders included.
+
+    Returns:
+        tuple: (created_count, updated_count, errors) where errors is a list of
+        per-order messages for orders that were skipped.
+    """
+    created_count, updated_count, errors = 0, 0, []
+    for orders in group_rows_by_order(rows, chunk_size):
+        try:
+            created, updated = _commit_orders(orders, user, errors)
+        finally:
+            if progress:
+                progress(sum(len(items) for items in orders.values()))
+        created_count += created
+        updated_count += updated
+
+    return created_count, updated_count, errors
+
+
+def learn_product_mappings(rows):
+    """
+    Remembers the confirmed product of every imported product name for future
+    imports. Names are deduplicated (the last confirmed row wins) and only
+    mappings that are new or point to a different product are written, in a
+    single upsert.
+
+    Returns:
+        int: the number of mappings created or changed.
+    """
+    confirmed = {}
+    for item_row in rows:
+        imported_name = _row_product_name(item_row)
+        if imported_name and item_row.get('confirmed_product_id'):
+            confirmed[imported_name[:255]] = int(item_row['confirmed_product_id'])
+
+    learned_mappings = get_learned_mappings()
+    changed = {name: product_id for name, product_id in confirmed.items() if learned_mappings.get(name) != product_id}
+    if not changed:
+        return 0
+
+    ProductMapping.objects.bulk_create(
+        [ProductMapping(imported_name=name, mapped_product_id=product_id) for name, product_id in changed.items()],
+        batch_size=ORDER_IMPORT_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['imported_name'],
+        update_fields=['mapped_product', 'last_used_at'],
+    )
+    # bulk_create sends no model signals.
+    invalidate_learned_mappings()
+    logger.info(f"[OrderImport] Learned/updated {len(changed)} product mappings.")
+    return len(changed)
+
+
+def _progress_recorder(job):
+    def record(rows):
+        job.rows_processed += rows
+        OrderImportJob.objects.filter(pk=job.pk).update(rows_processed=job.rows_processed)
+    return record
+
+
+def _run_stage_job(job):
+    batch = job.batch
+    try:
+        with job.source_file.open('rb') as source_file:
+            rows = read_order_import_rows(source_file)
+            stage_order_import(rows, batch, progress=_progress_recorder(job))
+    except ValueError as e:
+        job.errors = [str(e)]
+        return False
+
+    job.rows_total = batch.row_count
+    if not batch.row_count:
+        job.errors = ["No valid order items could be parsed from the file."]
+        return False
+    # The staged rows now hold everything the file had to offer.
+    job.source_file.delete(save=False)
+    return True
+
+
+def _run_commit_job(job):
+    batch = job.batch
+    job.rows_total = batch.row_count
+    ImportBatch.objects.filter(pk=batch.pk).update(status='COMMITTING')
+
+    learn_product_mappings(iter_staged_rows(batch))
+    created_count, updated_count, errors = commit_order_import(
+        iter_staged_rows(batch, by_order=True), job.created_by, progress=_progress_recorder(job),
+    )
+    job.orders_created, job.orders_updated, job.errors = created_count, updated_count, errors
+
+    batch.rows.all().delete()
+    batch.status = 'COMMITTED'
+    batch.committed_at = timezone.now()
+    batch.save(update_fields=['status', 'committed_at'])
+    return True
+
+
+def run_order_import_job(job_id):
+    """
+    Runs an OrderImportJob to completion. Safe to call again for a job that was
+    interrupted: staging replaces the batch's rows and the commit upserts orders
+    by erp_order_id. Jobs that already succeeded are left alone.
+
+    Returns:
+        OrderImportJob: the job in its final state.
+    """
+    job = OrderImportJob.objects.select_related('batch', 'created_by').get(pk=job_id)
+    if job.state == 'SUCCEEDED':
+        logger.info(f"[OrderImport] Job {job.pk} already succeeded; skipping.")
+        return job
+
+    job.state, job.started_at, job.finished_at = 'RUNNING', timezone.now(), None
+    job.rows_processed, job.errors = 0, []
+    job.save(update_fields=['state', 'started_at', 'finished_at', 'rows_processed', 'errors'])
+    logger.info(f"[OrderImport] Job {job.pk} ({job.kind}) started for import batch {job.batch_id}.")
+
+    try:
+        succeeded = _run_stage_job(job) if job.kind == 'STAGE' else _run_commit_job(job)
+    except Exception as e:
+        logger.error(f"[OrderImport] Job {job.pk} failed: {e}", exc_info=True)
+        job.errors = [f"An unexpected error occurred: {e}"]
+        succeeded = False
+
+    if succeeded:
+        job.state = 'SUCCEEDED'
+        job.rows_processed = job.rows_total
+    else:
+        job.state = 'FAILED'
+        # A failed commit leaves the batch staged so it can be confirmed again.
+        ImportBatch.objects.filter(pk=job.batch_id).update(status='FAILED' if job.kind == 'STAGE' else 'STAGED')
+    job.finished_at = timezone.now()
+    job.save(update_fields=[
+        'state', 'rows_total', 'rows_processed', 'orders_created', 'orders_updated', 'errors', 'source_file', 'finished_at',
+    ])
+    logger.info(f"[OrderImport] Job {job.pk} finished: {job.state}.")
+    return job
@@ -0,0 +1,206 @@
+# app/operation/order_status.py
+"""
+Deferred, coalesced recomputation of Order.status, and the set-based
+recomputation of OrderItem packed/shipped quantities it builds on.
+
+Saving a ParcelItem, OrderItem, Parcel or Order used to re-run the order's
+status rules straight away, so one packing or tracking operation recomputed the
+same order many times. Now those saves only call `mark_orders_dirty`. The ids
+are collected for the current transaction and `recompute_order_statuses` runs
+once for all of them in `transaction.on_commit`. Outside a transaction the
+recomputation happens immediately.
+
+The recomputation is a single UPDATE ... FROM over the orders, their items and
+the quantities recorded in `items_removed_log`. It applies the rules of
+Order.update_status_based_on_items_and_parcels:
+
+- orders in a terminal status are left alone;
+- an order without items is NEW_ORDER;
+- when every item is packed or removed, the order is FULLY_SHIPPED if anything
+  was packed (or it was already PARTIALLY_SHIPPED), otherwise it keeps its status;
+- otherwise it is PARTIALLY_SHIPPED if anything was packed or removed, else NEW_ORDER.
+"""
+import logging
+import threading
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_ORDER_STATUSES = ['DELIVERED', 'ADJUSTED_TO_CLOSE', 'INVOICE_ISSUED', 'CANCELLED']
+# Parcel statuses in which the packed goods have left the warehouse.
+SHIPPED_PARCEL_STATUSES = ['PICKED_UP', 'IN_TRANSIT', 'DELIVERED', 'DELIVERY_FAILED']
+# OrderItem statuses that parcel status changes never override.
+FINAL_ORDER_ITEM_STATUSES = ['ITEM_RETURNED_RESTOCKED', 'ITEM_CANCELLED', 'ITEM_BILLED']
+
+_RECOMPUTE_SQL = """
+WITH removed AS (
+    SELECT o.id AS order_id,
+           (entry->>'order_item_id')::numeric AS order_item_id,
+           SUM((entry->>'removed_qty')::numeric) AS quantity
+    FROM {order_table} o
+    CROSS JOIN LATERAL jsonb_array_elements(
+        CASE WHEN jsonb_typeof(o.items_removed_log) = 'array' THEN o.items_removed_log ELSE '[]'::jsonb END
+    ) AS entry
+    WHERE o.id = ANY(%(order_ids)s)
+      AND jsonb_typeof(entry) = 'object'
+      AND jsonb_typeof(entry->'order_item_id') = 'number'
+      AND jsonb_typeof(entry->'removed_qty') = 'number'
+    GROUP BY 1, 2
+),
+totals AS (
+    SELECT o.id AS order_id,
+           COUNT(i.id) AS item_count,
+           COUNT(i.id) FILTER (WHERE i.quantity_packed + COALESCE(r.quantity, 0) < i.quantity_ordered) AS open_items,
+           COUNT(i.id) FILTER (WHERE i.quantity_packed > 0) AS packed_items,
+           COALESCE(jsonb_typeof(o.items_removed_log) = 'array'
+                    AND jsonb_array_length(o.items_removed_log) > 0, FALSE) AS has_removals
+    FROM {order_table} o
+    LEFT JOIN {item_table} i ON i.order_id = o.id
+    LEFT JOIN removed r ON r.order_id = o.id AND r.order_item_id = i.id
+    WHERE o.id = ANY(%(order_ids)s) AND NOT (o.status = ANY(%(terminal)s))
+    GROUP BY o.id
+),
+computed AS (
+    SELECT t.order_id,
+           CASE
+               WHEN t.item_count = 0 THEN 'NEW_ORDER'
+               WHEN t.open_items = 0 AND (t.packed_items > 0 OR o.status = 'PARTIALLY_SHIPPED') THEN 'FULLY_SHIPPED'
+               WHEN t.open_items = 0 THEN o.status
+               WHEN t.packed_items > 0 OR t.has_removals THEN 'PARTIALLY_SHIPPED'
+               ELSE 'NEW_ORDER'
+           END AS new_status
+    FROM totals t
+    JOIN {order_table} o ON o.id = t.order_id
+)
+UPDATE {order_table} o
+SET status = c.new_status, last_updated_at = %(now)s
+FROM computed c
+WHERE o.id = c.order_id AND o.status <> c.new_status
+RETURNING o.id, o.status
+"""
+
+def recompute_order_items(order_item_ids, parcel_status):
+    """
+    Recomputes quantity_packed, quantity_shipped and status of the given order
+    items from their ParcelItems with one aggregate query and one bulk update,
+    applying ParcelItem.save()'s status rules for a parcel in `parcel_status`.
+    """
+    OrderItem = apps.get_model('operation', 'OrderItem')
+    ParcelItem = apps.get_model('operation', 'ParcelItem')
+    order_items = list(OrderItem.objects.filter(pk__in=order_item_ids))
+    totals = {
+        row['order_item']: row
+        for row in ParcelItem.objects.filter(order_item__in=order_item_ids)
+        .values('order_item')
+        .annotate(
+            packed=Sum('quantity_shipped_in_this_parcel'),
+            shipped=Sum('quantity_shipped_in_this_parcel', filter=Q(parcel__status__in=SHIPPED_PARCEL_STATUSES)),
+        )
+    }
+    for order_item in order_items:
+        row = totals.get(order_item.pk, {})
+        order_item.quantity_packed = row.get('packed') or 0
+        order_item.quantity_shipped = row.get('shipped') or 0
+        if order_item.status in FINAL_ORDER_ITEM_STATUSES:
+            continue
+        if parcel_status == 'DELIVERED':
+            order_item.status = 'ITEM_DELIVERED'
+        elif parcel_status == 'DELIVERY_FAILED':
+            order_item.status = 'ITEM_DELIVERY_FAILED'
+        elif parcel_status in ['PICKED_UP', 'IN_TRANSIT']:
+            order_item.status = 'ITEM_SHIPPED'
+        elif parcel_status in ['PREPARING_TO_PACK', 'READY_TO_SHIP']:
+            order_item.status = 'PACKED' if order_item.quantity_packed > 0 else 'PENDING_PROCESSING'
+        elif parcel_status == 'BILLED':
+            if order_item.status != 'ITEM_DELIVERED':
+                order_item.status = 'ITEM_BILLED'
+        elif order_item.quantity_packed == 0:
+            order_item.status = 'PENDING_PROCESSING'
+    OrderItem.objects.bulk_update(order_items, ['quantity_packed', 'quantity_shipped', 'status'])
+    return order_items
+
+
+def recompute_order_statuses(order_ids):
+    """
+    Recomputes and stores the status of every order in `order_ids` with one query.
+
+    Returns:
+        dict: {order_id: new_status} for the orders whose status changed.
+    """
+    order_ids = sorted({order_id for order_id in order_ids if order_id is not None})
+    if not order_ids:
+        return {}
+    Order = apps.get_model('operation', 'Order')
+    OrderItem = apps.get_model('operation', 'OrderItem')
+    sql = _RECOMPUTE_SQL.format(
+        order_table=connection.ops.quote_name(Order._meta.db_table),
+        item_table=connection.ops.quote_name(OrderItem._meta.db_table),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'order_ids': order_ids,
+            'terminal': TERMINAL_ORDER_STATUSES,
+            'now': timezone.now(),
+        })
+        changed = dict(cursor.fetchall())
+    for order_id, status in changed.items():
+        logger.info(f"Order PK {order_id} status auto-updated to {status}.")
+    return changed
+
+
+_local = threading.local()
+
+
+class _PendingRecompute:
+    """The on_commit callback for one transaction; collects the dirty order ids."""
+
+    def __init__(self):
+        self.order_ids = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        order_ids, self.order_ids = self.order_ids, set()
+        recompute_order_statuses(order_ids)
+
+
+def _is_queued(pending):
+    # Rolling back a transaction or savepoint discards its on_commit callbacks,
+    # so a pending recompute that is no longer queued must not collect more ids.
+    return not pending.done and any(entry[1] is pending for entry in connection.run_on_commit)
+
+
+def mark_orders_dirty(order_ids):
+    """
+    Records that the status of the given orders must be recomputed.
+
+    Inside a transaction, all orders marked before the commit are recomputed
+    once, together, when it commits. Outside a transaction they are recomputed
+    immediately.
+    """
+    order_ids = {order_id for order_id in order_ids if order_id is not None}
+    if not order_ids:
+        return
+    if not connection.in_atomic_block:
+        recompute_order_statuses(order_ids)
+        return
+
+    pending = getattr(_local, 'pending', None)
+    if pending is None or not _is_queued(pending):
+        pending = _local.pending = _PendingRecompute()
+        transaction.on_commit(pending)
+    pending.order_ids |= order_ids
+
+
+def flush_dirty_orders():
+    """
+    Recomputes the orders marked dirty in the current transaction now, so the
+    caller can read their new status before the commit.
+    """
+    pending = getattr(_local, 'pending', None)
+    if pending is not None and _is_queued(pending):
+        pending()
@@ -0,0 +1,250 @@
+# app/operation/packing.py
+"""
+Packing service: turns a packing form submission into a Parcel in one pass.
+
+Every warehouse product, inventory batch and packaging material row involved
+is locked with one SELECT ... FOR UPDATE per table, waiting at most
+PACKING_LOCK_TIMEOUT_MS for packers holding the same rows. Stock reserved for
+other orders (inventory.reservations) is never packed. ParcelItem /
+StockTransaction / PackagingStockTransaction rows are bulk-created, stock
+deltas are applied as one grouped UPDATE per table, and the packed quantities,
+statuses and reservations of the affected OrderItems are updated once at the
+end. The Order's status is marked dirty and recomputed on commit. The number
+of queries does not depend on the number of lines in the parcel.
+"""
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+
+from inventory.models import InventoryBatchItem, StockTransaction, WarehousePackagingMaterial, PackagingStockTransaction
+from inventory.reservations import consume_reservations, lock_warehouse_products, reserved_quantities
+from warehouse.models import WarehouseProduct
+
+from .models import OrderItem, Parcel, ParcelItem, grouped_delta
+from .order_status import mark_orders_dirty, recompute_order_items
+
+logger = logging.getLogger(__name__)
+
+# Longest a pack waits for another transaction's row locks before giving up.
+PACKING_LOCK_TIMEOUT_MS = getattr(settings, 'PACKING_LOCK_TIMEOUT_MS', 5000)
+# Postgres SQLSTATE raised when lock_timeout expires.
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+class PackingError(Exception):
+    """A packing request that cannot be fulfilled; nothing has been written."""
+
+
+def _set_lock_timeout():
+    # Bound how long a packer waits on rows another packer holds; past it, the pack fails cleanly.
+    with connection.cursor() as cursor:
+        cursor.execute(f"SET LOCAL lock_timeout = '{int(PACKING_LOCK_TIMEOUT_MS)}ms'")
+
+
+def _lock_warehouse_products(batch_ids):
+    return lock_warehouse_products(
+        InventoryBatchItem.objects.filter(pk__in=batch_ids).values('warehouse_product_id')
+    )
+
+
+def _lock_batches(batch_ids):
+    batches = (
+        InventoryBatchItem.objects
+        .select_for_update(of=('self',))
+        .select_related('warehouse_product__warehouse', 'warehouse_product__product')
+        .filter(pk__in=batch_ids)
+        .order_by('pk')
+    )
+    return {batch.pk: batch for batch in batches}
+
+
+def _lock_packaging_stock(packaging_type, warehouse):
+    components = list(packaging_type.packagingtypematerialcomponent_set.select_related('packaging_material'))
+    if not components:
+        return []
+    stock_by_material = {
+        stock.packaging_material_id: stock
+        for stock in WarehousePackagingMaterial.objects.select_for_update().filter(
+            warehouse=warehouse,
+            packaging_material__in=[component.packaging_material for component in components],
+        ).order_by('pk')
+    }
+
+    usage = []
+    for component in components:
+        material = component.packaging_material
+        warehouse_stock = stock_by_material.get(material.pk)
+        if warehouse_stock is None:
+            raise PackingError(f"Stock for packaging material '{material.name}' is not configured in warehouse '{warehouse.name}'.")
+        if warehouse_stock.current_stock < component.quantity:
+            raise PackingError(
+                f"Insufficient stock for packaging material: '{material.name}'. "
+                f"Required: {component.quantity}, Available: {warehouse_stock.current_stock}"
+            )
+        usage.append((warehouse_stock, component.quantity))
+    return usage
+
+
+@transaction.atomic
+def pack_order(order, lines, courier_company, packaging_type, user, notes=''):
+    """
+    Packs `lines` of `order` into a new Parcel.
+
+    Args:
+        order (Order): the order being packed.
+        lines (list): dicts with 'order_item_id', 'batch_id' and 'quantity'. The
+            same order item may be packed from several batches.
+        courier_company, packaging_type: the parcel's courier and packaging.
+        user: the user recorded on the parcel and stock transactions.
+        notes (str): parcel notes.
+
+    Returns:
+        Parcel: the new parcel.
+
+    Raises:
+        PackingError: if a line cannot be packed. The transaction is rolled back.
+    """
+    if not lines:
+        raise PackingError('No items were submitted with a quantity to pack.')
+
+    requested_by_item = defaultdict(int)
+    requested_by_batch = defaultdict(int)
+    for line in lines:
+        requested_by_item[line['order_item_id']] += line['quantity']
+        requested_by_batch[line['batch_id']] += line['quantity']
+
+    try:
+        return _pack_order(order, lines, requested_by_item, requested_by_batch, courier_company, packaging_type, user, notes)
+    except OperationalError as e:
+        if getattr(e.__cause__, 'pgcode', None) != LOCK_NOT_AVAILABLE:
+            raise
+        raise PackingError('This stock is being packed by someone else right now. Please try again.') from e
+
+
+def _pack_order(order, lines, requested_by_item, requested_by_batch, courier_company, packaging_type, user, notes):
+    _set_lock_timeout()
+
+    # Lock the order's items (serialising concurrent packs of the same order), then the
+    # warehouse products and batches involved, in the same order reserve_order_items uses.
+    order_items = OrderItem.objects.select_for_update(of=('self',)).select_related('product').filter(
+        order=order, pk__in=requested_by_item,
+    ).in_bulk()
+    missing_items = set(requested_by_item) - set(order_items)
+    if missing_items:
+        raise PackingError(f"Order item(s) {', '.join(map(str, sorted(missing_items)))} do not belong to this order.")
+
+    warehouse_products = _lock_warehouse_products(requested_by_batch)
+    batches = _lock_batches(requested_by_batch)
+    missing_batches = set(requested_by_batch) - set(batches)
+    if missing_batches:
+        raise PackingError(f"Inventory batch(es) {', '.join(map(str, sorted(missing_batches)))} not found.")
+
+    for batch_id, requested_qty in requested_by_batch.items():
+        batch = batches[batch_id]
+        if requested_qty > batch.quantity:
+            raise PackingError(
+                f"Not enough stock for {batch.warehouse_product.product.sku} in batch {batch.batch_number}. "
+                f"Requested: {requested_qty}, Available: {batch.quantity}"
+            )
+
+    for order_item_id, total_packed in requested_by_item.items():
+        order_item = order_items[order_item_id]
+        total_removed_for_item = order.get_total_removed_quantity_for_item(order_item.id)
+        quantity_remaining_on_order = (order_item.quantity_ordered - total_removed_for_item) - order_item.quantity_packed
+        if total_packed > quantity_remaining_on_order:
+            raise PackingError(
+                f"Cannot pack a total of {total_packed} for {order_item.product.sku}. "
+                f"Only {quantity_remaining_on_order} are remaining on the order."
+            )
+
+    # Stock reserved for other order items cannot be packed; this pack may use its own reservations.
+    requested_by_warehouse_product = defaultdict(int)
+    for batch_id, qty in requested_by_batch.items():
+        requested_by_warehouse_product[batches[batch_id].warehouse_product_id] += qty
+    reserved_by_others = reserved_quantities(warehouse_products, exclude_order_items=list(order_items))
+    for warehouse_product_id, requested_qty in requested_by_warehouse_product.items():
+        warehouse_product = warehouse_products[warehouse_product_id]
+        promisable = warehouse_product.quantity - reserved_by_others.get(warehouse_product_id, 0)
+        if requested_qty > promisable:
+            raise PackingError(
+                f"Cannot pack {requested_qty} of {warehouse_product.product.sku}: "
+                f"{reserved_by_others[warehouse_product_id]} are reserved for other orders, "
+                f"so only {max(promisable, 0)} can be used."
+            )
+
+    packaging_usage = _lock_packaging_stock(packaging_type, order.warehouse)
+
+    parcel = Parcel.objects.create(
+        order=order,
+        created_by=user,
+        notes=notes,
+        courier_company=courier_company,
+        packaging_type=packaging_type,
+    )
+
+    ParcelItem.objects.bulk_create([
+        ParcelItem(
+            parcel=parcel,
+            order_item=order_items[line['order_item_id']],
+            quantity_shipped_in_this_parcel=line['quantity'],
+            shipped_from_batch=batches[line['batch_id']],
+        )
+        for line in lines
+    ])
+
+    # Grouped stock deltas: one UPDATE for all batches, one for all warehouse products.
+    InventoryBatchItem.objects.filter(pk__in=requested_by_batch).update(
+        quantity=F('quantity') - grouped_delta(requested_by_batch)
+    )
+    WarehouseProduct.objects.filter(pk__in=requested_by_warehouse_product).update(
+        quantity=F('quantity') - grouped_delta(requested_by_warehouse_product),
+        batched_quantity=F('batched_quantity') - grouped_delta(requested_by_warehouse_product),
+    )
+
+    StockTransaction.objects.bulk_create([
+        StockTransaction(
+            warehouse=batch.warehouse_product.warehouse,
+            transaction_type=StockTransaction.TransactionTypes.SALE_PACKED_OUT,
+            warehouse_product=batch.warehouse_product,
+            product=batch.warehouse_product.product,
+            batch_item_involved=batch,
+            quantity=-line['quantity'],
+            reference_note=f"LWA Order {order.erp_order_id}, Parcel {parcel.parcel_code_system}, Batch {batch.batch_number}",
+            related_order=order,
+            recorded_by=user,
+        )
+        for line in lines
+        for batch in [batches[line['batch_id']]]
+    ])
+
+    if packaging_usage:
+        WarehousePackagingMaterial.objects.filter(pk__in=[stock.pk for stock, _ in packaging_usage]).update(
+            current_stock=F('current_stock') - grouped_delta({stock.pk: qty for stock, qty in packaging_usage})
+        )
+        PackagingStockTransaction.objects.bulk_create([
+            PackagingStockTransaction(
+                warehouse_packaging_material=stock,
+                transaction_type=PackagingStockTransaction.TransactionTypes.STOCK_OUT,
+                quantity=-qty,
+                related_parcel=parcel,
+                notes=f"Used for Parcel {parcel.parcel_code_system}",
+                recorded_by=user,
+            )
+            for stock, qty in packaging_usage
+        ])
+
+    packed_by_item_batch = defaultdict(int)
+    for line in lines:
+        packed_by_item_batch[(line['order_item_id'], line['batch_id'])] += line['quantity']
+    consume_reservations(packed_by_item_batch)
+    recompute_order_items(list(order_items), parcel.status)
+    mark_orders_dirty([order.pk])
+
+    logger.info(
+        f"[Packing] Parcel {parcel.parcel_code_system} created for order {order.erp_order_id}: "
+        f"{len(lines)} lines from {len(batches)} batches."
+    )
+    return parcel
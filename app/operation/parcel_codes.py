@@ -0,0 +1,80 @@
+# app/operation/parcel_codes.py
+"""
+Parcel code allocator.
+
+Codes come from the Postgres sequence `operation_parcel_code_seq`, so allocating
+never reads the parcel table and never retries. One `nextval` per code is
+fetched in a single query, however many codes are requested.
+
+Each sequence value is scrambled with a multiplicative permutation, so that
+consecutive parcels do not get consecutive-looking codes. It is then written in
+the existing 33-symbol alphabet, padded to at least 4 symbols, and followed by
+a check character. New codes are therefore at least 5 characters long and can
+never collide with the 4-character random codes issued before.
+Every symbol count L has its own 33**L permutation, so codes stay unique as
+they grow past 5 characters.
+"""
+from django.db import connection
+
+PARCEL_CODE_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+PARCEL_CODE_SEQUENCE = 'operation_parcel_code_seq'
+PARCEL_CODE_MIN_SYMBOLS = 4
+# Coprime with 33, so multiplying by it permutes 0 .. 33**L - 1.
+PARCEL_CODE_MULTIPLIER = 7919
+
+_BASE = len(PARCEL_CODE_ALPHABET)
+_SYMBOL_VALUES = {symbol: value for value, symbol in enumerate(PARCEL_CODE_ALPHABET)}
+
+
+def _check_character(payload):
+    """
+    Check character such that the symbol values, weighted 1, 2, 1, ... from the
+    right (check character included), sum to 0 mod 33. Both weights and their
+    difference are coprime with 33, so any single wrong symbol or swap of two
+    adjacent symbols is detected.
+    """
+    total = 0
+    weight = 2
+    for symbol in reversed(payload):
+        total += weight * _SYMBOL_VALUES[symbol]
+        weight = 3 - weight
+    return PARCEL_CODE_ALPHABET[-total % _BASE]
+
+
+def encode_parcel_code(number):
+    """Turns a sequence value into a parcel code with a trailing check character."""
+    symbols = PARCEL_CODE_MIN_SYMBOLS
+    while number >= _BASE ** symbols:
+        symbols += 1
+    value = (number * PARCEL_CODE_MULTIPLIER) % _BASE ** symbols
+    payload = []
+    for _ in range(symbols):
+        value, digit = divmod(value, _BASE)
+        payload.append(PARCEL_CODE_ALPHABET[digit])
+    payload = ''.join(reversed(payload))
+    return payload + _check_character(payload)
+
+
+def is_valid_parcel_code(code):
+    """True if `code` is a sequence-allocated code whose check character matches."""
+    code = (code or '').strip().upper()
+    if len(code) <= PARCEL_CODE_MIN_SYMBOLS or any(symbol not in _SYMBOL_VALUES for symbol in code):
+        return False
+    return _check_character(code[:-1]) == code[-1]
+
+
+def allocate_parcel_codes(count):
+    """
+    Reserves `count` new parcel codes with one query.
+
+    Returns:
+        list: `count` unique codes.
+    """
+    if count <= 0:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(%s) FROM generate_series(1, %s)",
+            [PARCEL_CODE_SEQUENCE, count],
+        )
+        return [encode_parcel_code(number) for (number,) in cursor.fetchall()]
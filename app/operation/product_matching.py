@@ -0,0 +1,155 @@
+# app/operation/product_matching.py
+"""
+In-memory product name matching index for the Excel order import.
+
+The index pre-processes every catalogue name once and scores a whole batch of
+imported names against it with rapidfuzz's `process.cdist`, which computes the
+similarity matrix in C. Scores are the same as the previous per-row
+`fuzzywuzzy.process.extractOne(name, choices, scorer=fuzz.ratio)` call: both
+sides are lower-cased with non-alphanumerics stripped, scores are rounded to
+integers, and ties go to the first product in catalogue order.
+
+The built index is kept per process and rebuilt only when the catalogue version
+changes. The version lives in the Django cache and is bumped by the Product
+signals in operation/signals.py, so every worker sharing a cache backend drops
+its stale index. Learned ProductMapping entries are cached the same way, so
+repeat uploads of known product names do not query the mapping table.
+"""
+import logging
+import threading
+
+import numpy as np
+from rapidfuzz import fuzz, process, utils
+
+from django.core.cache import cache
+
+from inventory.models import Product
+from .models import ProductMapping
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_MATCH_THRESHOLD = 60
+PRODUCT_MATCH_VERSION_CACHE_KEY = 'operation_product_match_index_version'
+PRODUCT_MAPPING_VERSION_CACHE_KEY = 'operation_product_mapping_version'
+# Number of imported names scored per cdist call; bounds the similarity matrix size.
+PRODUCT_MATCH_QUERY_CHUNK = 256
+
+
+class ProductMatchIndex:
+    """
+    Pre-processed view of the product catalogue, built from a {name: product_id}
+    mapping in catalogue order.
+    """
+
+    def __init__(self, product_choices):
+        self.product_ids = list(product_choices.values())
+        self.processed_names = [utils.default_process(name) for name in product_choices]
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def match(self, names, threshold=PRODUCT_MATCH_THRESHOLD):
+        """
+        Matches every distinct name once.
+
+        Returns:
+            dict: {name: (product_id, score)} for names whose best score reaches
+            `threshold`. Names without a good enough match are omitted.
+        """
+        if not self.product_ids:
+            return {}
+        queries = [(name, utils.default_process(name)) for name in dict.fromkeys(names) if name]
+
+        matches = {}
+        for start in range(0, len(queries), PRODUCT_MATCH_QUERY_CHUNK):
+            chunk = queries[start:start + PRODUCT_MATCH_QUERY_CHUNK]
+            scores = process.cdist(
+                [processed for _, processed in chunk], self.processed_names,
+                scorer=fuzz.ratio, dtype=np.float64, workers=-1,
+            )
+            scores = np.rint(scores)
+            best_columns = scores.argmax(axis=1)
+            for row, (name, _) in enumerate(chunk):
+                column = best_columns[row]
+                score = int(scores[row, column])
+                if score >= threshold:
+                    matches[name] = (self.product_ids[column], score)
+        return matches
+
+
+class _VersionedCache:
+    """
+    A per-process cached value that is rebuilt when its version in the Django
+    cache changes. Bumping the version marks the value stale in every process
+    sharing the cache backend.
+    """
+
+    def __init__(self, version_key, build):
+        self.version_key = version_key
+        self.build = build
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+
+    def _current_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, 1, timeout=None)
+            version = cache.get(self.version_key, 1)
+        return version
+
+    def get(self):
+        version = self._current_version()
+        with self._lock:
+            if self._value is None or self._version != version:
+                self._value = self.build()
+                self._version = version
+            return self._value
+
+    def invalidate(self):
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, 1, timeout=None)
+        with self._lock:
+            self._value = None
+
+
+def _build_match_index():
+    product_choices = {name: pk for pk, name in Product.objects.order_by('name', 'pk').values_list('pk', 'name')}
+    logger.info(f"[ProductMatch] Built match index for {len(product_choices)} products.")
+    return ProductMatchIndex(product_choices)
+
+
+def _build_learned_mappings():
+    mappings = dict(ProductMapping.objects.order_by().values_list('imported_name', 'mapped_product_id'))
+    logger.info(f"[ProductMatch] Loaded {len(mappings)} learned product mappings.")
+    return mappings
+
+
+_match_index_cache = _VersionedCache(PRODUCT_MATCH_VERSION_CACHE_KEY, _build_match_index)
+_learned_mappings_cache = _VersionedCache(PRODUCT_MAPPING_VERSION_CACHE_KEY, _build_learned_mappings)
+
+
+def get_product_match_index():
+    """Returns the process-wide ProductMatchIndex, rebuilding it if the catalogue changed."""
+    return _match_index_cache.get()
+
+
+def invalidate_product_match_index():
+    """Marks the cached match index stale in every process sharing the cache."""
+    _match_index_cache.invalidate()
+
+
+def get_learned_mappings():
+    """
+    Returns the process-wide {imported_name: product_id} dict of learned
+    ProductMapping entries, reloading it only after a mapping changed. The
+    dict is shared and must not be modified by callers.
+    """
+    return _learned_mappings_cache.get()
+
+
+def invalidate_learned_mappings():
+    """Marks the cached learned mappings stale in every process sharing the cache."""
+    _learned_mappings_cache.invalidate()
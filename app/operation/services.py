@@ -11,33 +11,86 @@ from django.conf import settings
 from django.utils import timezone
 
 from datetime import datetime, timedelta, timezone as dt_timezone
-from django.core.cache import cache
 from decimal import Decimal, InvalidOperation
 from django.db import IntegrityError, transaction
-from django.db.models import F
+from django.db.models import Case, Exists, OuterRef, Subquery, Value, When
 
-from .models import Parcel, ParcelTrackingLog, CourierInvoice, CourierInvoiceItem
+from .courier_http import COURIER_CLIENTS, cached_token
+from .invoice_reconciliation import InvoiceLine, reconcile_invoice_lines
+from .models import Parcel, ParcelTrackingLog, CourierInvoice, TRACKING_DELIVERY_FAILED_DAYS
 
 logger = logging.getLogger(__name__)
 
+# Courier API hosts; settings can point them elsewhere (e.g. a sandbox or a local stub server).
+DHL_API_BASE_URL = getattr(settings, 'DHL_API_BASE_URL', 'https://api-eu.dhl.com')
+FEDEX_API_BASE_URL = getattr(settings, 'FEDEX_API_BASE_URL', 'https://apis.fedex.com')
+UPS_API_BASE_URL = getattr(settings, 'UPS_API_BASE_URL', 'https://onlinetools.ups.com')
+# Most tracking numbers sent in one tracking request.
+DHL_TRACKING_BATCH_SIZE = getattr(settings, 'DHL_TRACKING_BATCH_SIZE', 10)
+FEDEX_TRACKING_BATCH_SIZE = getattr(settings, 'FEDEX_TRACKING_BATCH_SIZE', 30)
 
 
-def get_dhl_tracking_details(tracking_number):
+def _match_shipments(tracking_numbers, shipments, tracking_number_of):
     """
-    Fetches tracking details from the DHL API for a given tracking number,
-    using a more robust method for generating unique event IDs.
+    Fans a multi-shipment response back out as {tracking_number: shipment}.
+    With a single tracking number the first shipment is used whatever number
+    the courier echoes back, as the one-number clients always did.
+    """
+    if len(tracking_numbers) == 1:
+        return {tracking_numbers[0]: shipments[0]} if shipments else {}
+    wanted = set(tracking_numbers)
+    matched = {}
+    for shipment in shipments:
+        tracking_number = str(tracking_number_of(shipment) or '').strip()
+        if tracking_number in wanted and tracking_number not in matched:
+            matched[tracking_number] = shipment
+    return matched
+
+
+def _parse_dhl_events(shipment):
+    parsed_events = []
+    for event in shipment.get('events', []):
+        timestamp = datetime.fromisoformat(event['timestamp'].replace('Z', '+00:00'))
+        description = event.get('description', 'No description')
+
+        # --- START OF THE FIX ---
+        # Create a more unique fallback event_id by combining the timestamp
+        # with the event description. This prevents duplicate IDs when
+        # multiple events happen in the same second.
+        fallback_id = f"{timestamp.timestamp()}-{description}"
+        event_id = event.get('id', fallback_id)
+        # --- END OF THE FIX ---
+
+        parsed_events.append({
+            'timestamp': timestamp,
+            'description': description,
+            'location': event.get('location', {}).get('address', {}).get('addressLocality', ''),
+            'event_id': event_id
+        })
+    return parsed_events
+
+
+def get_dhl_tracking_details_bulk(tracking_numbers):
+    """
+    Fetches tracking details for up to DHL_TRACKING_BATCH_SIZE tracking
+    numbers with one DHL API request (a comma-separated trackingNumber).
+
+    Returns:
+        dict: {tracking_number: list of events, or None if the request failed}.
+        Numbers DHL does not know get an empty list.
     """
-    logger.info(f"[DHL Tracking] Starting process for tracking number: {tracking_number}")
+    tracking_numbers = list(tracking_numbers)
+    logger.info(f"[DHL Tracking] Starting process for {len(tracking_numbers)} tracking numbers: {tracking_numbers}")
 
     api_key = getattr(settings, 'DHL_API_KEY', None)
     if not api_key:
         logger.error("[DHL Tracking] CRITICAL: DHL_API_KEY is not configured.")
-        return None
+        return dict.fromkeys(tracking_numbers)
 
-    url = f"https://api-eu.dhl.com/track/shipments"
+    url = f"{DHL_API_BASE_URL}/track/shipments"
     headers = {"DHL-API-Key": api_key}
     params = {
-        "trackingNumber": tracking_number,
+        "trackingNumber": ",".join(tracking_numbers),
         "service": "express",
         "levelOfDetail": "ALL_EVENTS"
     }
@@ -45,66 +98,48 @@ def get_dhl_tracking_details(tracking_number):
     logger.info(f"[DHL Tracking] Sending request to URL: {url} with params: {params}")
 
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=15)
-        logger.debug(f"[DHL Tracking] Raw Response Body for {tracking_number}: \n{response.text}")
+        response = COURIER_CLIENTS['dhl'].get(url, headers=headers, params=params)
+        logger.debug(f"[DHL Tracking] Raw Response Body for {params['trackingNumber']}: \n{response.text}")
         response.raise_for_status()
 
-        data = response.json()
-        shipments = data.get('shipments', [])
+        shipments = response.json().get('shipments', [])
         if not shipments:
-            logger.warning(f"[DHL Tracking] 'shipments' array is empty for {tracking_number}.")
-            return []
+            logger.warning(f"[DHL Tracking] 'shipments' array is empty for {params['trackingNumber']}.")
 
-        events = shipments[0].get('events', [])
-        parsed_events = []
-        for event in events:
-            timestamp = datetime.fromisoformat(event['timestamp'].replace('Z', '+00:00'))
-            description = event.get('description', 'No description')
-
-            # --- START OF THE FIX ---
-            # Create a more unique fallback event_id by combining the timestamp
-            # with the event description. This prevents duplicate IDs when
-            # multiple events happen in the same second.
-            fallback_id = f"{timestamp.timestamp()}-{description}"
-            event_id = event.get('id', fallback_id)
-            # --- END OF THE FIX ---
-
-            parsed_events.append({
-                'timestamp': timestamp,
-                'description': description,
-                'location': event.get('location', {}).get('address', {}).get('addressLocality', ''),
-                'event_id': event_id
-            })
-
-        logger.info(f"[DHL Tracking] Successfully parsed {len(parsed_events)} events for {tracking_number}.")
-        return parsed_events
+        matched = _match_shipments(tracking_numbers, shipments, lambda shipment: shipment.get('id'))
+        results = {
+            tracking_number: _parse_dhl_events(matched[tracking_number]) if tracking_number in matched else []
+            for tracking_number in tracking_numbers
+        }
+        logger.info(f"[DHL Tracking] Successfully parsed {sum(map(len, results.values()))} events for {len(matched)} shipments.")
+        return results
 
     except requests.RequestException as e:
-        logger.error(f"[DHL Tracking] Network Request Error for {tracking_number}: {e}")
-        return None
+        logger.error(f"[DHL Tracking] Network Request Error for {params['trackingNumber']}: {e}")
+        return dict.fromkeys(tracking_numbers)
     except Exception as e:
-        logger.error(f"[DHL Tracking] An unexpected error occurred while processing {tracking_number}: {e}", exc_info=True)
-        return None
+        logger.error(f"[DHL Tracking] An unexpected error occurred while processing {params['trackingNumber']}: {e}", exc_info=True)
+        return dict.fromkeys(tracking_numbers)
 
 
-def get_fedex_access_token():
+def get_dhl_tracking_details(tracking_number):
     """
-    Retrieves a FedEx API access token, utilizing cache.
+    Fetches tracking details from the DHL API for a given tracking number,
+    using a more robust method for generating unique event IDs.
     """
-    token = cache.get('fedex_access_token')
-    if token:
-        logger.debug("Found FedEx access token in cache.")
-        return token
+    return get_dhl_tracking_details_bulk([tracking_number])[tracking_number]
+
 
+def _fetch_fedex_access_token():
     logger.info("No FedEx access token in cache, requesting a new one.")
     api_key = getattr(settings, 'FEDEX_API_KEY', None)
     secret_key = getattr(settings, 'FEDEX_SECRET_KEY', None)
 
     if not all([api_key, secret_key]):
         logger.error("FEDEX_API_KEY or FEDEX_SECRET_KEY are not configured.")
-        return None
+        return None, 0
 
-    auth_url = "https://apis.fedex.com/oauth/token"
+    auth_url = f"{FEDEX_API_BASE_URL}/oauth/token"
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
     payload = {
         "grant_type": "client_credentials",
@@ -113,94 +148,120 @@ def get_fedex_access_token():
     }
 
     try:
-        response = requests.post(auth_url, headers=headers, data=payload, timeout=10)
+        response = COURIER_CLIENTS['fedex'].post(auth_url, headers=headers, data=payload, timeout=10)
         response.raise_for_status()
         token_data = response.json()
         access_token = token_data.get('access_token')
         expires_in = token_data.get('expires_in', 3540)
-        cache.set('fedex_access_token', access_token, timeout=expires_in - 60)
         logger.info("Successfully obtained and cached new FedEx access token.")
-        return access_token
+        return access_token, expires_in - 60
     except requests.RequestException as e:
         logger.error(f"Failed to get FedEx access token: {e}")
         if e.response is not None:
             logger.error(f"FedEx Auth API Response: {e.response.text}")
-        return None
+        return None, 0
 
-def get_fedex_tracking_details(tracking_number):
+
+def get_fedex_access_token():
     """
-    Fetches tracking details from the Fedex API for a given tracking number.
+    Retrieves a FedEx API access token, utilizing cache. Concurrent callers
+    share one refresh when the cached token has expired.
     """
+    return cached_token('fedex_access_token', _fetch_fedex_access_token)
+
+def _parse_fedex_events(tracking_number, complete_result):
+    track_results = complete_result.get('trackResults')
+    if not track_results:
+        return []
+
+    events = track_results[0].get('scanEvents', [])
+    parsed_events = []
+    for event in events:
+        timestamp_str = event.get('date')
+        if timestamp_str:
+            dt_object = datetime.fromisoformat(timestamp_str)
+            timestamp = timezone.make_aware(dt_object, timezone.utc) if dt_object.tzinfo is None else dt_object
+        else:
+            timestamp = timezone.now()
+
+        event_unique_id = f"{tracking_number}-{event.get('date')}-{event.get('eventDescription')}"
+        parsed_events.append({
+            'timestamp': timestamp,
+            'description': event.get('eventDescription', 'No description'),
+            'location': event.get('scanLocation', {}).get('city', ''),
+            'event_id': event_unique_id
+        })
+    return parsed_events
+
+
+def get_fedex_tracking_details_bulk(tracking_numbers):
+    """
+    Fetches tracking details for up to FEDEX_TRACKING_BATCH_SIZE tracking
+    numbers with one FedEx Track API request.
+
+    Returns:
+        dict: {tracking_number: list of events, or None if the request failed}.
+    """
+    tracking_numbers = list(tracking_numbers)
     access_token = get_fedex_access_token()
     if not access_token:
-        return None
+        return dict.fromkeys(tracking_numbers)
 
-    url = "https://apis.fedex.com/track/v1/trackingnumbers"
+    url = f"{FEDEX_API_BASE_URL}/track/v1/trackingnumbers"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json"
     }
     payload = {
         "includeDetailedScans": True,
-        "trackingInfo": [{"trackingNumberInfo": {"trackingNumber": tracking_number}}]
+        "trackingInfo": [
+            {"trackingNumberInfo": {"trackingNumber": tracking_number}}
+            for tracking_number in tracking_numbers
+        ]
     }
 
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
+        response = COURIER_CLIENTS['fedex'].post(url, headers=headers, json=payload)
         response.raise_for_status()
 
         data = response.json()
-        track_results = data.get('output', {}).get('completeTrackResults', [])
-        if not track_results or not track_results[0].get('trackResults'):
-            return []
-
-        events = track_results[0]['trackResults'][0].get('scanEvents', [])
-        parsed_events = []
-        for event in events:
-            timestamp_str = event.get('date')
-            if timestamp_str:
-                dt_object = datetime.fromisoformat(timestamp_str)
-                timestamp = timezone.make_aware(dt_object, timezone.utc) if dt_object.tzinfo is None else dt_object
-            else:
-                timestamp = timezone.now()
-
-            event_unique_id = f"{tracking_number}-{event.get('date')}-{event.get('eventDescription')}"
-            parsed_events.append({
-                'timestamp': timestamp,
-                'description': event.get('eventDescription', 'No description'),
-                'location': event.get('scanLocation', {}).get('city', ''),
-                'event_id': event_unique_id
-            })
-        return parsed_events
+        matched = _match_shipments(
+            tracking_numbers,
+            data.get('output', {}).get('completeTrackResults', []),
+            lambda result: result.get('trackingNumber'),
+        )
+        return {
+            tracking_number: _parse_fedex_events(tracking_number, matched[tracking_number]) if tracking_number in matched else []
+            for tracking_number in tracking_numbers
+        }
 
     except requests.RequestException as e:
-        logger.error(f"Error fetching Fedex tracking for {tracking_number}: {e}")
+        logger.error(f"Error fetching Fedex tracking for {tracking_numbers}: {e}")
         if e.response is not None:
             logger.error(f"FedEx API Response Content: {e.response.text}")
-        return None
+        return dict.fromkeys(tracking_numbers)
     except (KeyError, TypeError) as e:
-        logger.error(f"Error parsing Fedex response for {tracking_number}: {e}")
-        return None
+        logger.error(f"Error parsing Fedex response for {tracking_numbers}: {e}")
+        return dict.fromkeys(tracking_numbers)
 
-def get_ups_access_token():
+
+def get_fedex_tracking_details(tracking_number):
     """
-    Retrieves a UPS API access token for the PRODUCTION environment.
+    Fetches tracking details from the Fedex API for a given tracking number.
     """
-    token = cache.get('ups_access_token')
-    if token:
-        logger.debug("Found cached UPS API access token.")
-        return token
+    return get_fedex_tracking_details_bulk([tracking_number])[tracking_number]
 
+def _fetch_ups_access_token():
     logger.info("No cached UPS token found, requesting a new one.")
     client_id = getattr(settings, 'UPS_CLIENT_ID', None)
     client_secret = getattr(settings, 'UPS_CLIENT_SECRET', None)
 
     if not client_id or not client_secret:
         logger.error("UPS_CLIENT_ID or UPS_CLIENT_SECRET are not configured.")
-        return None
+        return None, 0
 
     # *** THE FIX: Use the production URL for authentication ***
-    auth_url = "https://onlinetools.ups.com/security/v1/oauth/token"
+    auth_url = f"{UPS_API_BASE_URL}/security/v1/oauth/token"
 
     auth_string = f"{client_id}:{client_secret}"
     encoded_auth = base64.b64encode(auth_string.encode('utf-8')).decode('utf-8')
@@ -212,19 +273,26 @@ def get_ups_access_token():
     payload = {"grant_type": "client_credentials"}
 
     try:
-        response = requests.post(auth_url, headers=headers, data=payload, timeout=10)
+        response = COURIER_CLIENTS['ups'].post(auth_url, headers=headers, data=payload, timeout=10)
         response.raise_for_status()
         token_data = response.json()
         access_token = token_data.get('access_token')
         expires_in = int(token_data.get('expires_in', 14340))
-        cache.set('ups_access_token', access_token, timeout=expires_in - 60)
         logger.info("Successfully obtained and cached new UPS access token.")
-        return access_token
+        return access_token, expires_in - 60
     except requests.RequestException as e:
         logger.error(f"Failed to get UPS access token: {e}")
         if e.response is not None:
             logger.error(f"UPS Auth API Response: {e.response.text}")
-        return None
+        return None, 0
+
+
+def get_ups_access_token():
+    """
+    Retrieves a UPS API access token for the PRODUCTION environment. Concurrent
+    callers share one refresh when the cached token has expired.
+    """
+    return cached_token('ups_access_token', _fetch_ups_access_token)
 
 # In your operation/services.py file
 
@@ -239,7 +307,7 @@ def get_ups_tracking_details(tracking_number):
         logger.error("[UPS Tracking] Aborting fetch due to missing access token.")
         return None
 
-    url = f"https://onlinetools.ups.com/api/track/v1/details/{tracking_number}"
+    url = f"{UPS_API_BASE_URL}/api/track/v1/details/{tracking_number}"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "transId": str(timezone.now().timestamp()),
@@ -247,7 +315,7 @@ def get_ups_tracking_details(tracking_number):
     }
 
     try:
-        response = requests.get(url, headers=headers, timeout=15)
+        response = COURIER_CLIENTS['ups'].get(url, headers=headers)
         response.raise_for_status()
         data = response.json()
 
@@ -308,7 +376,30 @@ def get_ups_tracking_details(tracking_number):
         logger.error(f"[UPS Tracking] Error parsing response for {tracking_number}: {e}", exc_info=True)
         return None
 
-# In your operation/services.py file
+def get_ups_tracking_details_bulk(tracking_numbers):
+    """The UPS Track API takes one tracking number per request; same shape as the other bulk clients."""
+    return {tracking_number: get_ups_tracking_details(tracking_number) for tracking_number in tracking_numbers}
+
+
+# Tracking client per courier. A parcel's courier is matched by name.
+TRACKING_CLIENTS = {
+    'dhl': get_dhl_tracking_details,
+    'fedex': get_fedex_tracking_details,
+    'ups': get_ups_tracking_details,
+}
+# Multi-shipment client per courier and the most tracking numbers it sends per request.
+BULK_TRACKING_CLIENTS = {
+    'dhl': (get_dhl_tracking_details_bulk, DHL_TRACKING_BATCH_SIZE),
+    'fedex': (get_fedex_tracking_details_bulk, FEDEX_TRACKING_BATCH_SIZE),
+    'ups': (get_ups_tracking_details_bulk, 1),
+}
+
+
+def tracking_courier_key(parcel):
+    """The TRACKING_CLIENTS key for the parcel's courier, or None if it has no API handler."""
+    courier_name = parcel.courier_company.name.lower() if parcel.courier_company else ""
+    return next((key for key in TRACKING_CLIENTS if key in courier_name), None)
+
 
 def update_parcel_tracking_from_api(parcel: Parcel) -> (bool, str):
     """
@@ -320,30 +411,122 @@ def update_parcel_tracking_from_api(parcel: Parcel) -> (bool, str):
         logger.warning("[Tracking Update Debug] END: No tracking number found.")
         return False, "No tracking number."
 
-    events = None
-    courier_name = parcel.courier_company.name.lower() if parcel.courier_company else ""
-
-    if 'dhl' in courier_name:
-        events = get_dhl_tracking_details(parcel.tracking_number)
-    elif 'fedex' in courier_name:
-        events = get_fedex_tracking_details(parcel.tracking_number)
-    elif 'ups' in courier_name:
-        events = get_ups_tracking_details(parcel.tracking_number)
-    else:
-        logger.error(f"[Tracking Update Debug] END: No API handler for courier: {courier_name}")
+    courier_key = tracking_courier_key(parcel)
+    if courier_key is None:
+        logger.error(f"[Tracking Update Debug] END: No API handler for courier: {parcel.courier_company.name.lower() if parcel.courier_company else ''}")
         return False, f"No API handler for courier: {parcel.courier_company.name if parcel.courier_company else 'Unknown'}."
 
+    events = TRACKING_CLIENTS[courier_key](parcel.tracking_number)
     if events is None:
         logger.error("[Tracking Update Debug] END: API call failed. Could not retrieve events.")
         return False, "API call failed. Could not retrieve tracking events."
 
+    return apply_parcel_tracking_events(parcel, events)
+
+
+def _truncate(value, max_length):
+    return value[:max_length] if value else value
+
+
+def normalize_tracking_events(parcel, events):
+    """
+    Turns `events` (as returned by a courier client) into unsaved
+    ParcelTrackingLog rows for `parcel`, one per event_id.
+
+    Events without a timestamp cannot be stored and are left out. Events
+    without an event_id get one built from the tracking number, timestamp and
+    description, so the same scan maps to the same row on every refresh.
+    """
+    field = ParcelTrackingLog._meta.get_field
+    description_length = field('status_description').max_length
+    location_length = field('location').max_length
+    event_id_length = field('event_id').max_length
+
+    rows = {}
+    for event in events:
+        timestamp = event.get('timestamp')
+        if not timestamp:
+            logger.warning(f"[Tracking Ingest] Parcel {parcel.pk}: skipping event without a timestamp: {event.get('description')}")
+            continue
+        description = event.get('description') or 'No description'
+        event_id = event.get('event_id') or f"{parcel.tracking_number}-{timestamp.isoformat()}-{description}"
+        event_id = _truncate(str(event_id), event_id_length)
+        rows.setdefault(event_id, ParcelTrackingLog(
+            parcel=parcel,
+            event_id=event_id,
+            timestamp=timestamp,
+            status_description=_truncate(description, description_length),
+            location=_truncate(event.get('location'), location_length),
+        ))
+    return list(rows.values())
+
+
+def ingest_tracking_events(parcel, events):
+    """
+    Stores the events of `parcel` that are not stored yet, in two queries
+    however long the history is: one to find the event_ids already stored, and
+    one bulk INSERT of the rest. ON CONFLICT DO NOTHING on the unique event_id
+    makes a concurrent refresh of the same parcel harmless.
+
+    Returns:
+        int: how many events were new.
+    """
+    rows = normalize_tracking_events(parcel, events)
+    if not rows:
+        return 0
+    stored = set(
+        ParcelTrackingLog.objects
+        .filter(event_id__in=[row.event_id for row in rows])
+        .values_list('event_id', flat=True)
+    )
+    new_rows = [row for row in rows if row.event_id not in stored]
+    if new_rows:
+        ParcelTrackingLog.objects.bulk_create(new_rows, ignore_conflicts=True)
+    return len(new_rows)
+
+
+def backfill_latest_tracking_events(batch_size=1000):
+    """
+    Copies each parcel's newest ParcelTrackingLog onto its latest_event_*
+    fields, one UPDATE per batch_size parcels.
+
+    Returns:
+        int: how many parcels were backfilled.
+    """
+    newest_log = (
+        ParcelTrackingLog.objects.filter(parcel=OuterRef('pk')).order_by('-timestamp', '-pk')
+        .annotate(simplified_status=Case(
+            When(status_description__icontains='delivered', then=Value('DELIVERED')),
+            default=Value('IN_TRANSIT'),
+        ))
+    )
+    parcel_ids = list(Parcel.objects.filter(Exists(newest_log)).order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(parcel_ids), batch_size):
+        Parcel.objects.filter(pk__in=parcel_ids[start:start + batch_size]).update(
+            latest_event_at=Subquery(newest_log.values('timestamp')[:1]),
+            latest_event_status=Subquery(newest_log.values('simplified_status')[:1]),
+            latest_event_description=Subquery(newest_log.values('status_description')[:1]),
+        )
+    return len(parcel_ids)
+
+
+def apply_parcel_tracking_events(parcel, events):
+    """
+    Stores `events` (as returned by a courier client) for `parcel` and updates
+    its status and timestamps. Makes no API calls, so events fetched elsewhere
+    (e.g. by operation.tracking_refresh) are applied the same way.
+
+    The events are stored in bulk (ingest_tracking_events) and the status is
+    worked out once from the newest event, so the number of queries does not
+    depend on how many events there are.
+    """
     # --- Database Update Logic ---
     if not events:
         logger.info("[Tracking Update Debug] END: API returned no new tracking events.")
-        if parcel.status == 'IN_TRANSIT' and parcel.shipped_at and (timezone.now() - parcel.shipped_at > timedelta(days=20)):
+        if parcel.status == 'IN_TRANSIT' and parcel.shipped_at and (timezone.now() - parcel.shipped_at > timedelta(days=TRACKING_DELIVERY_FAILED_DAYS)):
             parcel.status = 'DELIVERY_FAILED'
             parcel.save(update_fields=['status'])
-            return True, "No new events, status updated to DELIVERY FAILED (in transit > 20 days)."
+            return True, f"No new events, status updated to DELIVERY FAILED (in transit > {TRACKING_DELIVERY_FAILED_DAYS} days)."
         return True, "No new tracking events found from API."
 
     logger.debug(f"[Tracking Update Debug] Received {len(events)} events from API (unsorted).")
@@ -359,19 +542,8 @@ def update_parcel_tracking_from_api(parcel: Parcel) -> (bool, str):
     logger.debug(f"[Tracking Update Debug] Latest Event:   {latest_event.get('timestamp')} - \"{latest_event.get('description')}\"")
 
     # First, save all new tracking logs to the database
-    new_logs_created_count = 0
-    for event_data in events:
-        log, created = ParcelTrackingLog.objects.get_or_create(
-            parcel=parcel,
-            event_id=event_data.get('event_id'),
-            defaults={
-                'timestamp': event_data['timestamp'],
-                'status_description': event_data['description'],
-                'location': event_data.get('location'),
-            }
-        )
-        if created:
-            new_logs_created_count += 1
+    new_logs_created_count = ingest_tracking_events(parcel, events)
+    logger.debug(f"[Tracking Update Debug] Stored {new_logs_created_count} new tracking logs.")
 
     # --- START OF THE FIX: Restructured Status and Timestamp Logic ---
 
@@ -414,13 +586,19 @@ def update_parcel_tracking_from_api(parcel: Parcel) -> (bool, str):
         fields_to_update.append('status')
         logger.info(f"[Tracking Update Debug] Staged 'status' for update to: '{new_status}'")
 
-    # 3. Save all collected changes to the database in one go.
+    # 3. Keep the parcel's copy of its newest event current for list pages.
+    latest_event_fields = parcel.set_latest_tracking_event(latest_event.get('timestamp'), latest_event['description'])
+
+    # 4. Save all collected changes to the database in one go.
     if fields_to_update:
         logger.info(f"[Tracking Update Debug] SAVING to DB. Fields to update: {fields_to_update}")
-        parcel.save(update_fields=fields_to_update)
+        parcel.save(update_fields=fields_to_update + latest_event_fields)
         message = f"Parcel {parcel.parcel_code_system} updated. New Status: '{parcel.get_status_display()}'."
     else:
         logger.info("[Tracking Update Debug] No changes to parcel status or timestamps.")
+        if latest_event_fields:
+            # No status transition, so skip save()'s order bookkeeping.
+            Parcel.objects.filter(pk=parcel.pk).update(**{field: getattr(parcel, field) for field in latest_event_fields})
         message = f"{new_logs_created_count} new events added. Status remains '{parcel.get_status_display()}'."
 
     logger.info(f"--- [Tracking Update Debug] END: Process complete. ---")
@@ -530,7 +708,7 @@ def parse_dhl_invoice(invoice):
             return 0, errors, 0, []
 
         with transaction.atomic():
-            # ... (rest of the function remains the same)
+            lines = []
             for row in shipment_rows:
                 try:
                     tracking_number = row[column_map['SHIPMENT NUMBER']].strip()
@@ -546,40 +724,20 @@ def parse_dhl_invoice(invoice):
                     city_name = row[column_map['DEST NAME']].strip()
                     receiver_state_full = STATE_MAP.get(state_abbr, state_abbr)
                     charge_data = {'invoice_number': temp_invoice_number, 'cost': str(new_cost), 'date': temp_invoice_date.isoformat(), 'courier_company_name': invoice.courier_company.name}
-                    parcel_link = Parcel.objects.filter(tracking_number=tracking_number).first()
-
-                    item, created = CourierInvoiceItem.objects.get_or_create(
-                        tracking_number=tracking_number,
-                        defaults={
-                            'courier_invoice': invoice, 'actual_cost': new_cost,
-                            'scale_weight': scale_weight, 'vol_weight': vol_weight,
-                            'billed_weight': billed_weight, 'cost_history': [charge_data],
-                            'receiver_state': receiver_state_full, 'destination_name': city_name,
-                            'parcel': parcel_link,
-                        }
-                    )
-
-                    if created:
-                        created_items += 1
-                    else:
-                        item.actual_cost = F('actual_cost') + new_cost
-                        item.courier_invoice = invoice
-                        item.scale_weight = scale_weight
-                        item.vol_weight = vol_weight
-                        item.billed_weight = billed_weight
-                        item.receiver_state = receiver_state_full
-                        item.destination_name = city_name
-                        if parcel_link and not item.parcel:
-                            item.parcel = parcel_link
-                        history = item.cost_history or []
-                        history.append(charge_data)
-                        item.cost_history = history
-                        item.save()
-                        updated_items += 1
+                    lines.append(InvoiceLine(
+                        tracking_number, new_cost, charge_data,
+                        scale_weight=scale_weight, vol_weight=vol_weight, billed_weight=billed_weight,
+                        receiver_state=receiver_state_full, destination_name=city_name,
+                    ))
                 except (IndexError, ValueError, InvalidOperation, KeyError) as e:
                     errors.append(f"Skipped a shipment row due to a data error: {e}")
                     continue
 
+            created_items, updated_items = reconcile_invoice_lines(
+                invoice, lines,
+                update_fields=('scale_weight', 'vol_weight', 'billed_weight', 'receiver_state', 'destination_name'),
+            )
+
             invoice.invoice_number = temp_invoice_number
             invoice.invoice_date = temp_invoice_date
             invoice.invoice_amount = total_invoice_amount
@@ -705,6 +863,7 @@ def parse_fedex_invoice(invoice):
                     continue
 
                 processed_invoices_count += 1
+                lines = []
                 for row in inv_data['rows']:
                     tracking_number_raw = row.get(column_map['tracking_number'], '').strip()
                     if not tracking_number_raw: continue
@@ -713,36 +872,22 @@ def parse_fedex_invoice(invoice):
 
                     new_cost = Decimal(row[column_map['total_amount']].replace(',', ''))
                     charge_data = {'invoice_number': inv_num, 'cost': str(new_cost), 'date': inv_data['date'].isoformat(), 'courier_company_name': current_invoice.courier_company.name}
-                    parcel_link = Parcel.objects.filter(tracking_number=tracking_number).first()
 
                     state_abbr = row.get(column_map['receiver_state'], '').strip().upper()
                     # Use the map to get the full name, or fall back to the abbreviation if not found
                     receiver_state_full = STATE_MAP.get(state_abbr, state_abbr)
 
-                    item, item_created = CourierInvoiceItem.objects.get_or_create(
-                        tracking_number=tracking_number,
-                        defaults={
-                            'courier_invoice': current_invoice,
-                            'actual_cost': new_cost,
-                            'billed_weight': Decimal(row[column_map['billed_weight']].replace(',', '')) if row.get(column_map['billed_weight']) else None,
-                            'receiver_state': receiver_state_full,  # ✅ Use the full state name
-                            'destination_name': row.get(column_map['destination_name'], ''),
-                            'parcel': parcel_link,
-                            'cost_history': [charge_data]
-                        }
-                    )
-                    if item_created:
-                        created_items_count += 1
-                    else:
-                        item.actual_cost = F('actual_cost') + new_cost
-                        item.courier_invoice = current_invoice
-                        if parcel_link and not item.parcel:
-                            item.parcel = parcel_link
-                        history = item.cost_history or []
-                        history.append(charge_data)
-                        item.cost_history = history
-                        item.save()
-                        updated_items_count += 1
+                    lines.append(InvoiceLine(
+                        tracking_number, new_cost, charge_data,
+                        billed_weight=Decimal(row[column_map['billed_weight']].replace(',', '')) if row.get(column_map['billed_weight']) else None,
+                        receiver_state=receiver_state_full,  # ✅ Use the full state name
+                        destination_name=row.get(column_map['destination_name'], ''),
+                    ))
+
+                # FedEx re-bills keep the item's first weight and address.
+                item_created_count, item_updated_count = reconcile_invoice_lines(current_invoice, lines)
+                created_items_count += item_created_count
+                updated_items_count += item_updated_count
         except Exception as e:
             errors.append(f"Error on invoice '{inv_num}': {e}. Skipped.")
             continue
@@ -759,6 +904,7 @@ def parse_ups_invoice(invoice):
     and robust error handling for decimal conversion.
     """
     logger.info("Starting UPS invoice parsing process with updated format.")
+    created_items, updated_items = 0, 0
     errors, success_messages = [], []
     shipment_data = {}
     total_invoice_amount = Decimal('0.0')
@@ -832,11 +978,9 @@ def parse_ups_invoice(invoice):
             invoice.delete()
             return 0, errors, 0, []
 
-        created_items = 0
-        updated_items = 0
         with transaction.atomic():
+            lines = []
             for tracking, data in shipment_data.items():
-                parcel_link = Parcel.objects.filter(tracking_number=tracking).first()
                 state_abbr = data['receiver_state'].strip().upper()
                 # Use the map to get the full name, or fall back to the abbreviation if not found
                 receiver_state_full = STATE_MAP.get(state_abbr, state_abbr)
@@ -848,36 +992,16 @@ def parse_ups_invoice(invoice):
                     'courier_company_name': invoice.courier_company.name,
                     'charges': data['charge_list']
                 }
-
-                item, created = CourierInvoiceItem.objects.get_or_create(
-                    tracking_number=tracking,
-                    defaults={
-                        'courier_invoice': invoice,
-                        'actual_cost': data['total_cost'],
-                        'billed_weight': data['billed_weight'],
-                        'receiver_state': receiver_state_full, # ✅ Use the full state name
-                        'destination_name': data['destination_name'],
-                        'parcel': parcel_link,
-                        'cost_history': [charge_data],
-                    }
-                )
-
-                if created:
-                    created_items += 1
-                else:
-                    item.actual_cost = F('actual_cost') + data['total_cost']
-                    item.courier_invoice = invoice
-                    item.billed_weight = data['billed_weight']
-                    item.receiver_state = data['receiver_state']
-                    item.destination_name = data['destination_name']
-                    if parcel_link and not item.parcel:
-                        item.parcel = parcel_link
-
-                    history = item.cost_history or []
-                    history.append(charge_data)
-                    item.cost_history = history
-                    item.save()
-                    updated_items += 1
+                lines.append(InvoiceLine(
+                    tracking, data['total_cost'], charge_data,
+                    billed_weight=data['billed_weight'],
+                    receiver_state=receiver_state_full, # ✅ Use the full state name
+                    destination_name=data['destination_name'],
+                ))
+
+            created_items, updated_items = reconcile_invoice_lines(
+                invoice, lines, update_fields=('billed_weight', 'receiver_state', 'destination_name'),
+            )
 
             invoice.invoice_number = temp_invoice_number
             invoice.invoice_date = temp_invoice_date
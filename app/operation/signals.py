@@ -0,0 +1,20 @@
+# operation/signals.py
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from inventory.models import Product
+from .models import ProductMapping
+from .product_matching import invalidate_product_match_index, invalidate_learned_mappings
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_catalogue_changed(sender, instance, **kwargs):
+    # Any product insert, rename or delete makes the import match index stale.
+    invalidate_product_match_index()
+
+
+@receiver(post_save, sender=ProductMapping)
+@receiver(post_delete, sender=ProductMapping)
+def product_mapping_changed(sender, instance, **kwargs):
+    invalidate_learned_mappings()
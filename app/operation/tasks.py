@@ -29,3 +29,35 @@ def match_and_update_parcels():
         except Parcel.MultipleObjectsReturned:
             # Handle cases where the tracking number is duplicated (should be rare)
              print(f"Multiple parcels found for tracking number: {item.tracking_number}")
+
+
+@shared_task(acks_late=True)
+def process_order_import_job(job_id):
+    """
+    Task to read or commit an order import in the background.
+    """
+    from .order_import import run_order_import_job
+
+    job = run_order_import_job(job_id)
+    return job.state
+
+
+@shared_task
+def refresh_parcel_tracking():
+    """
+    Periodic task (CELERY_BEAT_SCHEDULE) refreshing the tracking of in-flight parcels.
+    """
+    from .tracking_refresh import refresh_in_flight_parcels
+
+    run = refresh_in_flight_parcels()
+    return {'updated': run.parcels_updated, 'skipped': run.parcels_skipped, 'failed': run.parcels_failed}
+
+
+@shared_task
+def flag_tracking_sla_breaches():
+    """
+    Periodic task (CELERY_BEAT_SCHEDULE) flagging in-flight parcels past their courier's transit SLA.
+    """
+    from .tracking_refresh import flag_sla_breaches
+
+    return flag_sla_breaches()
@@ -0,0 +1,96 @@
+'''
+Tests for order-level batch suggestions and the packing modal payload.
+'''
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from inventory.models import Product, InventoryBatchItem
+from inventory.services import suggest_batches_for_order_items
+from warehouse.models import Warehouse, WarehouseProduct
+from operation.models import Order, OrderItem
+
+
+class BatchSuggestionTests(TestCase):
+    '''Test suggesting batches for a whole order from one query'''
+
+    def setUp(self):
+        self.warehouse = Warehouse.objects.create(name='Main WH')
+        self.order = Order.objects.create(erp_order_id='7001', order_date=datetime.date(2025, 1, 15), warehouse=self.warehouse)
+        self.user = get_user_model().objects.create_user(
+            email='packer@example.com', password='testpass123', name='Packer',
+        )
+        self.user.warehouse = self.warehouse
+        self.user.save()
+        self.client.force_login(self.user)
+
+    def make_item(self, sku, quantity_ordered, batches):
+        '''batches: (quantity, pick_priority, days to expiry or None) tuples'''
+        product = Product.objects.create(sku=sku, name=f'Product {sku}', price=1)
+        warehouse_product = WarehouseProduct.objects.create(
+            warehouse=self.warehouse, product=product, quantity=sum(qty for qty, _, _ in batches),
+        )
+        created = [
+            InventoryBatchItem.objects.create(
+                warehouse_product=warehouse_product, batch_number=f'{sku}-B{i}', quantity=qty, pick_priority=priority,
+                expiry_date=timezone.localdate() + datetime.timedelta(days=days) if days is not None else None,
+            )
+            for i, (qty, priority, days) in enumerate(batches)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            order_item = OrderItem.objects.create(
+                order=self.order, product=product, warehouse_product=warehouse_product, quantity_ordered=quantity_ordered,
+            )
+        return order_item, created
+
+    def test_suggestion_follows_pick_priority_then_fefo(self):
+        '''test default pick beats secondary, which beats the earliest-expiring unprioritised batch'''
+        item, (fefo, secondary, default) = self.make_item('A', 5, [(10, None, 10), (10, 1, 60), (10, 0, 90)])
+
+        suggestions, batches_by_wp = suggest_batches_for_order_items({item: 5})
+
+        self.assertEqual(suggestions[item.pk], default)
+        self.assertEqual(batches_by_wp[item.warehouse_product_id], [default, secondary, fefo])
+
+    def test_suggestion_skips_batches_too_small_or_expired(self):
+        '''test a batch is only suggested if it covers the quantity alone and has not expired'''
+        item, (expired, small, later, undated) = self.make_item('B', 5, [(10, None, -1), (3, None, 5), (8, None, 20), (9, None, None)])
+
+        suggestions, batches_by_wp = suggest_batches_for_order_items({item: 5})
+
+        self.assertEqual(suggestions[item.pk], later)
+        self.assertEqual(batches_by_wp[item.warehouse_product_id], [small, later, undated])
+
+    def test_one_query_for_many_items(self):
+        '''test the number of queries does not depend on the number of items'''
+        items = {self.make_item(f'SKU{i}', 2, [(5, None, 30), (5, 0, 60)])[0]: 2 for i in range(5)}
+
+        with CaptureQueriesContext(connection) as ctx:
+            suggestions, _ = suggest_batches_for_order_items(items)
+
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertTrue(all(batch.pick_priority == 0 for batch in suggestions.values()))
+
+    def test_packing_modal_returns_batch_options_for_every_item(self):
+        '''test the packing payload carries each item's dropdown options, at a constant query cost'''
+        url = reverse('operation:get_order_items_for_packing', args=[self.order.pk])
+        first, _ = self.make_item('C0', 2, [(5, None, 30)])
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        one_item_queries = len(ctx.captured_queries)
+        options = response.json()['batch_options']
+        self.assertEqual([batch['quantity_available'] for batch in options[str(first.pk)]], [5])
+
+        for i in range(1, 5):
+            self.make_item(f'C{i}', 2, [(5, None, 30), (5, 1, 60)])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+
+        self.assertEqual(len(ctx.captured_queries), one_item_queries)
+        self.assertEqual(len(response.json()['batch_options']), 5)
@@ -0,0 +1,221 @@
+'''
+Tests for the pooled courier HTTP client, run against a local stub server that injects latency and failures.
+'''
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from operation.courier_http import CircuitBreaker, CourierClient, CourierUnavailable, cached_token
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    '''
+    Answers 200 unless the server has queued faults. Each fault is a status
+    code to return, or a number of seconds to stall before answering.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.calls += 1
+            server.client_ports.add(self.client_address[1])
+            fault = server.faults.pop(0) if server.faults else None
+        status = 200
+        if isinstance(fault, float):
+            time.sleep(fault)
+        elif fault is not None:
+            status = fault
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+
+class CourierClientTests(SimpleTestCase):
+    '''Test retries, pooling and the circuit breaker of a courier client'''
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+        self.server.lock = threading.Lock()
+        self.server.calls = 0
+        self.server.client_ports = set()
+        self.server.faults = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/track'
+
+        self.slept = []
+        self.courier = CourierClient(
+            'Stub', timeout=(1, 0.2), max_retries=2, backoff_seconds=0.01,
+            breaker=CircuitBreaker(failure_threshold=2, reset_seconds=60), sleep=self.slept.append,
+        )
+        self.addCleanup(self.courier.session.close)
+
+    def test_connections_are_reused(self):
+        '''test sequential calls share one kept-alive connection'''
+        for _ in range(5):
+            self.assertEqual(self.courier.get(self.url).status_code, 200)
+
+        self.assertEqual(self.server.calls, 5)
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_server_errors_are_retried_with_backoff(self):
+        '''test 5xx answers are retried and the jittered waits stay under the exponential cap'''
+        self.server.faults = [503, 502]
+
+        response = self.courier.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.calls, 3)
+        self.assertEqual(len(self.slept), 2)
+        self.assertTrue(0 <= self.slept[0] <= 0.01 and 0 <= self.slept[1] <= 0.02)
+
+    def test_rate_limit_honours_retry_after(self):
+        '''test a 429 waits for the Retry-After the courier asked for'''
+        self.server.faults = [429]
+
+        self.assertEqual(self.courier.get(self.url).status_code, 200)
+        self.assertEqual(self.slept, [1])
+
+    def test_slow_courier_times_out_and_retries(self):
+        '''test a stalled answer is abandoned at the read timeout and tried again'''
+        self.server.faults = [0.5]
+
+        self.assertEqual(self.courier.get(self.url).status_code, 200)
+        self.assertEqual(self.server.calls, 2)
+
+    def test_breaker_fails_fast_during_an_outage(self):
+        '''test repeated failures open the breaker and later calls never reach the courier'''
+        self.server.faults = [500] * 6
+
+        for _ in range(2):
+            self.assertEqual(self.courier.get(self.url).status_code, 500)
+        with self.assertRaises(CourierUnavailable):
+            self.courier.get(self.url)
+
+        self.assertEqual(self.server.calls, 6)
+        self.assertEqual(self.courier.breaker.state, CircuitBreaker.OPEN)
+
+    def half_open_courier(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 30
+        courier = CourierClient('Stub', timeout=(1, 0.2), max_retries=1, breaker=breaker, sleep=self.slept.append)
+        self.addCleanup(courier.session.close)
+        return courier
+
+    def test_rate_limited_trial_closes_the_breaker(self):
+        '''test a half-open trial still rate limited after its retries closes the breaker, as the courier is up'''
+        courier = self.half_open_courier()
+        self.server.faults = [429, 429]
+
+        self.assertEqual(courier.get(self.url).status_code, 429)
+        self.assertEqual(courier.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_trial_reopens_the_breaker(self):
+        '''test a half-open trial answered with 5xx after its retries opens the breaker again'''
+        courier = self.half_open_courier()
+        self.server.faults = [503, 503]
+
+        self.assertEqual(courier.get(self.url).status_code, 503)
+        self.assertEqual(courier.breaker.state, CircuitBreaker.OPEN)
+
+    def test_trial_raising_any_error_reopens_the_breaker(self):
+        '''test a half-open trial ending in an error other than a connection failure does not leave the breaker stuck'''
+        courier = self.half_open_courier()
+
+        with self.assertRaises(requests.exceptions.InvalidHeader):
+            courier.get(self.url, headers={'X-Bad': 'one\ntwo'})
+
+        self.assertEqual(self.server.calls, 0)
+        self.assertEqual(courier.breaker.state, CircuitBreaker.OPEN)
+
+    def test_breaker_half_opens_after_reset(self):
+        '''test one trial call is let through after the reset time and closes the breaker on success'''
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        now[0] = 30
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+
+class CachedTokenTests(SimpleTestCase):
+    '''Test single-flight OAuth token refresh'''
+
+    def setUp(self):
+        cache.delete('stub_token')
+        self.addCleanup(cache.delete, 'stub_token')
+
+    def test_concurrent_callers_share_one_refresh(self):
+        '''test workers finding the token expired make one token request between them'''
+        fetches, tokens, start = [], [], threading.Barrier(8)
+
+        def fetch():
+            fetches.append(1)
+            time.sleep(0.2)
+            return 'fresh-token', 300
+
+        def worker():
+            start.wait(5)
+            tokens.append(cached_token('stub_token', fetch))
+
+        workers = [threading.Thread(target=worker) for _ in range(8)]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(tokens, ['fresh-token'] * 8)
+
+    def test_waits_for_another_process_refreshing(self):
+        '''test a caller finding another process's lease uses the token that process stores'''
+        cache.add('stub_token:refreshing', True, timeout=5)
+        self.addCleanup(cache.delete, 'stub_token:refreshing')
+        threading.Timer(0.2, cache.set, args=('stub_token', 'their-token', 300)).start()
+
+        token = cached_token('stub_token', lambda: self.fail('the token was fetched twice'))
+
+        self.assertEqual(token, 'their-token')
+
+    def test_giving_up_on_a_lease_leaves_it_alone(self):
+        '''test a caller that stops waiting fetches a token itself without dropping the other process's lease'''
+        cache.add('stub_token:refreshing', True, timeout=5)
+        self.addCleanup(cache.delete, 'stub_token:refreshing')
+
+        token = cached_token('stub_token', lambda: ('own-token', 300), wait_seconds=0.2, poll_seconds=0.05)
+
+        self.assertEqual(token, 'own-token')
+        self.assertTrue(cache.get('stub_token:refreshing'))
+
+    def test_failed_refresh_is_not_cached(self):
+        '''test a failed token request is retried by the next caller'''
+        self.assertIsNone(cached_token('stub_token', lambda: (None, 0)))
+        self.assertEqual(cached_token('stub_token', lambda: ('fresh-token', 300)), 'fresh-token')
+
+
+class CourierUnavailableTests(SimpleTestCase):
+    '''Test how callers see an open breaker'''
+
+    def test_is_a_request_exception(self):
+        '''test existing requests.RequestException handlers treat an open breaker as a failed call'''
+        self.assertTrue(issubclass(CourierUnavailable, requests.RequestException))
@@ -0,0 +1,93 @@
+'''
+Tests for set-based courier invoice reconciliation.
+'''
+import datetime
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from warehouse.models import Warehouse
+from operation.invoice_reconciliation import InvoiceLine, reconcile_invoice_lines
+from operation.models import Order, Parcel, CourierCompany, CourierInvoice, CourierInvoiceItem
+
+
+def line(tracking_number, cost, invoice_number='INV-2', **fields):
+    return InvoiceLine(
+        tracking_number, Decimal(cost), {'invoice_number': invoice_number, 'cost': cost}, **fields,
+    )
+
+
+class ReconcileInvoiceLinesTests(TestCase):
+    '''Test billing invoice lines to invoice items'''
+
+    def setUp(self):
+        courier = CourierCompany.objects.create(name='DHL Express', code='DHL')
+        self.old_invoice = CourierInvoice.objects.create(courier_company=courier, invoice_number='INV-1')
+        self.invoice = CourierInvoice.objects.create(courier_company=courier, invoice_number='INV-2')
+        warehouse = Warehouse.objects.create(name='Main WH')
+        self.order = Order.objects.create(erp_order_id='9201', order_date=datetime.date(2025, 3, 1), warehouse=warehouse)
+        self.disputed = CourierInvoiceItem.objects.create(
+            courier_invoice=self.old_invoice, tracking_number='T-OLD', actual_cost=Decimal('10.00'),
+            receiver_state='Selangor', cost_history=[{'invoice_number': 'INV-1', 'cost': '10.00'}],
+            dispute_date=datetime.date(2025, 2, 20), dispute_history=[{'remark': 'overweight'}],
+            final_amount_after_dispute=Decimal('8.00'),
+        )
+
+    def test_rebilling_and_new_items(self):
+        '''test charges accumulate with their history in file order and disputes are left alone'''
+        parcel = Parcel.objects.create(order=self.order, tracking_number='T-NEW', status='DELIVERED')
+
+        created, updated = reconcile_invoice_lines(self.invoice, [
+            line('T-OLD', '2.50'),
+            line('T-NEW', '7.00', receiver_state='Johor'),
+            line('T-OLD', '1.00'),
+            line('T-NEW', '3.00', receiver_state='Johor'),
+        ])
+
+        self.assertEqual((created, updated), (1, 3))
+        self.disputed.refresh_from_db()
+        self.assertEqual(self.disputed.actual_cost, Decimal('13.50'))
+        self.assertEqual([charge['cost'] for charge in self.disputed.cost_history], ['10.00', '2.50', '1.00'])
+        self.assertEqual(self.disputed.courier_invoice, self.invoice)
+        self.assertEqual(self.disputed.dispute_history, [{'remark': 'overweight'}])
+        self.assertEqual(self.disputed.final_amount_after_dispute, Decimal('8.00'))
+
+        new_item = CourierInvoiceItem.objects.get(tracking_number='T-NEW')
+        self.assertEqual(new_item.actual_cost, Decimal('10.00'))
+        self.assertEqual(len(new_item.cost_history), 2)
+        self.assertEqual(new_item.parcel, parcel)
+
+    def test_update_fields_choose_what_a_rebill_overwrites(self):
+        '''test only the courier's update_fields replace an existing item's values'''
+        reconcile_invoice_lines(self.invoice, [line('T-OLD', '1.00', receiver_state='Penang')])
+        self.disputed.refresh_from_db()
+        self.assertEqual(self.disputed.receiver_state, 'Selangor')
+
+        reconcile_invoice_lines(
+            self.invoice, [line('T-OLD', '1.00', receiver_state='Penang')], update_fields=('receiver_state',),
+        )
+        self.disputed.refresh_from_db()
+        self.assertEqual(self.disputed.receiver_state, 'Penang')
+
+    def test_existing_parcel_link_is_kept(self):
+        '''test a re-bill links an unlinked item to its parcel but never relinks a linked one'''
+        parcel = Parcel.objects.create(order=self.order, tracking_number='T-OLD', status='DELIVERED')
+
+        reconcile_invoice_lines(self.invoice, [line('T-OLD', '1.00')])
+
+        self.disputed.refresh_from_db()
+        self.assertEqual(self.disputed.parcel, parcel)
+
+    def test_query_count_independent_of_line_count(self):
+        '''test a large invoice costs the same queries as a small one'''
+        def count_queries(invoice_number, count):
+            invoice = CourierInvoice.objects.create(courier_company=self.invoice.courier_company, invoice_number=invoice_number)
+            lines = [line(f'{invoice_number}-{i % (count // 2)}', '1.00', invoice_number) for i in range(count)]
+            lines.append(line('T-OLD', '1.00', invoice_number))
+            with CaptureQueriesContext(connection) as ctx:
+                reconcile_invoice_lines(invoice, lines)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries('SMALL', 4), count_queries('LARGE', 200))
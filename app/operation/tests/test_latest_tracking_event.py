@@ -0,0 +1,74 @@
+'''
+Tests for the latest tracking event kept on Parcel.
+'''
+import datetime
+import io
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from warehouse.models import Warehouse
+from operation.models import Order, Parcel, ParcelTrackingLog, CourierCompany
+from operation.services import apply_parcel_tracking_events
+
+START = datetime.datetime(2025, 2, 1, 8, 0, tzinfo=datetime.timezone.utc)
+
+
+def event(description, hours, event_id):
+    return {'timestamp': START + datetime.timedelta(hours=hours), 'description': description, 'event_id': event_id}
+
+
+class LatestTrackingEventTests(TestCase):
+    '''Test keeping a parcel's newest tracking event on the parcel row'''
+
+    def setUp(self):
+        warehouse = Warehouse.objects.create(name='Main WH')
+        order = Order.objects.create(erp_order_id='9101', order_date=datetime.date(2025, 1, 31), warehouse=warehouse)
+        courier = CourierCompany.objects.create(name='DHL Express', code='DHL')
+        self.parcel = Parcel.objects.create(
+            order=order, courier_company=courier, tracking_number='LATEST1', status='IN_TRANSIT',
+            shipped_at=START,
+        )
+
+    def test_ingestion_keeps_newest_event(self):
+        '''test applied events set the latest event fields and older events never replace them'''
+        apply_parcel_tracking_events(self.parcel, [event('Picked up', 0, 'e0'), event('Arrived at hub', 5, 'e1')])
+        apply_parcel_tracking_events(self.parcel, [event('Late scan', 2, 'e2')])
+
+        self.parcel.refresh_from_db()
+        self.assertEqual(self.parcel.latest_event_at, START + datetime.timedelta(hours=5))
+        self.assertEqual(self.parcel.latest_event_description, 'Arrived at hub')
+        self.assertEqual(self.parcel.latest_event_status, 'IN_TRANSIT')
+
+        apply_parcel_tracking_events(self.parcel, [event('Delivered', 9, 'e3')])
+        self.parcel.refresh_from_db()
+        self.assertEqual(self.parcel.latest_event_status, 'DELIVERED')
+
+    def test_simplified_status_reads_no_logs(self):
+        '''test the list page status comes from the parcel row alone'''
+        apply_parcel_tracking_events(self.parcel, [event('Delivered', 3, 'e0')])
+        parcel = Parcel.objects.get(pk=self.parcel.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(parcel.simplified_tracking_status, 'Delivered')
+
+    def test_backfill_command(self):
+        '''test the backfill copies each parcel's newest log and leaves parcels without logs alone'''
+        ParcelTrackingLog.objects.bulk_create([
+            ParcelTrackingLog(parcel=self.parcel, event_id='b0', timestamp=START, status_description='Picked up'),
+            ParcelTrackingLog(
+                parcel=self.parcel, event_id='b1', timestamp=START + datetime.timedelta(days=2),
+                status_description='Delivered to recipient',
+            ),
+        ])
+        untracked = Parcel.objects.create(order=self.parcel.order, tracking_number='NOLOGS', status='IN_TRANSIT')
+
+        call_command('backfill_latest_tracking_events', batch_size=1, stdout=io.StringIO())
+
+        self.parcel.refresh_from_db()
+        self.assertEqual(self.parcel.latest_event_at, START + datetime.timedelta(days=2))
+        self.assertEqual(self.parcel.latest_event_status, 'DELIVERED')
+        self.assertEqual(self.parcel.latest_event_description, 'Delivered to recipient')
+        untracked.refresh_from_db()
+        self.assertIsNone(untracked.latest_event_at)
+        self.assertEqual(untracked.simplified_tracking_status, 'Awaiting Tracking Update')
@@ -0,0 +1,360 @@
+'''
+Tests for the bulk order import commit engine.
+'''
+import io
+import tempfile
+from unittest import mock
+
+from openpyxl import Workbook
+
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from inventory.models import Product
+from warehouse.models import Warehouse, WarehouseProduct
+from customers.models import Customer
+from operation.models import Order, OrderItem, ImportBatch, ImportRow, ProductMapping, OrderImportJob
+from operation.order_import import (
+    commit_order_import, read_order_import_rows, stage_order_import, iter_staged_rows, run_order_import_job,
+    learn_product_mappings,
+)
+from operation.product_matching import get_learned_mappings
+from operation.tasks import process_order_import_job
+from operation.product_matching import ProductMatchIndex
+
+
+def make_row(order_id, product, quantity=1, **extra):
+    '''Return a confirmed import row as produced by the confirmation step.'''
+    row = {
+        'Order_ID': order_id,
+        'Order_Date': '2025-01-15',
+        'Warehouse_name': 'Main WH',
+        'Customer_Name': 'Jane Doe',
+        'company': '-',
+        'phone': '60123456789',
+        'Product_Name': product.name,
+        'Quantity': quantity,
+        'isCold': 'no',
+        'confirmed_product_id': product.pk,
+    }
+    row.update(extra)
+    return row
+
+
+class CommitOrderImportTests(TestCase):
+    '''Test committing confirmed import rows in bulk'''
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='importer@example.com', password='testpass123', name='Importer',
+        )
+        self.warehouse = Warehouse.objects.create(name='Main WH')
+        self.product_a = Product.objects.create(sku='SKU-A', name='Product A', price=1)
+        self.product_b = Product.objects.create(sku='SKU-B', name='Product B', price=1)
+
+    def test_creates_orders_items_and_warehouse_products(self):
+        '''test orders, items and missing warehouse products are created'''
+        rows = [
+            make_row('1001', self.product_a, 2),
+            make_row('1001', self.product_b, 3, isCold='yes'),
+            make_row('1002', self.product_a, 1, phone='60111111111', Customer_Name='John Roe'),
+        ]
+
+        created, updated, errors = commit_order_import(rows, self.user)
+
+        self.assertEqual((created, updated, errors), (2, 0, []))
+        order = Order.objects.get(erp_order_id='1001')
+        self.assertTrue(order.is_cold_chain)
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(WarehouseProduct.objects.filter(warehouse=self.warehouse).count(), 2)
+        self.assertEqual(Customer.objects.count(), 2)
+
+    def test_reimport_replaces_items(self):
+        '''test importing an existing order replaces its items'''
+        commit_order_import([make_row('1001', self.product_a, 2)], self.user)
+
+        created, updated, errors = commit_order_import([make_row('1001', self.product_b, 5)], self.user)
+
+        self.assertEqual((created, updated), (0, 1))
+        items = OrderItem.objects.filter(order__erp_order_id='1001')
+        self.assertEqual([(i.product_id, i.quantity_ordered) for i in items], [(self.product_b.pk, 5)])
+
+    def test_bad_order_reported_without_blocking_others(self):
+        '''test a per-order error skips only that order'''
+        rows = [
+            make_row('1001', self.product_a),
+            make_row('1002', self.product_a, Warehouse_name='Unknown WH'),
+        ]
+
+        created, updated, errors = commit_order_import(rows, self.user)
+
+        self.assertEqual(created, 1)
+        self.assertEqual(len(errors), 1)
+        self.assertIn('1002', errors[0])
+        self.assertFalse(Order.objects.filter(erp_order_id='1002').exists())
+
+    def test_query_count_independent_of_order_count(self):
+        '''test the number of queries does not grow with the number of orders'''
+        small = [make_row(f'S{i}', self.product_a) for i in range(5)]
+        large = [make_row(f'L{i}', self.product_a) for i in range(50)]
+        commit_order_import([make_row('W0', self.product_a)], self.user)
+
+        with CaptureQueriesContext(connection) as small_queries:
+            commit_order_import(small, self.user)
+        with CaptureQueriesContext(connection) as large_queries:
+            commit_order_import(large, self.user)
+
+        self.assertEqual(len(small_queries), len(large_queries))
+
+
+class StagedOrderImportTests(TestCase):
+    '''Test staging import rows in the database and committing them'''
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='importer@example.com', password='testpass123', name='Importer',
+        )
+        self.client.force_login(self.user)
+        Warehouse.objects.create(name='Main WH')
+        self.product_a = Product.objects.create(sku='SKU-A', name='Vitamin C 500mg', price=1)
+        self.product_b = Product.objects.create(sku='SKU-B', name='Zinc Tablets', price=1)
+
+    def _stage(self):
+        rows = [make_row('1001', self.product_a), make_row('1001', self.product_b), make_row('1002', self.product_a)]
+        for row in rows:
+            del row['confirmed_product_id']
+        rows[1]['Product_Name'] = 'Unknown thing'
+        ProductMapping.objects.create(imported_name='Unknown thing', mapped_product=self.product_b)
+        rows[2]['Product_Name'] = 'vitamin c 500 mg'
+        batch = ImportBatch.objects.create(created_by=self.user, original_filename='orders.xlsx', status='PARSING')
+        return stage_order_import(iter(rows), batch, chunk_size=2)
+
+    def test_rows_are_staged_with_suggestions(self):
+        '''test staged rows carry learned and fuzzy suggestions'''
+        batch = self._stage()
+
+        self.assertEqual((batch.row_count, batch.status), (3, 'STAGED'))
+        staged = list(batch.rows.values_list('row_index', 'suggested_product_id', 'similarity_score'))
+        self.assertEqual(staged[0][:2], (0, self.product_a.pk))
+        self.assertEqual(staged[1], (1, self.product_b.pk, 100))
+        self.assertEqual(staged[2][1], self.product_a.pk)
+
+    def test_confirmation_commits_staged_rows(self):
+        '''test confirming a batch creates the orders and clears the staged rows'''
+        batch = self._stage()
+        first_row = batch.rows.get(row_index=0)
+
+        response = self.client.get(reverse('operation:confirm_order_import', args=[batch.pk]))
+        self.assertContains(response, f'product_selection_{first_row.pk}')
+
+        with mock.patch('operation.views.process_order_import_job.delay', side_effect=process_order_import_job), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('operation:create_orders_from_import'), {
+                'batch_id': batch.pk,
+                f'product_selection_{first_row.pk}': self.product_b.pk,
+            })
+
+        self.assertRedirects(response, reverse('operation:order_list'), fetch_redirect_response=False)
+        job = OrderImportJob.objects.get(batch=batch, kind='COMMIT')
+        self.assertEqual((job.state, job.orders_created, job.rows_processed), ('SUCCEEDED', 2, 3))
+        self.assertEqual(
+            sorted(OrderItem.objects.filter(order__erp_order_id='1001').values_list('product_id', flat=True)),
+            [self.product_b.pk, self.product_b.pk],
+        )
+        self.assertTrue(Order.objects.filter(erp_order_id='1002').exists())
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, 'COMMITTED')
+        self.assertFalse(ImportRow.objects.filter(batch=batch).exists())
+
+    def test_commit_groups_an_orders_scattered_rows(self):
+        '''test the rows of an order spread over the file are committed together, one order per chunk'''
+        rows = [make_row('1001', self.product_a), make_row('1002', self.product_a), make_row('1001', self.product_b)]
+        for row in rows:
+            del row['confirmed_product_id']
+        batch = ImportBatch.objects.create(created_by=self.user, original_filename='orders.xlsx', status='PARSING')
+        stage_order_import(iter(rows), batch)
+
+        created, updated, errors = commit_order_import(iter_staged_rows(batch, by_order=True), self.user, chunk_size=1)
+
+        self.assertEqual((created, updated, errors), (2, 0, []))
+        self.assertEqual(
+            sorted(OrderItem.objects.filter(order__erp_order_id='1001').values_list('product_id', flat=True)),
+            sorted([self.product_a.pk, self.product_b.pk]),
+        )
+
+    def test_other_users_cannot_touch_a_staged_import(self):
+        '''test a staged import can only be reviewed and confirmed by the user who uploaded it'''
+        batch = self._stage()
+        first_row = batch.rows.get(row_index=0)
+        other = get_user_model().objects.create_user(email='other@example.com', password='testpass123', name='Other')
+        self.client.force_login(other)
+
+        response = self.client.get(reverse('operation:confirm_order_import', args=[batch.pk]))
+        self.assertEqual(response.status_code, 404)
+
+        with mock.patch('operation.views.process_order_import_job.delay') as delay:
+            response = self.client.post(reverse('operation:create_orders_from_import'), {
+                'batch_id': batch.pk,
+                f'product_selection_{first_row.pk}': self.product_b.pk,
+            })
+
+        self.assertRedirects(response, reverse('operation:import_orders_from_excel'), fetch_redirect_response=False)
+        delay.assert_not_called()
+        first_row.refresh_from_db()
+        self.assertIsNone(first_row.confirmed_product_id)
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, 'STAGED')
+
+    def test_retried_commit_job_does_not_duplicate_orders(self):
+        '''test re-running a commit that was interrupted after some chunks updates instead of duplicating'''
+        batch = self._stage()
+        commit_order_import(iter_staged_rows(batch), self.user)
+        job = OrderImportJob.objects.create(batch=batch, kind='COMMIT', created_by=self.user, state='RUNNING')
+
+        job = run_order_import_job(job.pk)
+
+        self.assertEqual((job.state, job.orders_created, job.orders_updated), ('SUCCEEDED', 0, 2))
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(OrderItem.objects.count(), 3)
+
+
+def make_xlsx(rows, headers=None):
+    '''Return an in-memory .xlsx upload with the given data rows.'''
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(headers or ['Order ID', 'Warehouse name', 'Address name', 'Product name', 'Product quantity', 'company'])
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return SimpleUploadedFile('orders.xlsx', buffer.getvalue())
+
+
+class LearnProductMappingsTests(TestCase):
+    '''Test learning product mappings from confirmed rows'''
+
+    def setUp(self):
+        self.product_a = Product.objects.create(sku='SKU-A', name='Product A', price=1)
+        self.product_b = Product.objects.create(sku='SKU-B', name='Product B', price=1)
+        ProductMapping.objects.create(imported_name='Prod A', mapped_product=self.product_a)
+
+    def test_only_new_or_changed_mappings_are_written(self):
+        '''test duplicate names are written once and unchanged mappings are not touched'''
+        rows = [
+            {'Product_Name': 'Prod A', 'confirmed_product_id': self.product_a.pk},
+            {'Product_Name': 'Prod B', 'confirmed_product_id': self.product_a.pk},
+            {'Product_Name': 'Prod B', 'confirmed_product_id': self.product_b.pk},
+        ]
+
+        self.assertEqual(learn_product_mappings(rows), 1)
+        self.assertEqual(
+            dict(ProductMapping.objects.values_list('imported_name', 'mapped_product_id')),
+            {'Prod A': self.product_a.pk, 'Prod B': self.product_b.pk},
+        )
+        get_learned_mappings()  # reload after the write
+        with self.assertNumQueries(0):
+            self.assertEqual(learn_product_mappings(rows), 0)
+
+    def test_cached_mappings_follow_model_changes(self):
+        '''test the mapping cache is reused until a mapping is saved or deleted'''
+        get_learned_mappings()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_learned_mappings(), {'Prod A': self.product_a.pk})
+
+        ProductMapping.objects.filter(imported_name='Prod A').get().delete()
+
+        self.assertEqual(get_learned_mappings(), {})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class OrderImportUploadJobTests(TestCase):
+    '''Test reading uploaded files in a background job'''
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='importer@example.com', password='testpass123', name='Importer',
+        )
+        self.client.force_login(self.user)
+        Product.objects.create(sku='SKU-A', name='Product A', price=1)
+
+    def _upload(self, upload):
+        with mock.patch('operation.views.process_order_import_job.delay', side_effect=process_order_import_job), \
+                self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('operation:import_orders_from_excel'), {'excel_file': upload})
+
+    def test_upload_stages_rows_and_reports_progress(self):
+        '''test the stage job stages the rows and the status endpoint links to the review page'''
+        response = self._upload(make_xlsx([
+            [1001, 'Main WH', 'Jane Doe', 'Product A', 2, None],
+            [None, None, None, 'Product A', 1, None],
+        ]))
+
+        self.assertRedirects(response, reverse('operation:order_list'), fetch_redirect_response=False)
+        job = OrderImportJob.objects.get(kind='STAGE')
+        self.assertEqual((job.state, job.rows_total, job.rows_processed), ('SUCCEEDED', 2, 2))
+        self.assertFalse(job.source_file)
+        self.assertEqual(job.batch.rows.count(), 2)
+
+        status = self.client.get(reverse('operation:order_import_job_status', args=[job.pk])).json()
+        self.assertEqual(status['progress_percent'], 100)
+        self.assertEqual(status['review_url'], reverse('operation:confirm_order_import', args=[job.batch_id]))
+
+    def test_bad_file_fails_job_with_message(self):
+        '''test header problems are recorded on the failed job'''
+        self._upload(make_xlsx([[1001, 'Product A']], headers=['Order ID', 'Product name']))
+
+        job = OrderImportJob.objects.get(kind='STAGE')
+        self.assertEqual(job.state, 'FAILED')
+        self.assertIn('Product quantity', job.errors[0])
+        self.assertEqual(job.batch.status, 'FAILED')
+
+
+class ReadOrderImportRowsTests(SimpleTestCase):
+    '''Test the streaming order file reader'''
+
+    def test_forward_fills_order_fields_and_skips_invalid_rows(self):
+        '''test continuation lines inherit order fields and incomplete rows are dropped'''
+        upload = make_xlsx([
+            [1001.0, 'Main WH', 'Jane Doe', 'Product A', 2, 'ACME'],
+            [None, None, None, 'Product B', 1, None],
+            [None, None, None, None, None, None],
+            [1002, 'Main WH', 'John Roe', 'Product C', None, None],
+        ])
+
+        rows = list(read_order_import_rows(upload))
+
+        self.assertEqual([r['Order_ID'] for r in rows], ['1001', '1001'])
+        self.assertEqual(rows[1]['Customer_Name'], 'Jane Doe')
+        self.assertEqual(rows[1]['company'], 'ACME')
+        self.assertEqual(rows[1]['Product_Name'], 'Product B')
+
+    def test_missing_required_header(self):
+        '''test a missing required header is reported before reading rows'''
+        upload = make_xlsx([], headers=['Order ID', 'Product name'])
+
+        with self.assertRaisesMessage(ValueError, 'Product quantity'):
+            read_order_import_rows(upload)
+
+
+class ProductMatchIndexTests(SimpleTestCase):
+    '''Test the vectorised product name matcher'''
+
+    def test_matches_agree_with_fuzzywuzzy_extract_one(self):
+        '''test suggestions and scores equal the per-row extractOne results'''
+        from fuzzywuzzy import fuzz, process
+
+        product_choices = {'Vitamin C 500mg': 1, 'Vitamin D3 1000IU': 2, 'Fish Oil Omega-3': 3, 'Zinc Tablets': 4}
+        names = ['vitamin c 500 mg', 'VITAMIN D3', 'Omega 3 fish oil', 'Zinc', 'Unrelated Widget', 'vitamin c 500 mg']
+
+        matches = ProductMatchIndex(product_choices).match(names)
+
+        for name in set(names):
+            expected = process.extractOne(name, product_choices.keys(), scorer=fuzz.ratio)
+            if expected[1] >= 60:
+                self.assertEqual(matches[name], (product_choices[expected[0]], expected[1]))
+            else:
+                self.assertNotIn(name, matches)
@@ -0,0 +1,100 @@
+'''
+Tests for deferred order status recomputation.
+'''
+import datetime
+from unittest import mock
+
+from django.test import TestCase
+from django.db import transaction
+
+from inventory.models import Product
+from warehouse.models import Warehouse
+from operation.models import Order, OrderItem
+from operation import order_status
+from operation.order_status import mark_orders_dirty, recompute_order_statuses, flush_dirty_orders
+
+
+class OrderStatusTests(TestCase):
+    '''Test order statuses are recomputed once per transaction'''
+
+    def setUp(self):
+        self.warehouse = Warehouse.objects.create(name='Main WH')
+        self.product = Product.objects.create(sku='SKU-A', name='Product A', price=1)
+
+    def make_order(self, erp_order_id, *quantities, **fields):
+        # Run the recompute queued by the item saves, so each test starts with nothing pending.
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(
+                erp_order_id=erp_order_id, order_date=datetime.date(2025, 1, 15), warehouse=self.warehouse, **fields,
+            )
+            items = [
+                OrderItem.objects.create(order=order, product=self.product, quantity_ordered=qty)
+                for qty in quantities
+            ]
+        return order, items
+
+    def status_of(self, order):
+        return Order.objects.values_list('status', flat=True).get(pk=order.pk)
+
+    def test_recompute_applies_status_rules(self):
+        '''test packed, removed, empty and terminal orders get the expected status'''
+        partial, (item,) = self.make_order('1', 4)
+        OrderItem.objects.filter(pk=item.pk).update(quantity_packed=1)
+        full, (item_a, item_b) = self.make_order('2', 2, 3)
+        OrderItem.objects.filter(pk=item_a.pk).update(quantity_packed=2)
+        Order.objects.filter(pk=full.pk).update(items_removed_log=[
+            {'order_item_id': item_b.pk, 'removed_qty': 1},
+            {'order_item_id': item_b.pk, 'removed_qty': 2},
+        ])
+        empty, _ = self.make_order('3', status='PARTIALLY_SHIPPED')
+        closed, _ = self.make_order('4', 5, status='ADJUSTED_TO_CLOSE')
+
+        changed = recompute_order_statuses([partial.pk, full.pk, empty.pk, closed.pk])
+
+        self.assertEqual(changed, {
+            partial.pk: 'PARTIALLY_SHIPPED',
+            full.pk: 'FULLY_SHIPPED',
+            empty.pk: 'NEW_ORDER',
+        })
+        self.assertEqual(self.status_of(closed), 'ADJUSTED_TO_CLOSE')
+
+    def test_dirty_orders_recomputed_once_on_commit(self):
+        '''test many saves inside a transaction trigger one recompute at commit'''
+        order, items = self.make_order('1', 1, 1)
+
+        with mock.patch.object(order_status, 'recompute_order_statuses', wraps=recompute_order_statuses) as recompute:
+            with self.captureOnCommitCallbacks(execute=True):
+                for item in items:
+                    item.quantity_packed = 1
+                    item.save()
+                order.save()
+                self.assertEqual(self.status_of(order), 'NEW_ORDER')
+
+        recompute.assert_called_once_with({order.pk})
+        self.assertEqual(self.status_of(order), 'FULLY_SHIPPED')
+
+    def test_rolled_back_savepoint_does_not_drop_later_marks(self):
+        '''test orders marked after a rolled-back savepoint are still recomputed'''
+        order, (item,) = self.make_order('1', 2)
+        OrderItem.objects.filter(pk=item.pk).update(quantity_packed=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    mark_orders_dirty([order.pk])
+                    raise ValueError
+            except ValueError:
+                pass
+            mark_orders_dirty([order.pk])
+
+        self.assertEqual(self.status_of(order), 'PARTIALLY_SHIPPED')
+
+    def test_flush_recomputes_before_commit(self):
+        '''test flush_dirty_orders makes the new status visible inside the transaction'''
+        order, (item,) = self.make_order('1', 2)
+        OrderItem.objects.filter(pk=item.pk).update(quantity_packed=2)
+
+        mark_orders_dirty([order.pk])
+        flush_dirty_orders()
+
+        self.assertEqual(self.status_of(order), 'FULLY_SHIPPED')
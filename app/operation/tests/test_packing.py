@@ -0,0 +1,133 @@
+'''
+Tests for the single-pass packing service.
+'''
+import datetime
+
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.contrib.auth import get_user_model
+
+from inventory.models import (
+    Product, InventoryBatchItem, StockTransaction, PackagingMaterial,
+    WarehousePackagingMaterial, PackagingStockTransaction,
+)
+from warehouse.models import Warehouse, WarehouseProduct
+from operation.models import Order, OrderItem, ParcelItem, CourierCompany, PackagingType, PackagingTypeMaterialComponent
+from operation.packing import pack_order, PackingError
+
+
+class PackOrderTests(TestCase):
+    '''Test packing order lines into a parcel in one pass'''
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='packer@example.com', password='testpass123', name='Packer',
+        )
+        self.warehouse = Warehouse.objects.create(name='Main WH')
+        self.courier = CourierCompany.objects.create(name='DHL', code='DHL')
+        self.packaging_type = PackagingType.objects.create(name='Box S', warehouse=self.warehouse)
+        material = PackagingMaterial.objects.create(name='Foam Box A1')
+        PackagingTypeMaterialComponent.objects.create(
+            packaging_type=self.packaging_type, packaging_material=material, quantity=1,
+        )
+        self.box_stock = WarehousePackagingMaterial.objects.create(
+            packaging_material=material, warehouse=self.warehouse, current_stock=10,
+        )
+        self.order = Order.objects.create(erp_order_id='5001', order_date=datetime.date(2025, 1, 15), warehouse=self.warehouse)
+
+    def make_item(self, sku, quantity_ordered, batch_quantities):
+        product = Product.objects.create(sku=sku, name=f'Product {sku}', price=1)
+        warehouse_product = WarehouseProduct.objects.create(
+            warehouse=self.warehouse, product=product, quantity=sum(batch_quantities),
+        )
+        batches = [
+            InventoryBatchItem.objects.create(
+                warehouse_product=warehouse_product, batch_number=f'{sku}-B{i}', quantity=qty,
+            )
+            for i, qty in enumerate(batch_quantities)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            order_item = OrderItem.objects.create(
+                order=self.order, product=product, warehouse_product=warehouse_product, quantity_ordered=quantity_ordered,
+            )
+        return order_item, batches
+
+    def pack(self, lines):
+        return pack_order(
+            self.order, lines, courier_company=self.courier, packaging_type=self.packaging_type, user=self.user,
+        )
+
+    def test_packs_item_from_several_batches(self):
+        '''test an item packed from two batches deducts each batch and updates statuses'''
+        order_item, (batch_1, batch_2) = self.make_item('SKU-A', 5, [3, 4])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            parcel = self.pack([
+                {'order_item_id': order_item.pk, 'batch_id': batch_1.pk, 'quantity': 3},
+                {'order_item_id': order_item.pk, 'batch_id': batch_2.pk, 'quantity': 2},
+            ])
+
+        self.assertEqual(parcel.items_in_parcel.count(), 2)
+        batch_1.refresh_from_db()
+        batch_2.refresh_from_db()
+        self.assertEqual((batch_1.quantity, batch_2.quantity), (0, 2))
+        self.assertEqual(WarehouseProduct.objects.get(pk=batch_1.warehouse_product_id).quantity, 2)
+        self.assertEqual(
+            sorted(StockTransaction.objects.filter(related_order=self.order).values_list('quantity', flat=True)),
+            [-3, -2],
+        )
+        self.box_stock.refresh_from_db()
+        self.assertEqual(self.box_stock.current_stock, 9)
+        self.assertEqual(PackagingStockTransaction.objects.get(related_parcel=parcel).quantity, -1)
+        order_item.refresh_from_db()
+        self.assertEqual((order_item.quantity_packed, order_item.status), (5, 'PACKED'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'FULLY_SHIPPED')
+
+    def test_partial_pack_marks_order_partially_shipped(self):
+        '''test packing part of an order leaves it partially shipped'''
+        order_item, (batch,) = self.make_item('SKU-A', 5, [10])
+        self.make_item('SKU-B', 2, [10])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pack([{'order_item_id': order_item.pk, 'batch_id': batch.pk, 'quantity': 2}])
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'PARTIALLY_SHIPPED')
+
+    def test_insufficient_batch_stock_writes_nothing(self):
+        '''test over-packing a batch raises and rolls back'''
+        order_item, (batch,) = self.make_item('SKU-A', 5, [2])
+
+        with self.assertRaisesMessage(PackingError, 'Not enough stock for SKU-A'):
+            self.pack([{'order_item_id': order_item.pk, 'batch_id': batch.pk, 'quantity': 3}])
+
+        batch.refresh_from_db()
+        self.assertEqual(batch.quantity, 2)
+        self.assertFalse(ParcelItem.objects.exists())
+        self.assertFalse(self.order.parcels.exists())
+
+    def test_cannot_pack_more_than_remaining(self):
+        '''test packing beyond the quantity remaining on the order is rejected'''
+        order_item, (batch,) = self.make_item('SKU-A', 2, [10])
+
+        with self.assertRaisesMessage(PackingError, 'Only 2 are remaining'):
+            self.pack([{'order_item_id': order_item.pk, 'batch_id': batch.pk, 'quantity': 3}])
+
+    def test_query_count_independent_of_line_count(self):
+        '''test packing many lines takes as many queries as packing one'''
+        def count_queries(lines):
+            with CaptureQueriesContext(connection) as ctx:
+                self.pack(lines)
+            return len(ctx.captured_queries)
+
+        single_item, (single_batch,) = self.make_item('SKU-ONE', 1, [5])
+        one_line = count_queries([{'order_item_id': single_item.pk, 'batch_id': single_batch.pk, 'quantity': 1}])
+
+        many_lines = []
+        for n in range(6):
+            order_item, batches = self.make_item(f'SKU-{n}', 2, [1, 1])
+            many_lines += [{'order_item_id': order_item.pk, 'batch_id': batch.pk, 'quantity': 1} for batch in batches]
+
+        self.assertEqual(count_queries(many_lines), one_line)
@@ -0,0 +1,71 @@
+'''
+Tests for the sequence-backed parcel code allocator.
+'''
+import datetime
+
+from django.test import TestCase, SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+
+from warehouse.models import Warehouse
+from operation.models import Order, Parcel
+from operation.parcel_codes import (
+    PARCEL_CODE_ALPHABET, encode_parcel_code, is_valid_parcel_code, allocate_parcel_codes,
+)
+
+
+class EncodeParcelCodeTests(SimpleTestCase):
+    '''Test encoding sequence values as parcel codes'''
+
+    def test_codes_are_unique_and_grow_past_the_four_symbol_space(self):
+        '''test codes stay unique across the 4/5-symbol boundary'''
+        boundary = len(PARCEL_CODE_ALPHABET) ** 4
+        numbers = list(range(1, 5000)) + list(range(boundary - 2000, boundary + 2000))
+
+        codes = [encode_parcel_code(n) for n in numbers]
+
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertEqual(len(encode_parcel_code(boundary - 1)), 5)
+        self.assertEqual(len(encode_parcel_code(boundary)), 6)
+        self.assertTrue(all(set(code) <= set(PARCEL_CODE_ALPHABET) for code in codes))
+
+    def test_check_character_catches_typos(self):
+        '''test a single wrong symbol or an adjacent swap is rejected'''
+        code = encode_parcel_code(12345)
+        self.assertTrue(is_valid_parcel_code(code))
+        self.assertTrue(is_valid_parcel_code(code.lower()))
+
+        for i, symbol in enumerate(code):
+            for other in PARCEL_CODE_ALPHABET.replace(symbol, ''):
+                self.assertFalse(is_valid_parcel_code(code[:i] + other + code[i + 1:]))
+        for i in range(len(code) - 1):
+            if code[i] != code[i + 1]:
+                self.assertFalse(is_valid_parcel_code(code[:i] + code[i + 1] + code[i] + code[i + 2:]))
+
+    def test_legacy_codes_are_not_valid(self):
+        '''test 4-character codes from the old generator are never accepted'''
+        self.assertFalse(is_valid_parcel_code('AB12'))
+
+
+class AllocateParcelCodesTests(TestCase):
+    '''Test allocating parcel codes from the database sequence'''
+
+    def test_bulk_allocation_uses_one_query(self):
+        '''test many codes are reserved with a single query'''
+        with CaptureQueriesContext(connection) as ctx:
+            codes = allocate_parcel_codes(50)
+
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(len(set(codes)), 50)
+        self.assertTrue(all(is_valid_parcel_code(code) for code in codes))
+
+    def test_new_parcel_gets_code_without_reading_parcels(self):
+        '''test saving a new parcel allocates its code without an existence check'''
+        warehouse = Warehouse.objects.create(name='Main WH')
+        order = Order.objects.create(erp_order_id='6001', order_date=datetime.date(2025, 1, 15), warehouse=warehouse)
+
+        with CaptureQueriesContext(connection) as ctx:
+            parcel = Parcel.objects.create(order=order)
+
+        self.assertTrue(is_valid_parcel_code(parcel.parcel_code_system))
+        self.assertFalse(any('FROM "operation_parcel"' in query['sql'] for query in ctx.captured_queries))
@@ -0,0 +1,116 @@
+'''
+Tests for bulk parcel status transitions.
+'''
+import datetime
+
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.contrib.auth import get_user_model
+
+from inventory.models import Product, InventoryBatchItem, StockTransaction
+from warehouse.models import Warehouse, WarehouseProduct
+from operation.models import Order, OrderItem, Parcel, CourierCompany, PackagingType
+from operation.packing import pack_order
+
+
+class ParcelTransitionTests(TestCase):
+    '''Test moving many parcels to a new status at once'''
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='courier-desk@example.com', password='testpass123', name='Courier Desk',
+        )
+        self.warehouse = Warehouse.objects.create(name='Main WH')
+        self.courier = CourierCompany.objects.create(name='DHL', code='DHL')
+        self.packaging_type = PackagingType.objects.create(name='Envelope', warehouse=self.warehouse)
+        product = Product.objects.create(sku='SKU-A', name='Product A', price=1)
+        self.warehouse_product = WarehouseProduct.objects.create(warehouse=self.warehouse, product=product, quantity=100)
+        self.batch = InventoryBatchItem.objects.create(
+            warehouse_product=self.warehouse_product, batch_number='B1', quantity=100,
+        )
+
+    def make_parcels(self, count, quantity=2):
+        parcels = []
+        for _ in range(count):
+            with self.captureOnCommitCallbacks(execute=True):
+                order = Order.objects.create(
+                    erp_order_id=f'T{Order.objects.count()}', order_date=datetime.date(2025, 1, 15), warehouse=self.warehouse,
+                )
+                order_item = OrderItem.objects.create(
+                    order=order, product=self.warehouse_product.product, warehouse_product=self.warehouse_product,
+                    quantity_ordered=quantity,
+                )
+                parcels.append(pack_order(
+                    order, [{'order_item_id': order_item.pk, 'batch_id': self.batch.pk, 'quantity': quantity}],
+                    courier_company=self.courier, packaging_type=self.packaging_type, user=self.user,
+                ))
+        return parcels
+
+    def test_picked_up_stamps_and_ships_items(self):
+        '''test picking up parcels stamps shipped_at and marks their items shipped'''
+        parcels = self.make_parcels(2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Parcel.objects.transition([p.pk for p in parcels], 'PICKED_UP', self.user)
+
+        for parcel in Parcel.objects.filter(pk__in=[p.pk for p in parcels]):
+            self.assertEqual(parcel.status, 'PICKED_UP')
+            self.assertIsNotNone(parcel.shipped_at)
+        self.assertEqual(
+            set(OrderItem.objects.values_list('status', 'quantity_shipped')),
+            {('ITEM_SHIPPED', 2)},
+        )
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'FULLY_SHIPPED'})
+
+    def test_returned_parcels_restock_batches(self):
+        '''test returning shipped parcels puts their stock back in one pass'''
+        parcels = self.make_parcels(3)
+        Parcel.objects.transition([p.pk for p in parcels], 'PICKED_UP', self.user)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.quantity, 94)
+
+        Parcel.objects.transition([p.pk for p in parcels], 'RETURNED_COURIER', self.user)
+
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.quantity, 100)
+        returns = StockTransaction.objects.filter(transaction_type=StockTransaction.TransactionTypes.RETURN_IN)
+        self.assertEqual(sorted(returns.values_list('quantity', flat=True)), [2, 2, 2])
+        self.assertEqual(
+            set(OrderItem.objects.values_list('status', 'quantity_returned_to_stock', 'quantity_shipped')),
+            {('ITEM_RETURNED_RESTOCKED', 2, 0)},
+        )
+        self.assertFalse(Parcel.objects.filter(returned_at__isnull=True).exists())
+
+    def test_returning_unshipped_parcel_does_not_restock(self):
+        '''test cancelling a parcel that never left the warehouse returns no stock'''
+        parcels = self.make_parcels(1)
+
+        Parcel.objects.transition([parcels[0].pk], 'CANCELLED', self.user)
+
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.quantity, 98)
+        self.assertFalse(StockTransaction.objects.filter(transaction_type='RETURN_IN').exists())
+
+    def test_query_count_independent_of_parcel_count(self):
+        '''test transitioning many parcels takes as many queries as one'''
+        def count_queries(parcels):
+            ids = [p.pk for p in parcels]
+            Parcel.objects.transition(ids, 'PICKED_UP', self.user)
+            with CaptureQueriesContext(connection) as ctx:
+                Parcel.objects.transition(ids, 'RETURNED_COURIER', self.user)
+            return len(ctx.captured_queries)
+
+        one_parcel = count_queries(self.make_parcels(1))
+
+        self.assertEqual(count_queries(self.make_parcels(5)), one_parcel)
+
+    def test_save_uses_loaded_status(self):
+        '''test saving a loaded parcel does not re-read its row'''
+        parcel = Parcel.objects.get(pk=self.make_parcels(1)[0].pk)
+        parcel.notes = 'Fragile'
+
+        with CaptureQueriesContext(connection) as ctx:
+            parcel.save()
+
+        self.assertFalse(any('FROM "operation_parcel"' in query['sql'] for query in ctx.captured_queries))
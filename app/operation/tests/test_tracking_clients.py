@@ -0,0 +1,90 @@
+'''
+Tests for the multi-shipment courier tracking clients, against recorded API responses.
+'''
+from pathlib import Path
+from unittest import mock
+
+import requests
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from operation.courier_http import CourierClient
+from operation.services import (
+    get_dhl_tracking_details, get_dhl_tracking_details_bulk, get_fedex_tracking_details_bulk,
+)
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'tracking'
+
+
+def recorded_response(name, status=200):
+    response = requests.Response()
+    response.status_code = status
+    response._content = (FIXTURES / name).read_bytes()
+    return response
+
+
+class RecordedResponseTestCase(SimpleTestCase):
+    courier_key = None
+
+    def setUp(self):
+        # A fresh client per test, without retries, so breaker state does not leak between tests.
+        self.courier = CourierClient(self.courier_key, max_retries=0)
+        patcher = mock.patch.dict('operation.courier_http.COURIER_CLIENTS', {self.courier_key: self.courier})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def replay(self, name, status=200):
+        return mock.patch.object(self.courier.session, 'request', return_value=recorded_response(name, status))
+
+
+@override_settings(DHL_API_KEY='test-key')
+class DhlBulkTrackingTests(RecordedResponseTestCase):
+    '''Test DHL tracking several shipments per request'''
+    courier_key = 'dhl'
+
+    def test_one_request_fans_out_per_tracking_number(self):
+        '''test shipments in one response are matched back to their tracking numbers'''
+        with self.replay('dhl_shipments.json') as get:
+            results = get_dhl_tracking_details_bulk(['1234567890', '2234567890', '9999999999'])
+
+        get.assert_called_once()
+        self.assertEqual(get.call_args.kwargs['params']['trackingNumber'], '1234567890,2234567890,9999999999')
+        self.assertEqual([event['description'] for event in results['1234567890']][0], 'Delivered')
+        self.assertEqual(len(results['1234567890']), 3)
+        self.assertEqual(results['2234567890'][0]['location'], 'KUALA LUMPUR - MALAYSIA')
+        self.assertEqual(results['9999999999'], [])
+
+    def test_failed_request_fails_every_number(self):
+        '''test a failed request gives None, not an empty history, for each number'''
+        with self.replay('dhl_shipments.json', status=503):
+            results = get_dhl_tracking_details_bulk(['1234567890', '2234567890'])
+
+        self.assertEqual(results, {'1234567890': None, '2234567890': None})
+
+    def test_single_number_client_is_unchanged(self):
+        '''test the one-number client still returns that shipment's events'''
+        with self.replay('dhl_shipments.json'):
+            events = get_dhl_tracking_details('1234567890')
+
+        self.assertEqual(events[-1]['description'], 'Shipment picked up')
+
+
+class FedexBulkTrackingTests(RecordedResponseTestCase):
+    '''Test FedEx tracking several shipments per request'''
+    courier_key = 'fedex'
+
+    def setUp(self):
+        super().setUp()
+        cache.set('fedex_access_token', 'test-token')
+        self.addCleanup(cache.delete, 'fedex_access_token')
+
+    def test_one_request_fans_out_per_tracking_number(self):
+        '''test every number goes in one trackingInfo list and unknown numbers get no events'''
+        with self.replay('fedex_track.json') as post:
+            results = get_fedex_tracking_details_bulk(['794612345678', '794687654321'])
+
+        post.assert_called_once()
+        self.assertEqual(len(post.call_args.kwargs['json']['trackingInfo']), 2)
+        self.assertEqual([event['description'] for event in results['794612345678']], ['Delivered', 'Picked up'])
+        self.assertEqual(results['794612345678'][0]['location'], 'PENANG')
+        self.assertEqual(results['794687654321'], [])
@@ -0,0 +1,86 @@
+'''
+Tests for bulk, idempotent ingestion of courier tracking events.
+'''
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from warehouse.models import Warehouse
+from operation.models import Order, Parcel, ParcelTrackingLog, CourierCompany
+from operation.services import apply_parcel_tracking_events, ingest_tracking_events
+
+START = datetime.datetime(2025, 1, 10, 8, 0, tzinfo=datetime.timezone.utc)
+
+
+def scan_history(tracking_number, count, last_description='In transit'):
+    '''`count` hourly scans, newest first, the newest described as `last_description`'''
+    return [
+        {
+            'timestamp': START + datetime.timedelta(hours=i),
+            'description': last_description if i == count - 1 else f'Scan {i}',
+            'location': 'Leipzig',
+            'event_id': f'{tracking_number}-{i}',
+        }
+        for i in reversed(range(count))
+    ]
+
+
+class TrackingIngestionTests(TestCase):
+    '''Test storing courier tracking events for a parcel'''
+
+    def setUp(self):
+        warehouse = Warehouse.objects.create(name='Main WH')
+        order = Order.objects.create(erp_order_id='9001', order_date=datetime.date(2025, 1, 9), warehouse=warehouse)
+        courier = CourierCompany.objects.create(name='DHL Express', code='DHL')
+        self.make_parcel = lambda tracking_number: Parcel.objects.create(
+            order=order, courier_company=courier, tracking_number=tracking_number, status='READY_TO_SHIP',
+        )
+
+    def count_queries(self, parcel, events):
+        with CaptureQueriesContext(connection) as ctx:
+            apply_parcel_tracking_events(parcel, events)
+        return len(ctx.captured_queries)
+
+    def test_query_count_independent_of_history_length(self):
+        '''test a parcel with 40 scans costs the same queries as one with 2'''
+        short = self.count_queries(self.make_parcel('SHORT'), scan_history('SHORT', 2))
+        long = self.count_queries(self.make_parcel('LONG'), scan_history('LONG', 40))
+
+        self.assertEqual(short, long)
+        self.assertEqual(ParcelTrackingLog.objects.filter(parcel__tracking_number='LONG').count(), 40)
+
+    def test_refresh_is_idempotent(self):
+        '''test re-applying a longer history stores only the new scans'''
+        parcel = self.make_parcel('DHL1')
+        apply_parcel_tracking_events(parcel, scan_history('DHL1', 3))
+
+        self.assertEqual(ingest_tracking_events(parcel, scan_history('DHL1', 5)), 2)
+        self.assertEqual(ingest_tracking_events(parcel, scan_history('DHL1', 5)), 0)
+        self.assertEqual(parcel.tracking_logs.count(), 5)
+
+    def test_status_follows_newest_event(self):
+        '''test the transition is taken from the newest event and shipped_at from the oldest'''
+        parcel = self.make_parcel('DHL2')
+        events = scan_history('DHL2', 4, last_description='Delivered')
+
+        success, _ = apply_parcel_tracking_events(parcel, events)
+
+        parcel.refresh_from_db()
+        self.assertTrue(success)
+        self.assertEqual(parcel.status, 'DELIVERED')
+        self.assertEqual(parcel.delivered_at, START + datetime.timedelta(hours=3))
+        self.assertEqual(parcel.shipped_at, START)
+
+    def test_events_are_normalized(self):
+        '''test events without an id get a stable one, duplicates collapse and undated events are dropped'''
+        parcel = self.make_parcel('UPS1')
+        event = {'timestamp': START, 'description': 'Picked up', 'location': 'x' * 300}
+        events = [event, dict(event), {'timestamp': None, 'description': 'Label created'}]
+
+        self.assertEqual(ingest_tracking_events(parcel, events), 1)
+        self.assertEqual(ingest_tracking_events(parcel, [dict(event)]), 0)
+        log = parcel.tracking_logs.get()
+        self.assertEqual(log.event_id, f'UPS1-{START.isoformat()}-Picked up')
+        self.assertEqual(len(log.location), 255)
@@ -0,0 +1,295 @@
+'''
+Tests for the concurrent tracking refresher, run against local stub courier APIs.
+'''
+import datetime
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlparse, parse_qs
+
+from django.core.cache import cache
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.utils import timezone
+
+from warehouse.models import Warehouse
+from operation.models import Order, Parcel, CourierCompany, TrackingRefreshRun
+from operation.courier_http import CourierClient
+from operation.services import get_dhl_tracking_details_bulk
+from operation.tracking_refresh import (
+    TokenBucket, flag_sla_breaches, next_poll_at, poll_phase, refresh_parcels, refresh_in_flight_parcels,
+)
+
+
+class StubCourierHandler(BaseHTTPRequestHandler):
+    '''
+    Answers like the DHL, FedEx and UPS tracking APIs. A request asking about
+    any tracking number starting with FAIL gets a 500.
+    '''
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _answerable(self, tracking_numbers):
+        self.server.calls.append(tracking_numbers)
+        if any(tracking_number.startswith('FAIL') for tracking_number in tracking_numbers):
+            self._reply(500, {'detail': 'stub failure'})
+            return False
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/track/shipments':
+            tracking_numbers = parse_qs(url.query)['trackingNumber'][0].split(',')
+            if self._answerable(tracking_numbers):
+                self._reply(200, {'shipments': [
+                    {'id': tracking_number, 'events': [{
+                        'id': f'{tracking_number}-1', 'timestamp': '2025-01-16T08:00:00Z',
+                        'description': f'Delivered {tracking_number}',
+                        'location': {'address': {'addressLocality': 'Leipzig'}},
+                    }]}
+                    for tracking_number in tracking_numbers
+                ]})
+        elif url.path.startswith('/api/track/v1/details/'):
+            tracking_number = url.path.rsplit('/', 1)[1]
+            if self._answerable([tracking_number]):
+                self._reply(200, {'trackResponse': {'shipment': [{'package': [{'activity': [{
+                    'date': '20250116', 'time': '080000',
+                    'status': {'description': f'Delivered {tracking_number}'},
+                    'location': {'address': {'city': 'Louisville', 'countryCode': 'US'}},
+                }]}]}]}})
+        else:
+            self._reply(404, {})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path in ('/oauth/token', '/security/v1/oauth/token'):
+            self._reply(200, {'access_token': 'stub-token', 'expires_in': 3600})
+        elif self.path == '/track/v1/trackingnumbers':
+            tracking_numbers = [
+                info['trackingNumberInfo']['trackingNumber'] for info in json.loads(body)['trackingInfo']
+            ]
+            if self._answerable(tracking_numbers):
+                self._reply(200, {'output': {'completeTrackResults': [
+                    {'trackingNumber': tracking_number, 'trackResults': [{'scanEvents': [{
+                        'date': '2025-01-16T08:00:00+00:00', 'eventDescription': f'Delivered {tracking_number}',
+                    }]}]}
+                    for tracking_number in tracking_numbers
+                ]}})
+        else:
+            self._reply(404, {})
+
+
+class TokenBucketTests(SimpleTestCase):
+    '''Test the per-courier rate limiter'''
+
+    def setUp(self):
+        self.now = 0.0
+        self.slept = []
+
+        def sleep(seconds):
+            self.slept.append(seconds)
+            self.now += seconds
+
+        self.bucket = TokenBucket(rate=2, capacity=2, clock=lambda: self.now, sleep=sleep)
+
+    def test_burst_then_rate(self):
+        '''test the burst is free and later requests are spaced at the rate'''
+        for _ in range(4):
+            self.assertTrue(self.bucket.acquire(deadline=10))
+        self.assertEqual(self.slept, [0.5, 0.5])
+
+    def test_deadline(self):
+        '''test a request that would wait past the deadline is refused without taking a token'''
+        self.assertTrue(self.bucket.acquire(deadline=0))
+        self.assertTrue(self.bucket.acquire(deadline=0))
+        self.assertFalse(self.bucket.acquire(deadline=0.1))
+        self.assertTrue(self.bucket.acquire(deadline=0.5))
+
+
+class PollScheduleTests(SimpleTestCase):
+    '''Test how often a parcel is polled, by its newest event'''
+
+    def setUp(self):
+        self.now = datetime.datetime(2025, 1, 20, 12, 0, tzinfo=datetime.timezone.utc)
+
+    def event(self, description, hours_ago):
+        return {'description': description, 'timestamp': self.now - datetime.timedelta(hours=hours_ago)}
+
+    def test_phases(self):
+        '''test out-for-delivery and exceptions beat event age, and age decides the rest'''
+        self.assertEqual(poll_phase(None, self.now), 'awaiting_pickup')
+        self.assertEqual(poll_phase(self.event('With delivery courier', 50), self.now), 'out_for_delivery')
+        self.assertEqual(poll_phase(self.event('Clearance delay', 100), self.now), 'exception')
+        self.assertEqual(poll_phase(self.event('Departed facility', 2), self.now), 'moving')
+        self.assertEqual(poll_phase(self.event('Departed facility', 30), self.now), 'slow')
+        self.assertEqual(poll_phase(self.event('Arrived at facility', 24 * 14), self.now), 'idle')
+
+    def test_next_poll_uses_the_newest_event(self):
+        '''test the schedule follows the newest event whatever order the courier sent them in'''
+        events = [self.event('Picked up', 80), self.event('Out for delivery', 1)]
+
+        self.assertEqual(next_poll_at(events, self.now), self.now + datetime.timedelta(hours=1))
+        self.assertEqual(next_poll_at([], self.now), self.now + datetime.timedelta(hours=6))
+
+
+@override_settings(
+    DHL_API_KEY='stub-key', FEDEX_API_KEY='stub-id', FEDEX_SECRET_KEY='stub-secret',
+    UPS_CLIENT_ID='stub-id', UPS_CLIENT_SECRET='stub-secret',
+)
+class RefreshParcelsTests(TestCase):
+    '''Test refreshing in-flight parcels against stub courier servers'''
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubCourierHandler)
+        self.server.calls = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        for name in ('DHL_API_BASE_URL', 'FEDEX_API_BASE_URL', 'UPS_API_BASE_URL'):
+            patcher = mock.patch(f'operation.services.{name}', base_url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.delete('fedex_access_token')
+        cache.delete('ups_access_token')
+        patcher = mock.patch.dict('operation.courier_http.COURIER_CLIENTS', {
+            key: CourierClient(key, backoff_seconds=0) for key in ('dhl', 'fedex', 'ups')
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        warehouse = Warehouse.objects.create(name='Main WH')
+        self.order = Order.objects.create(erp_order_id='8001', order_date=datetime.date(2025, 1, 15), warehouse=warehouse)
+        self.dhl = CourierCompany.objects.create(name='DHL Express', code='DHL')
+        self.fedex = CourierCompany.objects.create(name='FedEx', code='FDX')
+        self.ups = CourierCompany.objects.create(name='UPS', code='UPS')
+
+    def make_parcel(self, tracking_number, courier, status='IN_TRANSIT'):
+        return Parcel.objects.create(order=self.order, courier_company=courier, tracking_number=tracking_number, status=status)
+
+    def test_refresh_updates_parcels_and_records_run(self):
+        '''test parcels of several couriers are fetched, applied and summarised'''
+        parcels = [self.make_parcel(f'DHL{i}', self.dhl) for i in range(4)] + [
+            self.make_parcel('FDX1', self.fedex),
+            self.make_parcel('FAIL1', self.ups),
+            self.make_parcel('NOAPI1', CourierCompany.objects.create(name='Local Van', code='VAN')),
+        ]
+
+        run = refresh_in_flight_parcels()
+
+        self.assertEqual(
+            (run.parcels_selected, run.parcels_updated, run.parcels_skipped, run.parcels_failed), (7, 5, 1, 1),
+        )
+        self.assertEqual(run.errors[0]['tracking_number'], 'FAIL1')
+        self.assertEqual(TrackingRefreshRun.objects.get().trigger, 'SCHEDULED')
+        # The UPS 500 is retried before the parcel is failed.
+        self.assertEqual(
+            sorted(self.server.calls), [['DHL0', 'DHL1', 'DHL2', 'DHL3']] + [['FAIL1']] * 3 + [['FDX1']],
+        )
+        parcels[0].refresh_from_db()
+        self.assertEqual(parcels[0].status, 'DELIVERED')
+        self.assertEqual(parcels[0].tracking_logs.get().location, 'Leipzig')
+        self.assertIsNotNone(parcels[0].tracking_checked_at)
+
+    def test_parcels_are_batched_per_request(self):
+        '''test a courier's parcels go out in requests of up to its batch size'''
+        for i in range(25):
+            self.make_parcel(f'DHL{i:02}', self.dhl)
+
+        run = refresh_in_flight_parcels()
+
+        self.assertEqual(run.parcels_updated, 25)
+        self.assertEqual(sorted(len(call) for call in self.server.calls), [5, 10, 10])
+
+    def test_rate_limit_skips_parcels_past_the_deadline(self):
+        '''test a courier's requests stop at its limit and the rest are skipped, not failed'''
+        for i in range(3):
+            self.make_parcel(f'DHL{i}', self.dhl)
+
+        with mock.patch.dict('operation.tracking_refresh.TRACKING_RATE_LIMITS', {'dhl': (1, 1)}), \
+                mock.patch.dict('operation.tracking_refresh.BULK_TRACKING_CLIENTS',
+                                {'dhl': (get_dhl_tracking_details_bulk, 1)}):
+            run = refresh_in_flight_parcels(max_seconds=0)
+
+        self.assertEqual((run.parcels_updated, run.parcels_skipped, run.parcels_failed), (1, 2, 0))
+        self.assertEqual(len(self.server.calls), 1)
+        self.assertEqual(Parcel.objects.filter(tracking_checked_at__isnull=True).count(), 2)
+
+    def test_least_recently_checked_parcels_go_first(self):
+        '''test the scheduled selection starts with parcels never or longest ago checked'''
+        checked = self.make_parcel('DHL-OLD', self.dhl)
+        refresh_parcels([checked])
+        self.make_parcel('DHL-NEW', self.dhl)
+        self.make_parcel('DHL-DONE', self.dhl, status='DELIVERED')
+
+        run = refresh_in_flight_parcels(limit=1)
+
+        self.assertEqual(run.parcels_selected, 1)
+        self.assertEqual(self.server.calls, [['DHL-OLD'], ['DHL-NEW']])
+
+    def test_parcels_not_yet_due_are_left_alone(self):
+        '''test scheduled runs only poll due parcels and schedule the next poll from the newest event'''
+        now = timezone.now()
+        waiting = self.make_parcel('DHL-LATER', self.dhl)
+        due = self.make_parcel('DHL-DUE', self.dhl)
+        Parcel.objects.filter(pk=waiting.pk).update(next_poll_at=now + datetime.timedelta(hours=3))
+        Parcel.objects.filter(pk=due.pk).update(next_poll_at=now - datetime.timedelta(minutes=5))
+
+        run = refresh_in_flight_parcels()
+
+        self.assertEqual(run.parcels_selected, 1)
+        self.assertEqual(self.server.calls, [['DHL-DUE']])
+        due.refresh_from_db()
+        # The stub's only event is days old, so the parcel is idle and polled daily.
+        self.assertGreater(due.next_poll_at, now + datetime.timedelta(hours=23))
+
+
+class TransitSlaTests(TestCase):
+    '''Test flagging in-flight parcels past their courier's transit SLA'''
+
+    def setUp(self):
+        warehouse = Warehouse.objects.create(name='Main WH')
+        self.order = Order.objects.create(erp_order_id='8101', order_date=datetime.date(2025, 1, 1), warehouse=warehouse)
+        self.express = CourierCompany.objects.create(name='DHL Express', code='DHL', transit_sla_days=3)
+        self.standard = CourierCompany.objects.create(name='Local Post', code='POS')
+        self.now = timezone.now()
+
+    def make_parcel(self, courier, days_ago, status='IN_TRANSIT'):
+        return Parcel.objects.create(
+            order=self.order, courier_company=courier, tracking_number=f'T{Parcel.objects.count()}', status=status,
+            shipped_at=self.now - datetime.timedelta(days=days_ago),
+        )
+
+    def test_breaches_use_each_couriers_sla(self):
+        '''test the courier's SLA, or the default, decides which parcels are flagged, once'''
+        late_express = self.make_parcel(self.express, 4)
+        self.make_parcel(self.standard, 4)
+        late_standard = self.make_parcel(self.standard, 10)
+        self.make_parcel(self.standard, 10, status='DELIVERED')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(flag_sla_breaches(self.now), 2)
+        self.assertEqual(flag_sla_breaches(self.now + datetime.timedelta(hours=1)), 0)
+
+        self.assertEqual(
+            set(Parcel.objects.filter(sla_breached_at=self.now).values_list('pk', flat=True)),
+            {late_express.pk, late_standard.pk},
+        )
+
+    def test_parcel_never_picked_up_counts_from_creation(self):
+        '''test a labelled parcel the courier never collected is flagged from when it was created'''
+        parcel = Parcel.objects.create(
+            order=self.order, courier_company=self.express, tracking_number='T-LABEL', status='READY_TO_SHIP',
+        )
+        Parcel.objects.filter(pk=parcel.pk).update(created_at=self.now - datetime.timedelta(days=5))
+
+        self.assertEqual(flag_sla_breaches(self.now), 1)
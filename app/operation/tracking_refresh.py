@@ -0,0 +1,281 @@
+# app/operation/tracking_refresh.py
+"""
+Concurrent refresh of courier tracking for in-flight parcels.
+
+refresh_in_flight_parcels() runs on the Celery beat schedule
+(operation.tasks.refresh_parcel_tracking). 'Trace Selected' runs the same
+refresh_parcels() for the parcels a user picked. A run:
+
+- groups each courier's parcels into multi-shipment requests of up to the
+  courier's batch size (operation.services.BULK_TRACKING_CLIENTS) and sends
+  them from a bounded pool of worker threads. Each courier has its own token
+  bucket, taken once per request, so a run never sends a courier more than its
+  configured requests per second, however many workers are free;
+- applies the fetched events on the calling thread, one parcel at a time, with
+  apply_parcel_tracking_events. Worker threads never touch the database;
+- stops asking for tokens at the run's deadline. Parcels not reached by then
+  are skipped, not failed;
+- stamps Parcel.tracking_checked_at on every parcel it asked about. It also
+  sets Parcel.next_poll_at from what the newest event says and how old it
+  is: hourly while out for delivery, a few hours while the parcel moves, and
+  daily once it has gone quiet (TRACKING_POLL_INTERVALS). Scheduled runs
+  only pick parcels that are due, earliest first.
+
+Every run is recorded as a TrackingRefreshRun with its updated / skipped /
+failed counts.
+
+flag_sla_breaches() stamps Parcel.sla_breached_at on parcels that are still
+in flight past their courier's transit SLA
+(CourierCompany.transit_sla_days). It does this in one UPDATE, whatever the
+polling has reached.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Parcel, TrackingRefreshRun
+from .services import BULK_TRACKING_CLIENTS, apply_parcel_tracking_events, tracking_courier_key
+
+logger = logging.getLogger(__name__)
+
+# Parcels whose tracking can still change.
+IN_FLIGHT_PARCEL_STATUSES = ['READY_TO_SHIP', 'PICKED_UP', 'IN_TRANSIT']
+TRACKING_REFRESH_WORKERS = getattr(settings, 'TRACKING_REFRESH_WORKERS', 8)
+TRACKING_REFRESH_BATCH_SIZE = getattr(settings, 'TRACKING_REFRESH_BATCH_SIZE', 500)
+# A run stops starting requests after this long, so it ends before the next scheduled one.
+TRACKING_REFRESH_MAX_SECONDS = getattr(settings, 'TRACKING_REFRESH_MAX_SECONDS', 240)
+# (requests per second, burst) per courier API.
+TRACKING_RATE_LIMITS = getattr(settings, 'TRACKING_RATE_LIMITS', {
+    'dhl': (4, 4),
+    'fedex': (5, 5),
+    'ups': (5, 5),
+})
+# Seconds until a parcel is polled again, by its tracking phase (see poll_phase).
+TRACKING_POLL_INTERVALS = getattr(settings, 'TRACKING_POLL_INTERVALS', {
+    'out_for_delivery': 60 * 60,
+    'exception': 2 * 60 * 60,
+    'moving': 4 * 60 * 60,
+    'slow': 12 * 60 * 60,
+    'idle': 24 * 60 * 60,
+    'awaiting_pickup': 6 * 60 * 60,
+    'failed': 60 * 60,
+})
+TRACKING_DEFAULT_TRANSIT_SLA_DAYS = getattr(settings, 'TRACKING_DEFAULT_TRANSIT_SLA_DAYS', 7)
+OUT_FOR_DELIVERY_KEYWORDS = ('out for delivery', 'with delivery courier', 'on vehicle for delivery')
+EXCEPTION_KEYWORDS = ('exception', 'delay', 'attempt', 'held', 'clearance', 'incorrect address')
+MAX_RECORDED_ERRORS = 50
+
+_SKIPPED = object()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, holding at most
+    `capacity`. A caller that has to wait reserves its token first and sleeps
+    outside the lock, so waiters are served in order.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline):
+        """
+        Takes a token, waiting for it if need be.
+
+        Returns:
+            bool: False, without taking a token, if none is free now and none
+            will be before `deadline` (a value of the bucket's clock).
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait and now + wait > deadline:
+                return False
+            self._tokens -= 1
+        if wait:
+            self._sleep(wait)
+        return True
+
+
+def _fetch(parcels, courier_key, bucket, deadline):
+    try:
+        if not bucket.acquire(deadline):
+            return _SKIPPED
+        fetch_many, _ = BULK_TRACKING_CLIENTS[courier_key]
+        return fetch_many([parcel.tracking_number for parcel in parcels])
+    finally:
+        # Clients may use the cache; never leave a thread-local connection open.
+        connection.close()
+
+
+def poll_phase(latest_event, now):
+    """
+    Classifies a parcel by its newest tracking event (None if the courier has
+    none yet) into a TRACKING_POLL_INTERVALS key.
+    """
+    if latest_event is None:
+        return 'awaiting_pickup'
+    description = (latest_event.get('description') or '').lower()
+    if any(keyword in description for keyword in OUT_FOR_DELIVERY_KEYWORDS):
+        return 'out_for_delivery'
+    if any(keyword in description for keyword in EXCEPTION_KEYWORDS):
+        return 'exception'
+    timestamp = latest_event.get('timestamp')
+    if timestamp is None or now - timestamp >= timedelta(days=3):
+        return 'idle'
+    if now - timestamp >= timedelta(days=1):
+        return 'slow'
+    return 'moving'
+
+
+def next_poll_at(events, now):
+    """When to poll a parcel again, given the events just fetched for it."""
+    dated = [event for event in events if event.get('timestamp')]
+    latest_event = max(dated, key=lambda event: event['timestamp']) if dated else (events[0] if events else None)
+    return now + timedelta(seconds=TRACKING_POLL_INTERVALS[poll_phase(latest_event, now)])
+
+
+def in_flight_parcels(now=None):
+    """Parcels due a refresh, most overdue first."""
+    return (
+        Parcel.objects
+        .filter(status__in=IN_FLIGHT_PARCEL_STATUSES, tracking_number__isnull=False)
+        .filter(Q(next_poll_at__isnull=True) | Q(next_poll_at__lte=now or timezone.now()))
+        .exclude(tracking_number='')
+        .select_related('courier_company')
+        .order_by(
+            F('next_poll_at').asc(nulls_first=True), F('tracking_checked_at').asc(nulls_first=True), 'pk',
+        )
+    )
+
+
+def refresh_parcels(parcels, trigger='SCHEDULED', max_workers=None, max_seconds=None):
+    """
+    Refreshes the tracking of `parcels` (with courier_company loaded).
+
+    Returns:
+        TrackingRefreshRun: the saved run summary.
+    """
+    parcels = list(parcels)
+    run = TrackingRefreshRun.objects.create(trigger=trigger, parcels_selected=len(parcels))
+    deadline = time.monotonic() + (TRACKING_REFRESH_MAX_SECONDS if max_seconds is None else max_seconds)
+    buckets = {key: TokenBucket(*TRACKING_RATE_LIMITS[key]) for key in BULK_TRACKING_CLIENTS}
+
+    def record_error(parcel, message):
+        run.parcels_failed += 1
+        if len(run.errors) < MAX_RECORDED_ERRORS:
+            run.errors.append({'parcel': parcel.pk, 'tracking_number': parcel.tracking_number, 'message': message})
+
+    now = timezone.now()
+    by_courier = {}
+    polled = []
+    for parcel in parcels:
+        courier_key = tracking_courier_key(parcel) if parcel.tracking_number else None
+        if courier_key is None:
+            run.parcels_skipped += 1
+            # No API to ask; keep the parcel from taking a place in every scheduled run.
+            parcel.next_poll_at = now + timedelta(seconds=TRACKING_POLL_INTERVALS['idle'])
+            polled.append(parcel)
+        else:
+            by_courier.setdefault(courier_key, []).append(parcel)
+    requests_to_send = []
+    for courier_key, courier_parcels in by_courier.items():
+        _, batch_size = BULK_TRACKING_CLIENTS[courier_key]
+        for i in range(0, len(courier_parcels), batch_size):
+            requests_to_send.append((courier_parcels[i:i + batch_size], courier_key))
+
+    with ThreadPoolExecutor(max_workers=max_workers or TRACKING_REFRESH_WORKERS) as executor:
+        futures = {
+            executor.submit(_fetch, request_parcels, courier_key, buckets[courier_key], deadline): request_parcels
+            for request_parcels, courier_key in requests_to_send
+        }
+        for future in as_completed(futures):
+            request_parcels = futures[future]
+            try:
+                events_by_number = future.result()
+            except Exception as e:
+                logger.error(f"[TrackingRefresh] Fetching {len(request_parcels)} parcels failed: {e}", exc_info=True)
+                events_by_number = {parcel.tracking_number: e for parcel in request_parcels}
+            if events_by_number is _SKIPPED:
+                run.parcels_skipped += len(request_parcels)
+                continue
+            for parcel in request_parcels:
+                parcel.tracking_checked_at = now
+                parcel.next_poll_at = now + timedelta(seconds=TRACKING_POLL_INTERVALS['failed'])
+                polled.append(parcel)
+                events = events_by_number.get(parcel.tracking_number)
+                if isinstance(events, Exception):
+                    record_error(parcel, str(events))
+                    continue
+                if events is None:
+                    record_error(parcel, "API call failed. Could not retrieve tracking events.")
+                    continue
+                parcel.next_poll_at = next_poll_at(events, now)
+                try:
+                    success, message = apply_parcel_tracking_events(parcel, events)
+                except Exception as e:
+                    logger.error(f"[TrackingRefresh] Applying events to parcel {parcel.pk} failed: {e}", exc_info=True)
+                    success, message = False, str(e)
+                if success:
+                    run.parcels_updated += 1
+                else:
+                    record_error(parcel, message)
+
+    if polled:
+        Parcel.objects.bulk_update(polled, ['tracking_checked_at', 'next_poll_at'])
+    run.finished_at = timezone.now()
+    run.save(update_fields=['parcels_updated', 'parcels_skipped', 'parcels_failed', 'errors', 'finished_at'])
+    logger.info(f"[TrackingRefresh] {run}")
+    return run
+
+
+def refresh_in_flight_parcels(limit=None, **options):
+    """Refreshes up to `limit` due in-flight parcels, most overdue first. Takes refresh_parcels' options."""
+    return refresh_parcels(in_flight_parcels()[:limit or TRACKING_REFRESH_BATCH_SIZE], **options)
+
+
+def sla_breaching_parcels(now=None):
+    """
+    In-flight parcels past their courier's transit SLA, counted from shipment
+    (or from creation for parcels the courier never picked up).
+    """
+    sla_days = Coalesce('courier_company__transit_sla_days', Value(TRACKING_DEFAULT_TRANSIT_SLA_DAYS))
+    sla_window = ExpressionWrapper(sla_days * Value(timedelta(days=1)), output_field=DurationField())
+    return (
+        Parcel.objects
+        .filter(status__in=IN_FLIGHT_PARCEL_STATUSES)
+        .alias(sla_due_at=ExpressionWrapper(
+            Coalesce('shipped_at', 'created_at') + sla_window, output_field=DateTimeField(),
+        ))
+        .filter(sla_due_at__lt=now or timezone.now())
+    )
+
+
+def flag_sla_breaches(now=None):
+    """
+    Stamps sla_breached_at on newly breaching parcels in one UPDATE.
+
+    Returns:
+        int: how many parcels were newly flagged.
+    """
+    now = now or timezone.now()
+    flagged = sla_breaching_parcels(now).filter(sla_breached_at__isnull=True).update(sla_breached_at=now)
+    if flagged:
+        logger.warning(f"[TrackingSLA] {flagged} in-flight parcels newly past their transit SLA.")
+    return flagged
@@ -12,7 +12,9 @@ app_name = 'operation'
 
 urlpatterns = [
     path('import-excel/', views.import_orders_from_excel, name='import_orders_from_excel'),
+    path('import-excel/<int:batch_pk>/confirm/', views.confirm_order_import, name='confirm_order_import'),
     path('create-orders-from-import/', views.create_orders_from_import, name='create_orders_from_import'),
+    path('import-jobs/<int:job_pk>/status/', views.order_import_job_status, name='order_import_job_status'),
 
     # The main list view now handles tabs internally
     path('list/', views.order_list, name='order_list'),
@@ -23,15 +23,10 @@ import datetime
 import calendar
 
 from decimal import Decimal, InvalidOperation
-from openpyxl import Workbook
 from collections import Counter
 from dateutil.relativedelta import relativedelta
-from fuzzywuzzy import fuzz, process
 
-import openpyxl
-import xlrd
 import json
-import pandas as pd
 
 from .forms import (
     ExcelImportForm, ParcelItemFormSet, InitialParcelItemFormSet,
@@ -51,19 +46,26 @@ from .models import (Order,
                      ParcelTrackingLog,
                      CourierInvoice,
                      CourierInvoiceItem,
-                     ProductMapping)
+                     ImportBatch,
+                     ImportRow,
+                     OrderImportJob)
 from inventory.models import (Product,
-                              InventoryBatchItem,
                               StockTransaction,
                               PackagingMaterial,
                               WarehousePackagingMaterial,
                               PackagingStockTransaction
                               )
-from warehouse.models import Warehouse, WarehouseProduct
-from inventory.services import get_suggested_batch_for_order_item
+from warehouse.models import Warehouse
+from inventory.services import available_batches_by_warehouse_product, suggest_batches_for_order_items
+from inventory.reservations import reserve_order_items
 from customers.utils import get_or_create_customer_from_import
 from customers.models import Customer
-from .services import update_parcel_tracking_from_api, parse_invoice_file
+from .services import parse_invoice_file
+from .tasks import process_order_import_job
+from .packing import pack_order, PackingError
+from .tracking_refresh import refresh_parcels
+from core.exports import Column, stream_xlsx
+from .order_status import mark_orders_dirty, flush_dirty_orders
 
 
 logger = logging.getLogger(__name__)
@@ -71,6 +73,20 @@ DEFAULT_CUSTOMER_ORDERS_TAB = "customer_orders"
 DEFAULT_PARCELS_TAB = "parcels_details"
 
 
+def _recent_order_import_jobs(user):
+    """The user's running import jobs, recently finished ones, and files still waiting for review."""
+    recent = timezone.now() - datetime.timedelta(minutes=15)
+    return (
+        OrderImportJob.objects.filter(created_by=user)
+        .filter(
+            Q(state__in=OrderImportJob.ACTIVE_STATES)
+            | Q(finished_at__gte=recent)
+            | Q(kind='STAGE', state='SUCCEEDED', batch__status='STAGED', created_at__gte=timezone.now() - datetime.timedelta(days=1))
+        )
+        .select_related('batch')[:5]
+    )
+
+
 @login_required
 def order_list(request):
     logger.debug(f"[OrderListView] Request GET params: {request.GET}")
@@ -88,6 +104,7 @@ def order_list(request):
     context = {
         'status_choices': status_choices,
         'import_form': import_form,
+        'import_jobs': _recent_order_import_jobs(user),
         'active_tab': active_tab,
         'DEFAULT_CUSTOMER_ORDERS_TAB': DEFAULT_CUSTOMER_ORDERS_TAB,
         'DEFAULT_PARCELS_TAB': DEFAULT_PARCELS_TAB,
@@ -463,11 +480,31 @@ def load_more_customer_orders(request):
 
 
 
+ORDER_IMPORT_CONFIRM_PAGE_SIZE = 100
+
+
+def _enqueue_order_import_job(job):
+    """Hands the job to a Celery worker once the surrounding transaction commits."""
+    def enqueue():
+        try:
+            process_order_import_job.delay(job.pk)
+        except Exception as e:
+            logger.error(f"Could not queue order import job {job.pk}: {e}", exc_info=True)
+            OrderImportJob.objects.filter(pk=job.pk).update(
+                state='FAILED', finished_at=timezone.now(),
+                errors=["The import could not be queued. Please try again later."],
+            )
+            ImportBatch.objects.filter(pk=job.batch_id).update(status='FAILED' if job.kind == 'STAGE' else 'STAGED')
+    transaction.on_commit(enqueue)
+
+
 @login_required
 def import_orders_from_excel(request):
     """
-    Handles the initial Excel file upload, remembers past corrections,
-    and shows a confirmation modal for new or uncertain matches.
+    Handles the initial Excel file upload. The file is stored and read by a
+    background job, which stages its rows with learned or fuzzy product
+    suggestions; the order list page shows its progress and links to the
+    paginated confirmation page once it is ready.
     """
     if request.method != 'POST':
         return redirect('operation:order_list')
@@ -478,235 +515,161 @@ def import_orders_from_excel(request):
         return redirect('operation:order_list')
 
     excel_file = request.FILES['excel_file']
+    if not excel_file.name.lower().endswith(('.xlsx', '.xls')):
+        messages.error(request, "Unsupported file format. Please use .xlsx or .xls.")
+        return redirect('operation:order_list')
 
-    try:
-        # --- 1. Load Excel File and Get Iterator ---
-        if excel_file.name.lower().endswith('.xlsx'):
-            workbook = openpyxl.load_workbook(excel_file, data_only=True)
-            sheet = workbook.active
-            rows_iterator = sheet.iter_rows(min_row=1, values_only=True)
-        elif excel_file.name.lower().endswith('.xls'):
-            file_contents = excel_file.read()
-            workbook = xlrd.open_workbook(file_contents=file_contents)
-            sheet = workbook.sheet_by_index(0)
-            rows_iterator = (sheet.row_values(r) for r in range(sheet.nrows))
-        else:
-            messages.error(request, "Unsupported file format. Please use .xlsx or .xls.")
-            return redirect('operation:order_list')
-
-        headers = [str(h).strip() if h is not None else '' for h in next(rows_iterator)]
-
-        # --- 2. Map Headers ---
-        header_map = {
-            'Order_ID': 'Order ID', 'Order_Date': 'Order date', 'Warehouse_name': 'Warehouse name',
-            'title': 'title', 'comment': 'comment', 'Customer_Name': 'Address name', 'company': 'company',
-            'address': 'address', 'country': 'country', 'city': 'city', 'state': 'state',
-            'zip': 'zip', 'phone': 'phone', 'Vat_number': 'Vat number',
-            'Product_Name': 'Product name', 'Quantity': 'Product quantity', 'isCold': 'isCold'
-        }
-
-        index_map = {key: headers.index(value) for key, value in header_map.items() if value in headers}
-
-        missing = [v for k, v in header_map.items() if k in ['Order_ID', 'Product_Name', 'Quantity'] and v not in headers]
-        if missing:
-            messages.error(request, f"Required headers not found in file: {', '.join(missing)}")
-            return redirect('operation:order_list')
-
-        # --- 3. Process Rows & Prepare for Confirmation ---
-        items_to_confirm = []
-        last_order_details = {}
+    with transaction.atomic():
+        batch = ImportBatch.objects.create(created_by=request.user, original_filename=excel_file.name[:255], status='PARSING')
+        job = OrderImportJob.objects.create(batch=batch, kind='STAGE', source_file=excel_file, created_by=request.user)
+        _enqueue_order_import_job(job)
 
-        for row_idx, row_values in enumerate(rows_iterator, start=2):
-            if not any(c is not None and str(c).strip() for c in row_values):
-                continue
+    messages.info(request, f"'{excel_file.name}' is being read in the background. You can review the product matches once it is ready.")
+    return redirect('operation:order_list')
 
-            row_dict = {key: row_values[idx] if idx < len(row_values) else None for key, idx in index_map.items()}
 
-            # Clean Order ID
-            order_id_raw = row_dict.get('Order_ID')
-            if order_id_raw:
-                try:
-                    row_dict['Order_ID'] = str(int(float(order_id_raw)))
-                except (ValueError, TypeError):
-                    row_dict['Order_ID'] = str(order_id_raw).strip()
+@login_required
+def confirm_order_import(request, batch_pk):
+    """
+    Shows one page of a staged import's rows for the user who uploaded it to
+    confirm or correct the suggested products.
+    """
+    batch = get_object_or_404(ImportBatch, pk=batch_pk, status='STAGED', created_by=request.user)
+    paginator = Paginator(batch.rows.order_by('row_index'), ORDER_IMPORT_CONFIRM_PAGE_SIZE)
+    try:
+        rows_page = paginator.page(request.GET.get('page', 1))
+    except PageNotAnInteger:
+        rows_page = paginator.page(1)
+    except EmptyPage:
+        rows_page = paginator.page(paginator.num_pages)
 
-            # Clean Company Name
-            company_raw = row_dict.get('company')
-            row_dict['company'] = str(company_raw).strip() if company_raw and pd.notna(company_raw) else '-'
+    return render(request, 'operation/import_orders_from_excel.html', {
+        'show_confirmation_modal': True,
+        'import_batch': batch,
+        'rows_page': rows_page,
+        'all_products': Product.objects.all(),
+    })
 
 
-            if not row_dict.get('Order_ID'):
-                row_dict.update({k: v for k, v in last_order_details.items() if k not in ['Product_Name', 'Quantity', 'isCold']})
-            else:
-                last_order_details = row_dict.copy()
-
-            if not all([row_dict.get('Order_ID'), row_dict.get('Product_Name'), row_dict.get('Quantity')]):
+def _save_import_selections(request, batch):
+    """Stores the products chosen on the submitted confirmation page."""
+    selections = {}
+    for key, value in request.POST.items():
+        if key.startswith('product_selection_') and value:
+            try:
+                selections[int(key[len('product_selection_'):])] = int(value)
+            except ValueError:
                 continue
-
-            items_to_confirm.append(row_dict)
-
-        if not items_to_confirm:
-            messages.warning(request, "No valid order items could be parsed from the file.")
-            return redirect('operation:order_list')
-
-        # --- 4. Perform Matching ("Remember" Logic) ---
-        all_products = list(Product.objects.all())
-        product_choices = {p.name: p.id for p in all_products}
-        learned_mappings = {mapping.imported_name: mapping.mapped_product_id for mapping in ProductMapping.objects.all()}
-
-        for item in items_to_confirm:
-            name_to_match = str(item.get('Product_Name', '')).strip()
-            item['suggested_product_id'] = None
-            item['similarity_score'] = 0
-
-            # Prioritize learned mappings
-            if name_to_match in learned_mappings:
-                item['suggested_product_id'] = learned_mappings[name_to_match]
-                item['similarity_score'] = 100 # Perfect score for a learned match
-            elif name_to_match:
-                # Fallback to fuzzy matching
-                match = process.extractOne(name_to_match, product_choices.keys(), scorer=fuzz.ratio)
-                if match and match[1] >= 60:
-                    item['suggested_product_id'] = product_choices[match[0]]
-                    item['similarity_score'] = match[1]
-
-        # --- 5. Render Confirmation Modal ---
-        request.session['imported_data'] = items_to_confirm
-        return render(request, 'operation/import_orders_from_excel.html', {
-            'show_confirmation_modal': True,
-            'items_to_confirm': items_to_confirm,
-            'all_products': all_products,
-        })
-
-    except Exception as e:
-        logger.error(f"Error during Excel import: {e}", exc_info=True)
-        messages.error(request, f"An unexpected error occurred: {e}")
-        return redirect('operation:order_list')
+    if not selections:
+        return
+    rows = list(batch.rows.filter(pk__in=selections.keys()).only('pk', 'confirmed_product_id'))
+    for row in rows:
+        row.confirmed_product_id = selections[row.pk]
+    ImportRow.objects.bulk_update(rows, ['confirmed_product'], batch_size=ORDER_IMPORT_CONFIRM_PAGE_SIZE)
 
 
 @login_required
-@transaction.atomic
 def create_orders_from_import(request):
     """
-    Creates orders from the session data and "learns" any product
-    corrections made by the user.
+    Saves the product choices from a confirmation page. On final confirmation,
+    queues a COMMIT job that "learns" any product corrections made by the user
+    and creates the orders from the staged rows (see
+    operation.order_import.run_order_import_job).
     """
     if request.method != 'POST':
         return redirect('operation:import_orders_from_excel')
 
-    imported_data = request.session.get('imported_data')
-    if not imported_data:
+    batch = ImportBatch.objects.filter(
+        pk=request.POST.get('batch_id') or None, status='STAGED', created_by=request.user,
+    ).first()
+    if not batch:
         messages.error(request, "Import session has expired. Please re-upload your file.")
         return redirect('operation:import_orders_from_excel')
 
-    # --- START: "Learn" from User Corrections ---
-    for i, item_row in enumerate(imported_data):
-        product_id_str = request.POST.get(f'product_selection_{i}')
-        if not product_id_str:
-            messages.error(request, f"A product was not selected for '{item_row.get('Product_Name')}'.")
-            return redirect('operation:import_orders_from_excel')
-
-        confirmed_product_id = int(product_id_str)
-        item_row['confirmed_product_id'] = confirmed_product_id
-
-        imported_name = str(item_row.get('Product_Name', '')).strip()
-        if imported_name:
-            ProductMapping.objects.update_or_create(
-                imported_name=imported_name,
-                defaults={'mapped_product_id': confirmed_product_id}
-            )
-            logger.info(f"Learned/updated mapping: '{imported_name}' -> Product ID {confirmed_product_id}")
-    # --- END: "Learn" from User Corrections ---
-
-    # Group items by Order ID
-    orders_to_process = {}
-    for item in imported_data:
-        order_id = str(item.get('Order_ID'))
-        if order_id not in orders_to_process:
-            orders_to_process[order_id] = []
-        orders_to_process[order_id].append(item)
-
-    # Final database creation loop
-    for order_id, items in orders_to_process.items():
-        first_item = items[0]
-
-        # --- Validate and Get Warehouse ---
-        warehouse_name = first_item.get('Warehouse_name')
-        if pd.isna(warehouse_name) or not warehouse_name:
-            messages.error(request, f"Import failed: 'Warehouse name' is missing for order {order_id}.")
-            raise transaction.TransactionManagementError("Rolling back due to missing warehouse name.")
-        try:
-            warehouse = Warehouse.objects.get(name__iexact=str(warehouse_name))
-        except Warehouse.DoesNotExist:
-            messages.error(request, f"Import failed: Warehouse '{warehouse_name}' not found for order {order_id}.")
-            raise transaction.TransactionManagementError("Rolling back due to non-existent warehouse.")
-
-        # --- Robust Customer Lookup ---
-        customer = None
-        phone_number_raw = first_item.get('phone')
-        phone_number_clean = None
-        if phone_number_raw and pd.notna(phone_number_raw):
-            try:
-                phone_number_clean = str(int(float(phone_number_raw)))
-            except (ValueError, TypeError):
-                pass
-        if phone_number_clean:
-            customer = Customer.objects.filter(phone_number=phone_number_clean).first()
-        if not customer:
-            customer, _ = Customer.objects.get_or_create(
-                customer_name=first_item.get('Customer_Name', ''),
-                defaults={
-                    'email': first_item.get('email') if pd.notna(first_item.get('email')) else None,
-                    'company_name': first_item.get('company', ''), 'phone_number': phone_number_clean,
-                    'address_line1': first_item.get('address'), 'city': first_item.get('city'),
-                    'state': first_item.get('state'), 'zip_code': first_item.get('zip'),
-                    'country': first_item.get('country'), 'vat_number': first_item.get('Vat_number')
-                }
-            )
+    _save_import_selections(request, batch)
 
-        # --- Create or Update Order ---
-        order_date = pd.to_datetime(first_item.get('Order_Date'), errors='coerce').date() or timezone.now().date()
-        order, created = Order.objects.update_or_create(
-            erp_order_id=order_id,
-            defaults={
-                'customer': customer, 'order_date': order_date, 'warehouse': warehouse,
-                'title_notes': first_item.get('title'), 'shipping_notes': first_item.get('comment'),
-                'status': 'NEW_ORDER', 'imported_by': request.user
-            }
-        )
-        if not created:
-            order.items.all().delete()
-
-        # --- Create Order Items ---
-        order_is_cold = False
-        for item_data in items:
-            product = Product.objects.get(id=item_data['confirmed_product_id'])
-            warehouse_product, _ = WarehouseProduct.objects.get_or_create(
-                warehouse=warehouse, product=product, defaults={'quantity': 0}
-            )
-            OrderItem.objects.create(
-                order=order, product=product, warehouse_product=warehouse_product,
-                quantity_ordered=int(item_data.get('Quantity', 0))
-            )
-            if str(item_data.get('isCold')).lower() in ['yes', 'true', '1']:
-                order_is_cold = True
+    # Previous/next page buttons only save the current page.
+    target_page = request.POST.get('goto_page')
+    if target_page:
+        return redirect(f"{reverse('operation:confirm_order_import', args=[batch.pk])}?page={target_page}")
+
+    unresolved = batch.rows.filter(confirmed_product__isnull=True, suggested_product__isnull=True).first()
+    if unresolved:
+        messages.error(request, f"A product was not selected for '{unresolved.data.get('Product_Name')}'.")
+        page = unresolved.row_index // ORDER_IMPORT_CONFIRM_PAGE_SIZE + 1
+        return redirect(f"{reverse('operation:confirm_order_import', args=[batch.pk])}?page={page}")
 
-        if order_is_cold:
-            order.is_cold_chain = True
-            order.save()
+    # Learning from the user's corrections and creating the orders run in the background.
+    with transaction.atomic():
+        if not ImportBatch.objects.filter(pk=batch.pk, status='STAGED').update(status='COMMITTING'):
+            messages.warning(request, "This import is already being processed.")
+            return redirect('operation:order_list')
+        job = OrderImportJob.objects.create(batch=batch, kind='COMMIT', created_by=request.user)
+        _enqueue_order_import_job(job)
 
-    # Clean up and redirect
-    if 'imported_data' in request.session:
-        del request.session['imported_data']
-    messages.success(request, f"{len(orders_to_process)} orders have been successfully imported or updated.")
+    messages.info(request, f"Creating orders from '{batch.original_filename}' in the background.")
     return redirect('operation:order_list')
 
 
+def _order_import_job_payload(job):
+    payload = {
+        'id': job.pk,
+        'kind': job.kind,
+        'kind_display': job.get_kind_display(),
+        'state': job.state,
+        'state_display': job.get_state_display(),
+        'is_active': job.is_active,
+        'filename': job.batch.original_filename,
+        'rows_total': job.rows_total,
+        'rows_processed': job.rows_processed,
+        'progress_percent': job.progress_percent,
+        'orders_created': job.orders_created,
+        'orders_updated': job.orders_updated,
+        'error_count': len(job.errors),
+        'errors': job.errors[:20],
+        'review_url': None,
+    }
+    if job.kind == 'STAGE' and job.state == 'SUCCEEDED' and job.batch.status == 'STAGED':
+        payload['review_url'] = reverse('operation:confirm_order_import', args=[job.batch_id])
+    return payload
+
+
+@login_required
+def order_import_job_status(request, job_pk):
+    """
+    Lightweight JSON progress of one of the user's order import jobs, polled
+    by the order list page.
+    """
+    job = get_object_or_404(OrderImportJob.objects.select_related('batch'), pk=job_pk, created_by=request.user)
+    return JsonResponse(_order_import_job_payload(job))
+
+
+def _batch_option(batch):
+    """One entry of a packing row's batch dropdown."""
+    priority_label = ""
+    if batch.pick_priority == 0: priority_label = " [Default]"
+    elif batch.pick_priority == 1: priority_label = " [Secondary]"
+
+    location_display = f"[{batch.location_label}]" if batch.location_label else "NoLoc"
+    batch_display = f"Batch: {batch.batch_number}" if batch.batch_number else "NoBatch"
+    expiry_display = f"Exp: {batch.expiry_date.strftime('%d/%m/%y')}" if batch.expiry_date else "NoExp"
+    qty_display = f"Qty: {batch.quantity}"
+
+    return {
+        'id': batch.pk,
+        'display_name': f"{location_display} | {batch_display} | {expiry_display} | {qty_display}{priority_label}",
+        'quantity_available': batch.quantity,
+        'pick_priority': batch.pick_priority # Send pick_priority for potential JS logic
+    }
+
+
 @login_required
 def get_order_items_for_packing(request, order_pk):
     """
     Gets all data needed to populate the 'Pack Order' modal.
     This version uses a more robust method to count parcels for the courier dashboard.
+    Batch suggestions and every item's batch dropdown options ('batch_options',
+    keyed by order item id) come from a single batch query for the whole order.
     """
     try:
         order = get_object_or_404(
@@ -724,27 +687,37 @@ def get_order_items_for_packing(request, order_pk):
         if not request.user.is_superuser and (not request.user.warehouse or order.warehouse != request.user.warehouse):
             return JsonResponse({'success': False, 'message': 'Permission denied for this order.'}, status=403)
 
-        initial_form_data = []
+        quantities_to_pack = {}
         for item in order.items.all():
             total_removed_for_this_item = order.get_total_removed_quantity_for_item(item.id)
             quantity_remaining_to_pack_for_this_item = item.quantity_ordered - item.quantity_packed - total_removed_for_this_item
-
             if quantity_remaining_to_pack_for_this_item > 0:
-                best_suggested_batch = get_suggested_batch_for_order_item(item, quantity_remaining_to_pack_for_this_item)
-
-                # ++ MODIFICATION: Get the warehouse_product to access shipping limits ++
-                wp = item.warehouse_product
-
-                initial_form_data.append({
-                    'order_item_id': item.pk,
-                    'product_name': item.product.name if item.product else item.erp_product_name,
-                    'sku': item.product.sku if item.product else "N/A",
-                    'quantity_to_pack': quantity_remaining_to_pack_for_this_item,
-                    'selected_batch_item_id': best_suggested_batch.pk if best_suggested_batch else None,
-                    # ++ ADDED: Pass the shipping quantity limits to the form's initial data ++
-                    'max_ship_qty_a': wp.max_ship_qty_a if wp else None,
-                    'max_ship_qty_b': wp.max_ship_qty_b if wp else None,
-                })
+                quantities_to_pack[item] = quantity_remaining_to_pack_for_this_item
+
+        # One batch query for the whole order: suggestions and the dropdown options for every item.
+        suggested_batches, batches_by_wp = suggest_batches_for_order_items(quantities_to_pack)
+        batch_options = {
+            item.pk: [_batch_option(batch) for batch in batches_by_wp.get(item.warehouse_product_id, [])]
+            for item in quantities_to_pack
+        }
+
+        initial_form_data = []
+        for item, quantity_remaining_to_pack_for_this_item in quantities_to_pack.items():
+            best_suggested_batch = suggested_batches[item.pk]
+
+            # ++ MODIFICATION: Get the warehouse_product to access shipping limits ++
+            wp = item.warehouse_product
+
+            initial_form_data.append({
+                'order_item_id': item.pk,
+                'product_name': item.product.name if item.product else item.erp_product_name,
+                'sku': item.product.sku if item.product else "N/A",
+                'quantity_to_pack': quantity_remaining_to_pack_for_this_item,
+                'selected_batch_item_id': best_suggested_batch.pk if best_suggested_batch else None,
+                # ++ ADDED: Pass the shipping quantity limits to the form's initial data ++
+                'max_ship_qty_a': wp.max_ship_qty_a if wp else None,
+                'max_ship_qty_b': wp.max_ship_qty_b if wp else None,
+            })
 
         formset_html_content = ""
         message_for_modal = ""
@@ -803,7 +776,8 @@ def get_order_items_for_packing(request, order_pk):
             'is_cold_chain': order.is_cold_chain,
             'daily_courier_counts_object': final_daily_courier_counts,
             'available_couriers': courier_list_for_modal,
-            'available_packaging': available_packaging
+            'available_packaging': available_packaging,
+            'batch_options': batch_options,
         })
 
     except Http404:
@@ -816,12 +790,11 @@ def get_order_items_for_packing(request, order_pk):
 
 @login_required
 @require_POST # Ensures this view only accepts POST requests
-@transaction.atomic # Ensures all database operations are atomic
 def process_packing_for_order(request, order_pk):
     """
     Processes the packing form submission to create a new Parcel.
-    This version is redesigned to handle a single OrderItem being packed
-    from MULTIPLE inventory batches within the same parcel.
+    A single OrderItem may be packed from MULTIPLE inventory batches within
+    the same parcel; the work itself is done by operation.packing.pack_order.
     """
     order = get_object_or_404(Order.objects.select_related('warehouse'), pk=order_pk)
 
@@ -851,9 +824,8 @@ def process_packing_for_order(request, order_pk):
         packaging_type = get_object_or_404(PackagingType, pk=packaging_id)
         parcel_notes = request.POST.get('parcel-notes', order.shipping_notes or '')
 
-        # 3. Aggregate and Pre-validate Item Data from Formset
-        items_to_pack_grouped = {}
-        batch_pack_requests = {}
+        # 3. Collect the (order item, batch, quantity) lines from the formset
+        pack_lines = []
         total_forms = int(request.POST.get('packitems-TOTAL_FORMS', 0))
 
         logger.info(f"Found 'packitems-TOTAL_FORMS': {total_forms}. Looping through forms...")
@@ -861,183 +833,40 @@ def process_packing_for_order(request, order_pk):
         for i in range(total_forms):
             prefix = f'packitems-{i}-'
 
-            # Use .get() to avoid errors if a field is missing for some reason
             quantity_str = request.POST.get(f'{prefix}quantity_to_pack', '0')
             order_item_id = request.POST.get(f'{prefix}order_item_id')
-            # IMPORTANT: The name of your batch select might be different!
-            # I am using `selected_batch_item_id` based on previous context.
-            # Double-check this name in your HTML template.
             batch_id_str = request.POST.get(f'{prefix}selected_batch_item_id')
 
-            logger.info(f"--- Processing Form Index {i} ('{prefix}') ---")
-            logger.info(f"  Extracted quantity_to_pack: '{quantity_str}'")
-            logger.info(f"  Extracted order_item_id: '{order_item_id}'")
-            logger.info(f"  Extracted selected_batch_item_id: '{batch_id_str}'")
-
             try:
                 quantity_to_pack = int(quantity_str)
                 if quantity_to_pack <= 0:
-                    logger.info("  Quantity is 0 or less, skipping this form.")
                     continue
             except (ValueError, TypeError):
                 logger.warning(f"  Could not parse quantity '{quantity_str}' to an integer. Skipping.")
                 continue
 
             if not order_item_id or not batch_id_str:
-                logger.warning("  Missing order_item_id or batch_id_str. Skipping.")
+                logger.warning(f"  Form {i}: missing order_item_id or selected_batch_item_id. Skipping.")
                 continue
 
-            batch_id = int(batch_id_str)
-
-            # Aggregate total quantity requested per batch
-            batch_pack_requests[batch_id] = batch_pack_requests.get(batch_id, 0) + quantity_to_pack
-
-            # Group items for creating ParcelItem objects later
-            if order_item_id not in items_to_pack_grouped:
-                items_to_pack_grouped[order_item_id] = {
-                    'order_item_obj': get_object_or_404(OrderItem, pk=order_item_id, order=order),
-                    'total_quantity_to_pack': 0,
-                    'packs_from_batches': []
-                }
-
-            items_to_pack_grouped[order_item_id]['packs_from_batches'].append({
-                'batch_id': batch_id,
-                'quantity': quantity_to_pack
+            pack_lines.append({
+                'order_item_id': int(order_item_id),
+                'batch_id': int(batch_id_str),
+                'quantity': quantity_to_pack,
             })
-            items_to_pack_grouped[order_item_id]['total_quantity_to_pack'] += quantity_to_pack
-
-        # =========================================================================
-        # START: AGGREGATION LOGGING
-        # =========================================================================
-        logger.info("--- AGGREGATION RESULTS ---")
-        logger.info(f"Final `batch_pack_requests` dictionary: {batch_pack_requests}")
-        logger.info(f"Final `items_to_pack_grouped` dictionary: {items_to_pack_grouped}")
-        logger.info("---------------------------")
-        # =========================================================================
-
-        if not items_to_pack_grouped:
-            logger.error("Validation failed: No items with a quantity to pack were found after processing.")
-            return JsonResponse({'success': False, 'message': 'No items were submitted with a quantity to pack.'}, status=400)
-
-        # 4. Comprehensive Stock Validation (Post-Aggregation)
-        logger.info("--- PERFORMING STOCK VALIDATION ---")
-        for batch_id, requested_qty in batch_pack_requests.items():
-            batch_item = get_object_or_404(InventoryBatchItem, pk=batch_id)
-            logger.info(f"  Validating Batch ID {batch_id} ('{batch_item.batch_number}'): Requested {requested_qty}, Available {batch_item.quantity}")
-            if requested_qty > batch_item.quantity:
-                sku = batch_item.warehouse_product.product.sku
-                error_msg = f"Not enough stock for {sku} in batch {batch_item.batch_number}. Requested: {requested_qty}, Available: {batch_item.quantity}"
-                logger.error(f"  STOCK VALIDATION FAILED: {error_msg}")
-                return JsonResponse({'success': False, 'message': error_msg}, status=400)
-        logger.info("--- STOCK VALIDATION PASSED ---")
-
-        for data in items_to_pack_grouped.values():
-            order_item = data['order_item_obj']
-            total_packed = data['total_quantity_to_pack']
-            total_removed_for_item = order.get_total_removed_quantity_for_item(order_item.id)
-            quantity_remaining_on_order = (order_item.quantity_ordered - total_removed_for_item) - order_item.quantity_packed
-
-            if total_packed > quantity_remaining_on_order:
-                sku = order_item.product.sku
-                return JsonResponse({'success': False, 'message': f"Cannot pack a total of {total_packed} for {sku}. Only {quantity_remaining_on_order} are remaining on the order."}, status=400)
-
-        # 5. Create the Parcel
-        new_parcel = Parcel.objects.create(
-            order=order,
-            created_by=request.user,
-            notes=parcel_notes,
-            courier_company=courier_instance,
-            packaging_type=packaging_type
-        )
-        logger.info(f"Parcel {new_parcel.pk} created for order {order_pk}.")
-
-        # 6. Create ParcelItems and Update Stock
-        for data in items_to_pack_grouped.values():
-            order_item_obj = data['order_item_obj']
-
-            for pack_info in data['packs_from_batches']:
-                batch = get_object_or_404(InventoryBatchItem, pk=pack_info['batch_id'])
-                qty = pack_info['quantity']
-
-                ParcelItem.objects.create(
-                    parcel=new_parcel,
-                    order_item=order_item_obj,
-                    quantity_shipped_in_this_parcel=qty,
-                    shipped_from_batch=batch
-                )
-
-                # Deduct stock from both the specific batch AND the parent WarehouseProduct
-                batch.quantity = F('quantity') - qty
-                batch.save(update_fields=['quantity'])
-
-                if batch.warehouse_product:
-                    warehouse_product = batch.warehouse_product
-                    warehouse_product.quantity = F('quantity') - qty
-                    warehouse_product.save(update_fields=['quantity'])
-
-                StockTransaction.objects.create(
-                    warehouse=batch.warehouse_product.warehouse,
-                    transaction_type=StockTransaction.TransactionTypes.SALE_PACKED_OUT,
-                    warehouse_product=batch.warehouse_product,
-                    product=batch.warehouse_product.product,
-                    batch_item_involved=batch,
-                    quantity=-qty,
-                    reference_note=f"LWA Order {order.erp_order_id}, Parcel {new_parcel.parcel_code_system}, Batch {batch.batch_number}",
-                    related_order=order,
-                    recorded_by=request.user
-                )
 
-        # 6b. Deduct Packaging Material Stock
-        packaging_components = packaging_type.packagingtypematerialcomponent_set.select_related('packaging_material')
-        # First, validate all materials before making any changes
-        for component in packaging_components:
-            material_to_check = component.packaging_material
-            quantity_needed = component.quantity
-
-            try:
-                # Query the WAREHOUSE-SPECIFIC stock model
-                warehouse_stock = WarehousePackagingMaterial.objects.get(
-                    packaging_material=material_to_check,
-                    warehouse=order.warehouse
-                )
-
-                logger.info(f"  Validating stock for '{material_to_check.name}': Needed {quantity_needed}, Available {warehouse_stock.current_stock}")
-                if warehouse_stock.current_stock < quantity_needed:
-                    error_msg = f"Insufficient stock for packaging material: '{material_to_check.name}'. Required: {quantity_needed}, Available: {warehouse_stock.current_stock}"
-                    logger.error(f"  PACKAGING STOCK VALIDATION FAILED: {error_msg}")
-                    return JsonResponse({'success': False, 'message': error_msg}, status=400)
-
-            except WarehousePackagingMaterial.DoesNotExist:
-                error_msg = f"Stock for packaging material '{material_to_check.name}' is not configured in warehouse '{order.warehouse.name}'."
-                logger.error(f"  PACKAGING STOCK VALIDATION FAILED: {error_msg}")
-                return JsonResponse({'success': False, 'message': error_msg}, status=400)
-
-        for component in packaging_components:
-            warehouse_stock = WarehousePackagingMaterial.objects.get(
-                packaging_material=component.packaging_material,
-                warehouse=order.warehouse
-            )
-            quantity_to_deduct = component.quantity
-
-            # 1. Update the main stock level
-            warehouse_stock.current_stock = F('current_stock') - quantity_to_deduct
-            warehouse_stock.save(update_fields=['current_stock'])
-
-            # 2. Create the historical USAGE transaction record
-            PackagingStockTransaction.objects.create(
-                warehouse_packaging_material=warehouse_stock,
-                transaction_type=PackagingStockTransaction.TransactionTypes.STOCK_OUT,
-                quantity=-quantity_to_deduct, # Log usage as a negative number
-                related_parcel=new_parcel,
-                notes=f"Used for Parcel {new_parcel.parcel_code_system}",
-                recorded_by=request.user
+        # 4. Validate, lock stock and create the parcel in one pass
+        try:
+            new_parcel = pack_order(
+                order, pack_lines,
+                courier_company=courier_instance,
+                packaging_type=packaging_type,
+                user=request.user,
+                notes=parcel_notes,
             )
-            logger.info(f"  Deducted and logged {quantity_to_deduct} of '{component.packaging_material.name}' for Parcel {new_parcel.pk}.")
-
-
-
-        # 7. Update Order Status
-        order.update_status_based_on_items_and_parcels()
+        except PackingError as e:
+            logger.error(f"Packing validation failed for order {order.erp_order_id}: {e}")
+            return JsonResponse({'success': False, 'message': str(e)}, status=400)
 
         messages.success(request, f"Parcel {new_parcel.parcel_code_system} created successfully for order {order.erp_order_id}.")
         return JsonResponse({
@@ -1070,45 +899,8 @@ def get_available_batches_for_order_item(request, order_item_pk):
             return JsonResponse({'success': True, 'batches': [], 'message': 'Order item is not linked to a specific warehouse product.'})
 
         warehouse_product_for_item = order_item.warehouse_product
-        today = timezone.now().date()
-
-        logger.info(f"Fetching batches for WP: {warehouse_product_for_item.id} (Product: {warehouse_product_for_item.product.sku}), Criteria: Qty > 0, Not Expired (Today: {today})")
-
-        # Query for available batches
-        batches_qs = InventoryBatchItem.objects.filter(
-            warehouse_product=warehouse_product_for_item,
-            quantity__gt=0 # Only batches with stock
-        ).exclude(
-            expiry_date__isnull=False, expiry_date__lt=today # Exclude expired batches
-        ).order_by(
-            F('pick_priority').asc(nulls_last=True), # Default/Secondary picks first
-            F('expiry_date').asc(nulls_last=True),   # Then FEFO (First-Expiry, First-Out)
-            'date_received'                          # Then by received date as a tie-breaker
-        )
-
-        logger.info(f"Found {batches_qs.count()} total batches matching quantity/expiry for WP {warehouse_product_for_item.id} before serialization for OI {order_item.pk}.")
-
-
-        batches_data = []
-        for batch in batches_qs:
-            priority_label = ""
-            if batch.pick_priority == 0: priority_label = " [Default]"
-            elif batch.pick_priority == 1: priority_label = " [Secondary]"
-
-            location_display = f"[{batch.location_label}]" if batch.location_label else "NoLoc"
-            batch_display = f"Batch: {batch.batch_number}" if batch.batch_number else "NoBatch" # Ensure batch_number is shown
-            expiry_display = f"Exp: {batch.expiry_date.strftime('%d/%m/%y')}" if batch.expiry_date else "NoExp"
-            qty_display = f"Qty: {batch.quantity}"
-
-            batch_data_entry = {
-                'id': batch.pk,
-                'display_name': f"{location_display} | {batch_display} | {expiry_display} | {qty_display}{priority_label}",
-                'quantity_available': batch.quantity,
-                'pick_priority': batch.pick_priority # Send pick_priority for potential JS logic
-            }
-            batches_data.append(batch_data_entry)
-            logger.debug(f"Added batch to dropdown data: ID {batch.pk}, Prio {batch.pick_priority}, Qty {batch.quantity}, Label: ...{priority_label}")
-
+        batches = available_batches_by_warehouse_product([warehouse_product_for_item.pk]).get(warehouse_product_for_item.pk, [])
+        batches_data = [_batch_option(batch) for batch in batches]
 
         if not batches_data:
             logger.info(f"No available batches were serialized for OI {order_item.pk} (WP: {warehouse_product_for_item.id}). Dropdown will indicate no batches.")
@@ -1346,11 +1138,14 @@ def process_order_item_removal(request, order_pk):
 
         if any_actual_removal:
             order.items_removed_log = removed_items_summary_for_log
-            # The order.save() will trigger update_status_based_on_items_and_parcels
-            # which now needs to consider items_removed_log.
+            # Saving the order marks it dirty; its status recomputation
+            # considers items_removed_log.
 
-        order.save() # This will call update_status_based_on_items_and_parcels
-        order.refresh_from_db() # Get the potentially updated status
+        order.save()
+        # Removed quantities no longer need stock held for them.
+        reserve_order_items(OrderItem.objects.filter(order=order).select_related('order'))
+        flush_dirty_orders() # Recompute now so the response carries the new status
+        order.refresh_from_db()
 
         messages.success(request, "Order items updated successfully. Status refreshed.")
         return JsonResponse({
@@ -1444,9 +1239,10 @@ def remove_parcel(request, parcel_pk):
         parcel.delete()
         logger.info(f"Parcel {parcel_code_system} (PK: {parcel_pk}) deleted successfully.")
 
-        order.update_status_based_on_items_and_parcels()
-        order.save()
-        logger.info(f"Order {order.erp_order_id} status updated to '{order.get_status_display()}' after parcel removal.")
+        # The unpacked quantities need stock held for them again.
+        reserve_order_items(OrderItem.objects.filter(order=order).select_related('order'))
+        mark_orders_dirty([order.pk])
+        logger.info(f"Order {order.erp_order_id} marked for status recomputation after parcel removal.")
 
         messages.success(request, f"Parcel {parcel_code_system} has been removed.")
         return JsonResponse({
@@ -2209,7 +2005,7 @@ def get_parcel_tracking_history(request, parcel_pk):
 def trace_selected_parcels(request):
     """
     Handles the 'Trace Selected' button click for bulk manual tracking updates.
-    Loops through selected parcels and calls the tracking service for each one.
+    The selected parcels are refreshed by operation.tracking_refresh.
     """
     try:
         data = json.loads(request.body)
@@ -2219,34 +2015,14 @@ def trace_selected_parcels(request):
         if not parcel_ids:
             return JsonResponse({'success': False, 'message': 'No parcels selected.'}, status=400)
 
-        parcels_to_trace = Parcel.objects.filter(id__in=parcel_ids)
-        success_count = 0
-        error_count = 0
-        status_updates = []
-
-        for parcel in parcels_to_trace:
-            try:
-                # Call the centralized service function for each parcel
-                success, message = update_parcel_tracking_from_api(parcel)
-                if success:
-                    success_count += 1
-                    # Optional: Log the specific message for each parcel
-                    logger.info(f"Tracking update for Parcel {parcel.id}: {message}")
-                    if "Status updated" in message:
-                        status_updates.append(parcel.parcel_code_system)
-                else:
-                    error_count += 1
-                    logger.warning(f"Tracking update failed for Parcel {parcel.id}: {message}")
-
-            except Exception as e:
-                # Catch any unexpected errors during the service call for a single parcel
-                logger.error(f"[TraceParcels] Unexpected error processing parcel {parcel.id}: {e}", exc_info=True)
-                error_count += 1
+        parcels_to_trace = Parcel.objects.filter(id__in=parcel_ids).select_related('courier_company')
+        # Fetched concurrently within the per-courier rate limits, as the scheduled refresh does.
+        run = refresh_parcels(parcels_to_trace, trigger='MANUAL')
 
         # --- Construct a final summary message for the user ---
-        final_message = f"Tracking update complete. Success: {success_count}, Failed: {error_count}."
-        if status_updates:
-            final_message += f" Status changed for: {', '.join(status_updates)}."
+        final_message = f"Tracking update complete. Success: {run.parcels_updated}, Failed: {run.parcels_failed}."
+        if run.parcels_skipped:
+            final_message += f" Skipped: {run.parcels_skipped} (no courier API or rate limit reached)."
 
         return JsonResponse({'success': True, 'message': final_message})
 
@@ -2887,9 +2663,6 @@ STATE_MAP = {
 }
 
 
-# Add this import at the top of your views.py file if you don't have it
-from dateutil.relativedelta import relativedelta
-
 @login_required
 def generate_report(request):
     """
@@ -2920,49 +2693,30 @@ def generate_report(request):
         parcels = Parcel.objects.filter(created_at__date__range=[start_date, end_date]).select_related(
             'order__warehouse', 'packaging_type', 'billing_item').order_by('created_at')
 
-        workbook = Workbook()
-        sheet = workbook.active
-        sheet.title = "Parcels Export"
-        headers = ["Order#", "Tracking Number", "Shipment Date", "Warehouse", "Type", "Shipment cost", "Dispute"]
-        sheet.append(headers)
-
-        for parcel in parcels:
-            shipment_charges = Decimal('0.00')
-            is_disputed = ""
-
-            # --- START: THE FIX ---
-            # The entire block accessing billing_item is now inside the try...except block.
+        def billing_item(parcel):
             try:
-                if parcel.billing_item.actual_cost is not None:
-                    shipment_charges = (parcel.billing_item.actual_cost / exchange_rate) * margin_multiplier
-                if parcel.billing_item.dispute_date:
-                    is_disputed = "Yes"
+                return parcel.billing_item
             except Parcel.billing_item.RelatedObjectDoesNotExist:
-                # This will be triggered if a parcel has no billing_item,
-                # leaving shipment_charges and is_disputed at their default values.
-                pass
-            # --- END: THE FIX ---
-
-            if parcel.packaging_type:
-                packaging_info = parcel.packaging_type.get_environment_type_display()
-            else:
-                packaging_info = "N/A"
-
-            row_data = [
-                parcel.order.erp_order_id,
-                parcel.tracking_number,
-                parcel.created_at.strftime('%Y-%m-%d'),
-                parcel.order.warehouse.name if parcel.order and parcel.order.warehouse else 'N/A',
-                packaging_info,
-                round(shipment_charges, 2),
-                is_disputed
-            ]
-            sheet.append(row_data)
-
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="parcels_report_{month_str}.xlsx"'
-        workbook.save(response)
-        return response
+                return None
+
+        def shipment_cost(parcel):
+            item = billing_item(parcel)
+            if item is None or item.actual_cost is None:
+                return round(Decimal('0.00'), 2)
+            return round((item.actual_cost / exchange_rate) * margin_multiplier, 2)
+
+        columns = [
+            Column("Order#", 'order.erp_order_id'),
+            Column("Tracking Number", 'tracking_number'),
+            Column("Shipment Date", lambda parcel: parcel.created_at.strftime('%Y-%m-%d')),
+            Column("Warehouse", 'order.warehouse.name', default='N/A'),
+            Column("Type", lambda parcel: parcel.packaging_type.get_environment_type_display() if parcel.packaging_type else "N/A"),
+            Column("Shipment cost", shipment_cost),
+            Column("Dispute", lambda parcel: "Yes" if billing_item(parcel) and billing_item(parcel).dispute_date else ""),
+            Column("Tracking Status", 'simplified_tracking_status'),
+            Column("Last Tracking Event", 'latest_event_description'),
+        ]
+        return stream_xlsx(f'parcels_report_{month_str}.xlsx', parcels, columns, sheet_title="Parcels Export")
 
     # --- GET: Handle Dashboard Display ---
     today = datetime.date.today()
@@ -24,6 +24,7 @@ from .models import (Warehouse,
                      )
 
 from inventory.models import Product, Supplier, StockTransaction # Make sure StockTransaction is imported
+from core.exports import Column, stream_xlsx
 
 logger = logging.getLogger(__name__)
 
@@ -126,20 +127,13 @@ class WarehouseProductAdmin(admin.ModelAdmin):
 
         )
         queryset = cl.get_queryset(request).select_related('warehouse', 'product', 'supplier')
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "Warehouse Products Export"
-        sheet.append(self.EXCEL_HEADERS)
-        for obj in queryset:
-            sheet.append([
-                obj.warehouse.name if obj.warehouse else '', obj.product.sku if obj.product else '',
-                obj.code if obj.code else '', obj.product.name if obj.product else '',
-                obj.quantity, obj.threshold, obj.supplier.code if obj.supplier else '',
+        columns = [
+            Column(header, value)
+            for header, value in zip(self.EXCEL_HEADERS, [
+                'warehouse.name', 'product.sku', 'code', 'product.name', 'quantity', 'threshold', 'supplier.code',
             ])
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename="warehouse_products_export.xlsx"'
-        workbook.save(response)
-        return response
+        ]
+        return stream_xlsx('warehouse_products_export.xlsx', queryset, columns, sheet_title="Warehouse Products Export")
 
     def upload_excel(self, request):
         """
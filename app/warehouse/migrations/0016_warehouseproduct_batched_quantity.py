@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0015_warehouseproduct_selling_price'),
+        ('inventory', '0025_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='warehouseproduct',
+            name='batched_quantity',
+            field=models.IntegerField(default=0, editable=False, help_text="Sum of this product's batch quantities, kept up to date by inventory/stock_ledger.py."),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE warehouse_warehouseproduct wp
+                SET batched_quantity = totals.actual
+                FROM (
+                    SELECT warehouse_product_id, SUM(quantity) AS actual
+                    FROM inventory_inventorybatchitem
+                    GROUP BY warehouse_product_id
+                ) totals
+                WHERE totals.warehouse_product_id = wp.id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -27,6 +27,10 @@ class WarehouseProduct(models.Model):
         help_text="Easy to remember, human-readable code for this product in this warehouse (e.g., WH1-PROD-001)."
     )
     quantity = models.IntegerField(default=0)
+    batched_quantity = models.IntegerField(
+        default=0, editable=False,
+        help_text="Sum of this product's batch quantities, kept up to date by inventory/stock_ledger.py."
+    )
     threshold = models.IntegerField(default=0)
     supplier = models.ForeignKey('inventory.Supplier', on_delete=models.CASCADE, null=True, blank=True) # Made supplier blankable too
     photo = models.ImageField(
@@ -87,6 +91,12 @@ class WarehouseProduct(models.Model):
         # if self.code == "":
         #     self.code = None
 
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # batched_quantity is moved by deltas from batch changes; never write back a stale in-memory copy.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'batched_quantity'
+            ]
         super().save(*args, **kwargs)
 
 